@@ -0,0 +1,20 @@
+# core/API_URLs/async_urls.py
+from django.urls import path
+from core.API_Views import async_views
+
+urlpatterns = [
+    # Endpoint: GET /api/async/feed/?page={}&page_size={}
+    path('api/async/feed/', async_views.user_feed, name='async-user-feed'),
+
+    # Endpoint: GET /api/async/explore/posts/?page={}&page_size={}
+    path('api/async/explore/posts/', async_views.explore_page, name='async-explore-page'),
+
+    # Endpoint: GET /api/async/notifications/?page={}&page_size={}
+    path('api/async/notifications/', async_views.notifications, name='async-get-notifications'),
+
+    # Endpoint: GET /api/async/messages/conversation/{user_id}/?page={}&page_size={}
+    path('api/async/messages/conversation/<int:user_id>/', async_views.conversation, name='async-get-conversation'),
+
+    # Endpoint: GET /api/async/user/profile/{user_id}/?page={}&page_size={}
+    path('api/async/user/profile/<int:user_id>/', async_views.user_profile, name='async-user-profile'),
+]
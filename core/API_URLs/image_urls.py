@@ -0,0 +1,11 @@
+# core/API_URLs/image_urls.py
+from django.urls import path
+from core.API_Views import image_views
+
+urlpatterns = [
+    # Endpoint: GET /api/images/posts/{post_id}/?w={width}&fmt={webp|jpeg}
+    path('api/images/posts/<int:post_id>/', image_views.resized_post_media, name='resized-post-media'),
+
+    # Endpoint: GET /api/images/users/{user_id}/?w={width}&fmt={webp|jpeg}
+    path('api/images/users/<int:user_id>/', image_views.resized_profile_picture, name='resized-profile-picture'),
+]
@@ -14,4 +14,7 @@ urlpatterns = [
 
     # Endpoint: GET /api/messages/conversation-partners/?username={}&page={}&page_size={}
     path('api/messages/conversation-partners/', message_views.ConversationPartnerListView.as_view(), name='get-conversation-partners'),
+
+    # Endpoint: GET /api/messages/search/?q={}&user_id={}&cursor={}&page_size={}
+    path('api/messages/search/', message_views.MessageSearchView.as_view(), name='search-messages'),
 ]
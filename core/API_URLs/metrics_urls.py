@@ -0,0 +1,8 @@
+# core/API_URLs/metrics_urls.py
+from django.urls import path
+from core.API_Views import metrics_views
+
+urlpatterns = [
+    # Endpoint: GET /api/metrics/
+    path('api/metrics/', metrics_views.process_metrics, name='process-metrics'),
+]
@@ -0,0 +1,8 @@
+# core/API_URLs/presence_urls.py
+from django.urls import path
+from core.API_Views import presence_views
+
+urlpatterns = [
+    # Endpoint: GET /api/presence/?user_ids={},{},{}
+    path('api/presence/', presence_views.bulk_presence, name='bulk-presence'),
+]
@@ -0,0 +1,8 @@
+# core/API_URLs/suggestion_urls.py
+from django.urls import path
+from core.API_Views import suggestion_views
+
+urlpatterns = [
+    # Endpoint: GET /api/suggestions/users/?page={}
+    path('api/suggestions/users/', suggestion_views.UserSuggestionListView.as_view(), name='user-suggestions'),
+]
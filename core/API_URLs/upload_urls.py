@@ -0,0 +1,8 @@
+# core/API_URLs/upload_urls.py
+from django.urls import path
+from core.API_Views import upload_views
+
+urlpatterns = [
+    # Endpoint: POST /api/uploads/
+    path('api/uploads/', upload_views.create_upload_session, name='create-upload-session'),
+]
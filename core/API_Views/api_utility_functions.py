@@ -2,14 +2,18 @@ from rest_framework import status
 from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 
-# lets you directly manipulate database fields within database queries, leading to more efficient operations
-from django.db.models import F
+# Atomic transactions ensure that a series of database operations are completed together or not at all, maintaining data integrity.
+from django.db import transaction
+# Conditional expressions used to rank search matches
+from django.db.models import Case, When, Value, IntegerField
+from django.db.models.functions import Length
 
 # Accessing Django Channels' channel layer for WebSocket integration
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
-from core.models import Notification, Hashtag
+from core.models import User, Notification, Hashtag
+from core.Services import image_variants, sharded_counters
 
 
 # --------------- NOTIFICATION API VIEWS ---------------
@@ -30,41 +34,41 @@ def notify_user(notification_recipient, notification_sender, notification_type,
     # Create a notification for the recipient of the notification action
     try:
         notification = Notification.objects.create(
-            recipient=notification_recipient,
+            recipient_id=notification_recipient.id,
             sender=notification_sender,
             notification_type=notification_type
         )
     except Exception as e:
         raise APIException()
 
-    # Notify the recipient via WebSocket about the new notification
-    try:
+    event = {
+        "type": "core.notification",
+        "unique_identifier": str(notification.id),
+        "notification_type": notification_type,
+        "recipient": str(notification_recipient.id),
+        "sender": str(notification_sender.id),
+        "message": f"{notification_sender.username} {message}",
+        "sender_profile_picture_url": image_variants.variant_url(notification_sender, image_variants.PROFILE_PICTURE, 'thumbnail'),
+    }
+
+    # Notify the recipient via WebSocket about the new notification once the transaction creating it commits,
+    # so the WebSocket is never told about a notification that was rolled back
+    def send_notification():
         channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"notifications_{notification_recipient.id}",
-            {
-                "type": "core.notification",
-                "unique_identifier": str(notification.id),
-                "notification_type": notification_type,
-                "recipient": str(notification_recipient.id),
-                "sender": str(notification_sender.id),
-                "message": f"{notification_sender.username} {message}",
-                "sender_profile_picture_url": notification_sender.profile_picture.url if notification_sender.profile_picture else None,
-            }
-        )
-    except Exception as e:
-        raise APIException()
+        async_to_sync(channel_layer.group_send)(f"notifications_{notification_recipient.id}", event)
+
+    transaction.on_commit(send_notification)
 
 
 # Utility function to update follow counters
 # following_user is the user being followed and follower_user is the user who is following
-def update_follow_counters(following_user, follower_user):
-    # Increment the num_followers counter for the user being followed (following_user) using Django F object
-    following_user.num_followers = F('num_followers') + 1
-    following_user.save()
-    # Increment the num_following counter for the user attempting to follow (follower_user) using Django F object
-    follower_user.num_following = F('num_following') + 1
-    follower_user.save()
+def update_follow_counters(following_user, follower_user, amount=1):
+    # Increment the num_followers counter for the user being followed (following_user) and the num_following counter
+    # for the user attempting to follow (follower_user) in one statement, or through counter slots for hot users
+    sharded_counters.add_many(User, [
+        (following_user.id, 'num_followers', amount),
+        (follower_user.id, 'num_following', amount),
+    ])
 
 
 # --------------- POST API VIEWS ---------------
@@ -90,4 +94,23 @@ def accept_follow_request_notification(notification, user, action):
             "action": action,
             "unique_identifier": str(notification.id),
         }
-    )
\ No newline at end of file
+    )
+
+# --------------- USER SEARCH ---------------
+
+# Utility function to filter a queryset of users by a username search and order the matches by relevance:
+# exact match first, then usernames starting with the search, then usernames containing it (shortest first).
+# Usernames are stored in lowercase, so the search is lowercased and matched with case sensitive LIKE patterns
+# that can use the username prefix (varchar_pattern_ops) and trigram (gin_trgm_ops) indexes
+def search_users_by_username(users, username_query):
+    username_query = username_query.strip().lower()
+
+    return users.filter(username__contains=username_query).annotate(
+        match_rank=Case(
+            When(username=username_query, then=Value(0)),
+            When(username__startswith=username_query, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ),
+        username_length=Length('username'),
+    ).order_by('match_rank', 'username_length', 'username')
@@ -0,0 +1,119 @@
+import functools
+
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# Helpers for the async views (see async_views).
+# DRF views are synchronous, so async views can't use DRF's authentication, pagination and Response. These helpers
+# reproduce what the sync views get from DRF (token authentication, page number pagination and JSON rendering) with
+# the same response formats, so clients can use either version of an endpoint.
+
+
+# Build a JSON response, rendered like DRF's Response
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+# Authenticate a request with its "Authorization: Token <key>" header, like DRF's TokenAuthentication.
+# Sets request.user and returns None on success, returns the 401 response to send otherwise
+async def authenticate(request):
+    parts = request.headers.get('Authorization', '').split()
+    if not parts or parts[0].lower() != 'token':
+        detail = "Authentication credentials were not provided."
+    elif len(parts) != 2:
+        detail = "Invalid token header."
+    else:
+        token = await Token.objects.select_related('user').filter(key=parts[1]).afirst()
+        if token is not None and token.user.is_active:
+            request.user = token.user
+            return None
+        detail = "Invalid token." if token is None else "User inactive or deleted."
+
+    response = json_response({"detail": detail}, status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+# Decorator for the async read views, the equivalent of @api_view(['GET']) with @permission_classes([IsAuthenticated])
+def authenticated_get_view(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return json_response({"detail": f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+        error = await authenticate(request)
+        if error is not None:
+            return error
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+# Error raised for a page number that doesn't exist, sent as a 404 response like DRF's pagination
+class InvalidPage(Exception):
+    pass
+
+
+# Page of an async queryset, paginated like the pagination class (a DRF PageNumberPagination) of the sync view
+class AsyncPage:
+    def __init__(self, request, pagination_class):
+        self.request = request
+        self.paginator = pagination_class()
+        self.page_size = self.get_page_size()
+        self.items = []
+        self.count = 0
+        self.number = 1
+        self.num_pages = 1
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET[self.paginator.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.paginator.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.paginator.page_size
+
+    # Load the page of a queryset requested in the query string. Raises InvalidPage if it doesn't exist
+    async def load(self, queryset):
+        self.count = await queryset.acount()
+        self.num_pages = max(1, -(-self.count // self.page_size))
+        try:
+            self.number = int(self.request.GET.get(self.paginator.page_query_param, 1))
+        except ValueError:
+            raise InvalidPage()
+        if not 1 <= self.number <= self.num_pages:
+            raise InvalidPage()
+
+        offset = (self.number - 1) * self.page_size
+        self.items = [item async for item in queryset[offset:offset + self.page_size]]
+        return self.items
+
+    def get_next_link(self):
+        if self.number >= self.num_pages:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.paginator.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.paginator.page_query_param)
+        return replace_query_param(url, self.paginator.page_query_param, self.number - 1)
+
+    # Body of a paginated response, like PageNumberPagination.get_paginated_response
+    def paginated_data(self, results):
+        return {
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': results,
+        }
+
+
+# Response sent for a page number that doesn't exist
+def invalid_page_response():
+    return json_response({"detail": "Invalid page."}, status.HTTP_404_NOT_FOUND)
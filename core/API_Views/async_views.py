@@ -0,0 +1,193 @@
+from rest_framework import status
+
+from django.db.models import Q
+from django.contrib.auth import get_user_model
+
+from core.models import Message, Notification, Post
+from core.serializers import MessageSerializer, NotificationSerializer, PostSerializer, PostSerializerMinimal
+from core.Services import follow_graph, image_variants, sharded_counters
+from core.Pagination_Classes.paginations import LargePagination
+from .async_utility_functions import AsyncPage, InvalidPage, authenticated_get_view, invalid_page_response, json_response
+
+
+# Async versions of the hot read endpoints, served under /api/async/ with the same responses as the sync endpoints.
+# Under an ASGI server sync views run in a thread each, async views run on the event loop and only hand their
+# database queries to threads (through Django's async ORM), and read the cache through the async cache API.
+# Serializers don't support async queries, so the rows they need are loaded for the whole page first (authors and
+# related rows with select_related, hashtags, likes and counters with one query each) and the serializers are run
+# on the loaded rows, without any query (see the preloaded values in the serializers' context).
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+
+# Load what PostSerializer needs to serialize a page of posts without queries, returned as serializer context
+async def _post_page_context(request, posts, minimal=False):
+    post_ids = [post.id for post in posts]
+    context = {
+        'request': request,
+        'counter_values': await sharded_counters.aget_many(posts, ('like_count', 'comment_count')),
+    }
+    if minimal:
+        return context
+
+    hashtags_by_post = {}
+    async for post_id, hashtag_id, hashtag_name in Post.hashtags.through.objects.filter(post_id__in=post_ids).order_by('id').values_list('post_id', 'hashtag_id', 'hashtag__name'):
+        hashtags_by_post.setdefault(post_id, []).append({'id': hashtag_id, 'name': hashtag_name})
+    context['hashtags_by_post'] = hashtags_by_post
+    context['liked_post_ids'] = {
+        post_id async for post_id in Post.likes.through.objects.filter(user_id=request.user.id, post_id__in=post_ids).values_list('post_id', flat=True)
+    }
+    return context
+
+
+# Send a page of posts serialized with PostSerializer
+async def _post_page_response(request, queryset):
+    page = AsyncPage(request, LargePagination)
+    try:
+        posts = await page.load(queryset.select_related('user'))
+    except InvalidPage:
+        return invalid_page_response()
+    context = await _post_page_context(request, posts)
+    return json_response(page.paginated_data(PostSerializer(posts, many=True, context=context).data))
+
+
+# Endpoint: /api/async/feed/?page={}&page_size={}
+# Async version of /api/feed/ (UserFeedView)
+@authenticated_get_view
+async def user_feed(request):
+    following_ids = await follow_graph.aget_following_ids(request.user.id)
+    return await _post_page_response(request, Post.objects.filter(user_id__in=list(following_ids)))
+
+
+# Endpoint: /api/async/explore/posts/?page={}&page_size={}
+# Async version of /api/explore/posts/ (ExplorePageView)
+@authenticated_get_view
+async def explore_page(request):
+    excluded_user_ids = [request.user.id,
+                         *await follow_graph.aget_following_ids(request.user.id),
+                         *await follow_graph.aget_pending_sent_ids(request.user.id)]
+    return await _post_page_response(request, Post.objects.filter(visibility='public').exclude(user_id__in=excluded_user_ids))
+
+
+# Endpoint: /api/async/notifications/?page={}&page_size={}
+# Async version of /api/notifications/ (NotificationListView)
+@authenticated_get_view
+async def notifications(request):
+    queryset = (
+        Notification.objects.filter(recipient_id=request.user.id).order_by('-created_at')
+        .select_related('sender', 'notification_post', 'notification_comment')
+    )
+    page = AsyncPage(request, LargePagination)
+    try:
+        notifications_page = await page.load(queryset)
+    except InvalidPage:
+        return invalid_page_response()
+    return json_response(page.paginated_data(NotificationSerializer(notifications_page, many=True, context={'request': request}).data))
+
+
+# Endpoint: /api/async/messages/conversation/{user_id}/?page={}&page_size={}
+# Async version of /api/messages/conversation/{user_id}/ (ConversationListView)
+@authenticated_get_view
+async def conversation(request, user_id):
+    if not await User.objects.filter(id=user_id).aexists():
+        return json_response({"error": "User not found"}, status.HTTP_404_NOT_FOUND)
+
+    messages = Message.objects.filter(
+        Q(sender_id=request.user.id, receiver_id=user_id) | Q(sender_id=user_id, receiver_id=request.user.id)
+    )
+    # Mark the unread messages sent by the other user as read (a message that has been read has also been delivered)
+    await Message.objects.filter(sender_id=user_id, receiver_id=request.user.id, is_read=False).aupdate(is_read=True, is_delivered=True)
+
+    page = AsyncPage(request, LargePagination)
+    try:
+        messages_page = await page.load(messages)
+    except InvalidPage:
+        return invalid_page_response()
+
+    # Status of the most recent message of the conversation for its sender, if the requesting user sent it
+    most_recent_message = messages_page[0] if page.number == 1 and messages_page else await messages.only('id', 'sender_id', 'is_read').afirst()
+    most_recent_sender_status = None
+    if most_recent_message and most_recent_message.sender_id == request.user.id:
+        most_recent_sender_status = {
+            "id": most_recent_message.id,
+            "is_read": most_recent_message.is_read
+        }
+
+    return json_response(page.paginated_data({
+        "most_recent_sender_status": most_recent_sender_status,
+        "messages": MessageSerializer(messages_page, many=True).data
+    }))
+
+
+# Endpoint: /api/async/user/profile/{user_id}/?page={}&page_size={}
+# Async version of /api/user/profile/{user_id}/ (user_profile)
+@authenticated_get_view
+async def user_profile(request, user_id):
+    user = await User.objects.filter(id=user_id).afirst()
+    if user is None:
+        return json_response({"error": "User not found"}, status.HTTP_404_NOT_FOUND)
+
+    can_view = True
+    followed_by = None
+    if request.user.id == user_id:
+        follow_status = "self"
+    else:
+        following_ids = await follow_graph.aget_following_ids(request.user.id)
+        if follow_graph.contains(following_ids, user.id):
+            follow_status = "accepted"
+        elif follow_graph.contains(await follow_graph.aget_pending_sent_ids(request.user.id), user.id):
+            follow_status = "pending"
+        else:
+            follow_status = False
+
+        if user.profile_privacy == 'private' and (follow_status is False or follow_status == 'pending'):
+            can_view = False
+
+        mutual_count, mutual_ids = await follow_graph.aget_mutual_follows(request.user.id, user.id, user.num_followers)
+        mutual_users = await User.objects.only('id', 'username', 'profile_picture', 'profile_picture_variants').ain_bulk(mutual_ids) if mutual_ids else {}
+        followed_by = {
+            'count': mutual_count,
+            'users': [
+                {
+                    'id': mutual_user.id,
+                    'username': mutual_user.username,
+                    'profile_picture': image_variants.variant_url(mutual_user, image_variants.PROFILE_PICTURE, 'thumbnail'),
+                }
+                for mutual_user in (mutual_users.get(mutual_id) for mutual_id in mutual_ids) if mutual_user
+            ],
+        }
+
+    counters = await sharded_counters.aget_many([user], ('num_followers', 'num_following'))
+    response_data = {
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'profile_picture': image_variants.variant_url(user, image_variants.PROFILE_PICTURE, 'medium'),
+        'bio': user.bio,
+        'follow_status': follow_status,
+        'followed_by': followed_by,
+        'can_view': can_view,
+        'num_followers': counters[(user.id, 'num_followers')],
+        'num_following': counters[(user.id, 'num_following')],
+        'num_posts': user.num_posts,
+        'posts': None,
+    }
+
+    if can_view:
+        page = AsyncPage(request, LargePagination)
+        try:
+            posts = await page.load(
+                Post.objects.filter(user_id=user.id)
+                .only('id', 'media', 'media_variants', 'media_width', 'media_height', 'media_placeholder', 'like_count', 'comment_count')
+            )
+        except InvalidPage:
+            return invalid_page_response()
+        context = await _post_page_context(request, posts, minimal=True)
+        response_data['posts'] = PostSerializerMinimal(posts, many=True, context=context).data
+        response_data['pagination'] = {
+            'next': page.get_next_link(),
+            'previous': page.get_previous_link(),
+        }
+
+    return json_response(response_data)
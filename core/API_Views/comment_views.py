@@ -4,8 +4,6 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import PermissionDenied, APIException, NotFound
 from rest_framework.response import Response
 
-# lets you directly manipulate database fields within database queries, leading to more efficient operations
-from django.db.models import F
 # Atomic transactions ensure that a series of database operations are completed together or not at all, maintaining data integrity.
 from django.db import transaction
 
@@ -15,6 +13,7 @@ from asgiref.sync import async_to_sync
 
 from core.models import Post, Comment, Notification
 from core.serializers import CommentSerializer, CommentSerializerMinimal
+from core.Services import image_variants, mentions, sharded_counters
 from core.Pagination_Classes.paginations import LargePagination
 from .api_utility_functions import remove_notification
 
@@ -42,9 +41,8 @@ def create_comment(request, post_id):
             comment = Comment.objects.create(user=request.user, post=post, content=content)
             serializer = CommentSerializerMinimal(comment)
 
-            # Increment the counter for the comment count
-            post.comment_count = F('comment_count') + 1
-            post.save()  # Save the post to update the counter
+            # Increment the counter for the comment count (through counter slots if the post is hot)
+            sharded_counters.add(Post, post.id, 'comment_count', 1)
 
             # Create a new_comment notification for the post author
             notification = Notification.objects.create(
@@ -66,10 +64,13 @@ def create_comment(request, post_id):
                     "recipient": str(post.user.id),
                     "sender": str(request.user.id),
                     "message": f"{request.user.username} commented on your post",
-                    "sender_profile_picture_url": request.user.profile_picture.url if request.user.profile_picture else None,
-                    "post_media_url": post.media.url if post.media else None,
+                    "sender_profile_picture_url": image_variants.variant_url(request.user, image_variants.PROFILE_PICTURE, 'thumbnail'),
+                    "post_media_url": image_variants.variant_url(post, image_variants.POST_MEDIA, 'thumbnail'),
                 }
             )
+
+            # Notify the users mentioned in the comment
+            mentions.notify_mentions(request.user, content, post, comment)
     except Exception as e:
         return Response({"error": "An error occurred while creating the comment"},
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -95,13 +96,13 @@ def delete_comment(request, comment_id):
         # Use an atomic transaction for deleting the Comment instance, updating the comment counter,
         # deleting the comment notification, and informing the WebSocket of the deletion
         with transaction.atomic():
-            # Decrement the counter for the comment count
-            comment.post.comment_count = F('comment_count') - 1
-            comment.post.save()  # Save the post to update the counter
+            # Decrement the counter for the comment count (through counter slots if the post is hot)
+            sharded_counters.add(Post, comment.post_id, 'comment_count', -1)
 
             # Fetch the associated 'new_comment' notification
             notification = Notification.objects.filter(
-                notification_comment_id=comment.id
+                notification_comment_id=comment.id,
+                notification_type='new_comment'
             ).first()
 
             # Delete the comment
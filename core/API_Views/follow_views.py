@@ -4,22 +4,17 @@ from rest_framework.exceptions import APIException, NotFound
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-# Q object helps build complex queries using logical operators to filter database records based on multiple conditions
-from django.db.models import Q
-# lets you directly manipulate database fields within database queries, leading to more efficient operations
-from django.db.models import F
 # Atomic transactions ensure that a series of database operations are completed together or not at all, maintaining data integrity.
 from django.db import transaction, DatabaseError, IntegrityError
 # Get the User model configured for this Django project
 from django.contrib.auth import get_user_model
 
-# Accessing Django Channels' channel layer for WebSocket integration
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
 from core.models import Follow, Notification
 from core.serializers import FollowSerializer
-from .api_utility_functions import notify_user, update_follow_counters, accept_follow_request_notification, remove_notification
+from .api_utility_functions import (
+    notify_user, update_follow_counters, accept_follow_request_notification, remove_notification, search_users_by_username
+)
+from core.Services import follow_graph, follow_writes
 from core.Pagination_Classes.paginations import LargePagination
 
 
@@ -28,52 +23,47 @@ User = get_user_model()
 
 
 # Endpoint: /api/follow/user/{user_id}
-# API view to allow a requesting user to follow another user
+# API view to allow a requesting user to follow another user.
+# Following is idempotent: following a user again returns the current follow status instead of an error
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def follow_user(request, user_id):
-    # Look for the user we are attempting to follow
-    try:
-        following_user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-
     # Set the following user as the request user (user who is attempting to follow another user)
     follower_user = request.user
 
-    # Check if user already follows this user
-    if Follow.objects.filter(follower_id=follower_user.id, following_id=following_user.id, follow_status='accepted').exists():
-        return Response({"error": "You are already following this user"}, status=status.HTTP_400_BAD_REQUEST)
+    if follower_user.id == user_id:
+        return Response({"error": "You cannot follow yourself"}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
         with transaction.atomic():
-            # Determine the status of the follow request based on the profile privacy of the user we're attempting to follow
-            # If the user is public, then the follow is accepted. If the user is private then the status is pending
-            follow_status = 'accepted' if following_user.profile_privacy == 'public' else 'pending'
-
-            # Create the follow instance with the appropriate status
-            follow = Follow.objects.create(
-                follower=follower_user,
-                following=following_user,
-                follow_status=follow_status
-            )
-
-            # If the user is public, then the follow is immediately created
-            if following_user.profile_privacy == 'public':
-                # Update the num_followers and num_following counters for the users
-                update_follow_counters(following_user, follower_user)
-                # Create a new_follower notification for the user being followed and also notify them via WebSocket
-                notify_user(following_user, follower_user, 'new_follower', "started following you")
-            # If the user is private, a follow request is made and must be accepted before the requesting user can follow them
-            else:
-                # Create a follow_request notification for the user being followed and also notify them via WebSocket
-                notify_user(following_user, follower_user, 'follow_request', "sent you a follow request")
+            # Create the follow instance, with an accepted status if the user we're attempting to follow is public
+            # and a pending status (follow request) if they are private, unless the follow already exists
+            follow_status, created = follow_writes.create_follow(follower_user.id, user_id)
+
+            if follow_status is None:
+                return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+            if created:
+                # Refresh the cached follow graph of both users once the transaction commits
+                follow_graph.invalidate(follower_user.id, user_id)
+                following_user = User(id=user_id)
+
+                # If the user is public, then the follow is immediately created
+                if follow_status == 'accepted':
+                    # Update the num_followers and num_following counters for the users
+                    update_follow_counters(following_user, follower_user)
+                    # Create a new_follower notification for the user being followed and also notify them via WebSocket
+                    notify_user(following_user, follower_user, 'new_follower', "started following you")
+                # If the user is private, a follow request is made and must be accepted before the requesting user can follow them
+                else:
+                    # Create a follow_request notification for the user being followed and also notify them via WebSocket
+                    notify_user(following_user, follower_user, 'follow_request', "sent you a follow request")
     except Exception as e:
         return Response({"error": "An error occurred while processing the follow request"},
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     # Return a repsonse containing the status of the follow request (accepted or pending)
     # as this will be used by the frontend to update the UI
-    return Response({"follow_status": follow_status},status=status.HTTP_201_CREATED)
+    return Response({"follow_status": follow_status}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 # Endpoint: /api/respond_follow_request/user/{user_id}
@@ -103,6 +93,9 @@ def respond_follow_request(request, follower_id):
     if action in ['accept', 'decline']:
         try:
             with transaction.atomic():
+                # Refresh the cached follow graph of both users once the transaction commits
+                follow_graph.invalidate(follower_user.id, following_user.id)
+
                 if action == 'accept':
                     # Update the follow status of the Follow instance between the 2 users
                     follow.follow_status = 'accepted'
@@ -142,61 +135,40 @@ def respond_follow_request(request, follower_id):
 
 
 # Endpoint: /api/unfollow/user/{user_id}
-# API view to allow a requesting user to unfollow another user
+# API view to allow a requesting user to unfollow another user (or cancel their follow request).
+# Unfollowing is idempotent: unfollowing a user that isn't followed succeeds without changing anything
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def unfollow_user(request, user_id):
-    try:
-        following_user = User.objects.only('id').get(id=user_id)
-    except User.DoesNotExist:
-        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-
     # Set the follower user as the request user (user who is attempting to unfollow another user)
     follower_user = request.user
 
-    # Check if requesting user is currently following this user
-    follow = Follow.objects.filter(follower_id=follower_user.id, following_id=following_user.id).first()
-    if not follow:
-        return Response({"error": "You are not following this user"}, status=status.HTTP_400_BAD_REQUEST)
-
     try:
         # Use a transaction to handle unfollowing, updating the counters, and deleting the associated notification
         with transaction.atomic():
-            # Check that the requesting user is following the user they are attempting to unfollow
+            # Remove the follow relationship, getting the status it had
+            follow_status = follow_writes.delete_follow(follower_user.id, user_id)
+
+            if follow_status is None:
+                if not User.objects.filter(id=user_id).exists():
+                    return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+                # Already unfollowed (ex: a repeated request)
+                return Response({"follow_status": False}, status=status.HTTP_200_OK)
+
+            # Refresh the cached follow graph of both users once the transaction commits
+            follow_graph.invalidate(follower_user.id, user_id)
+
             # Since if the requesting user is canceling a pending follow request, no follow counts need to be changed
-            if follow.follow_status == "accepted":
-                # Decrement the num_followers counter for the user being unfollowed using F object
-                following_user.num_followers = F('num_followers') - 1
-                following_user.save()
-                # Decrement the num_following counter for the user who is unfollowing using F object
-                follower_user.num_following = F('num_following') - 1
-                follower_user.save()
-
-            # Remove the follow relationship
-            follow.delete()
-
-            # Fetch the associated "follow_request" or "new_follower" notification
-            notification = Notification.objects.filter(
-                Q(sender_id=follower_user.id, recipient_id=following_user.id, notification_type='follow_request') |
-                Q(sender_id=follower_user.id, recipient_id=following_user.id, notification_type='new_follower')
-            ).first()
-
-            # Check if the notification exists
-            if notification:
-                notification_id = str(notification.id)  # Store the ID for WebSocket use
-
-                # Delete the associated notification
-                notification.delete()
-
-                # Remove the notification for the recipient user via WebSocket
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    f"notifications_{following_user.id}",
-                    {
-                        "type": "remove_notification",
-                        "unique_identifier": notification_id,
-                    }
-                )
+            if follow_status == "accepted":
+                # Decrement the num_followers and num_following counters for the users
+                update_follow_counters(User(id=user_id), follower_user, -1)
+
+            # Delete the associated "follow_request" or "new_follower" notification
+            notification_ids = follow_writes.delete_follow_notifications(follower_user.id, user_id)
+
+            # Remove the notifications for the recipient user via WebSocket once the transaction commits
+            for notification_id in notification_ids:
+                transaction.on_commit(lambda notification_id=notification_id: remove_notification(user_id, str(notification_id)))
     except (DatabaseError, IntegrityError):
         return Response({"error": "An error occurred while unfollowing the user"},
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -228,9 +200,9 @@ class FollowerListView(generics.ListAPIView):
             # Get a queryset of the user's followers
             followers = User.objects.filter(following__following_id=user.id, following__follow_status='accepted').order_by('id')
 
-            # Apply username filter if the query parameter is provided
+            # Apply username search if the query parameter is provided, ordering the matches by relevance
             if username_query:
-                followers = followers.filter(username__icontains=username_query)
+                followers = search_users_by_username(followers, username_query)
 
             return followers
         except Exception as e:
@@ -275,9 +247,9 @@ class FollowingListView(generics.ListAPIView):
             # Get a queryset of the users that the requesting user follows
             following_users = User.objects.filter(follower__follower_id=user.id, follower__follow_status='accepted').order_by('id')
 
-            # Apply username filter if the query parameter is provided
+            # Apply username search if the query parameter is provided, ordering the matches by relevance
             if username_query:
-                following_users = following_users.filter(username__icontains=username_query)
+                following_users = search_users_by_username(following_users, username_query)
 
             return following_users
         except Exception as e:
@@ -0,0 +1,93 @@
+import os
+
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import patch_cache_control
+
+from core.models import Post
+from core.Services import follow_graph, image_resizing
+
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+# Seconds clients and CDNs can reuse a resized image before revalidating it with its ETag
+MAX_AGE = getattr(settings, 'IMAGE_RESIZE_MAX_AGE', 60 * 60 * 24)
+# Internal location of the resize cache in the front web server (ex: "/image-cache/" for an nginx internal location
+# aliasing IMAGE_RESIZE_CACHE_DIR). When set, cached images are sent by the web server with X-Accel-Redirect
+# (sendfile) instead of being streamed by the app, the only way they are sent without copying them through the app
+ACCEL_REDIRECT_PREFIX = getattr(settings, 'IMAGE_RESIZE_ACCEL_REDIRECT_PREFIX', None)
+
+
+# Send an image resized to the width and format requested in the query string (?w=320&fmt=webp)
+def _resized_image_response(request, image, public):
+    try:
+        width = int(request.query_params.get('w', ''))
+    except ValueError:
+        width = None
+    if width not in image_resizing.WIDTHS:
+        return Response({"error": f"w must be one of: {', '.join(map(str, image_resizing.WIDTHS))}"}, status=status.HTTP_400_BAD_REQUEST)
+    image_format = request.query_params.get('fmt', 'webp')
+    if image_format not in image_resizing.FORMATS:
+        return Response({"error": f"fmt must be one of: {', '.join(image_resizing.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if not image:
+        return Response({"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # The cached file name depends on the stored file, it changes whenever the image is replaced
+    name = image_resizing.cache_name(image.name, width, image_format)
+    etag = f'"{os.path.splitext(os.path.basename(name))[0]}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        try:
+            file, name = image_resizing.open_resized(image.name, width, image_format)
+        except FileNotFoundError:
+            return Response({"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        content_type = image_resizing.FORMATS[image_format][0]
+        if ACCEL_REDIRECT_PREFIX:
+            file.close()
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + name.replace(os.sep, '/')
+        else:
+            # Streamed by daphne in chunks read from the file (ASGI has no sendfile), see ACCEL_REDIRECT_PREFIX
+            response = FileResponse(file, content_type=content_type)
+
+    response['ETag'] = etag
+    patch_cache_control(response, max_age=MAX_AGE, **({'public': True} if public else {'private': True}))
+    return response
+
+
+# Endpoint: GET /api/images/posts/{post_id}/?w={width}&fmt={webp|jpeg}
+# API view to get the media of a post resized on demand to one of the allowed widths
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def resized_post_media(request, post_id):
+    post = Post.objects.filter(id=post_id).only('id', 'user_id', 'media', 'visibility').first()
+    if post is None:
+        return Response({"error": "Post not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # Private posts can only be seen by their author and the author's followers
+    if post.visibility == 'private' and follow_graph.ViewerFollowState(request.user.id).status_of(post.user_id) not in ('self', 'accepted'):
+        return Response({"error": "You don't have permission to view this post"}, status=status.HTTP_403_FORBIDDEN)
+
+    return _resized_image_response(request, post.media, public=post.visibility == 'public')
+
+
+# Endpoint: GET /api/images/users/{user_id}/?w={width}&fmt={webp|jpeg}
+# API view to get the profile picture of a user resized on demand to one of the allowed widths
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def resized_profile_picture(request, user_id):
+    user = User.objects.filter(id=user_id).only('id', 'profile_picture').first()
+    if user is None:
+        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # Profile pictures are shown to every user, even on private profiles
+    return _resized_image_response(request, user.profile_picture, public=True)
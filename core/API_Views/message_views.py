@@ -5,7 +5,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 # Q object helps build complex queries using logical operators to filter database records based on multiple conditions
-from django.db.models import Q, Max, Case, When, F, DateTimeField
+from django.db.models import Q, Max, Case, When, F, Value, DateTimeField, FloatField
+from django.db.models.functions import Cast
+# Full-text search over the messages' search documents
+from django.contrib.postgres.search import SearchQuery, SearchRank
 # Atomic transactions ensure that a series of database operations are completed together or not at all, maintaining data integrity.
 from django.db import transaction
 from django.core.exceptions import PermissionDenied
@@ -17,8 +20,8 @@ from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
 from core.models import Message
-from core.serializers import MessageSerializer, UserSerializer, FollowSerializerMinimal
-from core.Pagination_Classes.paginations import LargePagination
+from core.serializers import MessageSerializer, MessageSearchSerializer, UserSerializer, FollowSerializerMinimal
+from core.Pagination_Classes.paginations import LargePagination, MessageSearchPagination
 
 
 # Get the User model configured for this Django project
@@ -54,7 +57,8 @@ def send_message(request, receiver_id):
         # Use an atomic transaction for creating the Message instance, and informing the WebSocket of the new message
         with transaction.atomic():
             # Create the message
-            message = Message.objects.create(sender=sender, receiver=receiver, content=content, is_delivered=True)
+            # The message is only marked as delivered once the receiver's client acknowledges it over the WebSocket
+            message = Message.objects.create(sender=sender, receiver=receiver, content=content)
 
             # Notify WebSocket group about the new message
             channel_layer = get_channel_layer()
@@ -62,6 +66,8 @@ def send_message(request, receiver_id):
                 room_group_name,
                 {
                     "type": "chat.message",
+                    "room": room_group_name,
+                    "sender": sender.id,
                     "content": content,
                     "unique_identifier": str(message.id)  # Use message's ID as unique_identifier
                 }
@@ -108,6 +114,7 @@ def delete_message(request, message_id):
                 room_group_name,
                 {
                     "type": "remove_message",
+                    "room": room_group_name,
                     "unique_identifier": unique_identifier,
                 }
             )
@@ -140,7 +147,8 @@ class ConversationListView(generics.ListAPIView):
             )
 
             # Update unread messages sent by `user` since the `requesting user` has viewed them after calling this API
-            Message.objects.filter(sender_id=user.id, receiver_id=self.request.user.id, is_read=False).update(is_read=True)
+            # (a message that has been read has also been delivered)
+            Message.objects.filter(sender_id=user.id, receiver_id=self.request.user.id, is_read=False).update(is_read=True, is_delivered=True)
 
             return messages
         except Exception as e:
@@ -200,7 +208,7 @@ class ConversationPartnerListView(generics.ListAPIView):
         try:
             # Get all users that sent a message to the requesting user or received a message from the requesting user
             # last_interaction annotated field used to order the Users by their most recent interaction with the requesting user
-            conversation_partners = User.objects.only('id', 'username', 'profile_picture').filter(
+            conversation_partners = User.objects.only('id', 'username', 'profile_picture', 'profile_picture_variants').filter(
                 Q(received_messages__sender_id=self.request.user.id) | Q(sent_messages__receiver_id=self.request.user.id)
             ).annotate(
                 last_received=Max('received_messages__created_at'),
@@ -235,4 +243,55 @@ class ConversationPartnerListView(generics.ListAPIView):
             return self.get_paginated_response(serializer.data)
 
         serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+# Endpoint: /api/messages/search/?q={}&user_id={}&cursor={}&page_size={}
+# API view to search the messages of the conversations the requesting user participates in, ranked by relevance
+class MessageSearchView(generics.ListAPIView):
+    serializer_class = MessageSearchSerializer
+    pagination_class = MessageSearchPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        query_text = self.request.query_params.get('q', '').strip()  # Get the search text from the query parameters
+        user_id = self.request.query_params.get('user_id')  # Optionally limit the search to the conversation with a user
+
+        if not query_text:
+            return Message.objects.none().annotate(rank=Value(0.0, output_field=FloatField()))
+
+        try:
+            search_query = SearchQuery(query_text, search_type='websearch', config='english')
+
+            # Match the search query against the GIN indexed search documents of the requesting user's messages
+            messages = Message.objects.filter(
+                Q(sender_id=self.request.user.id) | Q(receiver_id=self.request.user.id),
+                search_vector=search_query
+            )
+
+            if user_id:
+                messages = messages.filter(Q(sender_id=int(user_id)) | Q(receiver_id=int(user_id)))
+
+            # Rank the matches by relevance (cast to double precision so the rank round-trips exactly through the cursor)
+            return messages.annotate(rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()))
+        except ValueError:
+            raise NotFound("User not found")
+        except Exception as e:
+            # Handle unexpected errors
+            raise APIException()
+
+    def list(self, request, *args, **kwargs):
+        try:
+            queryset = self.get_queryset()
+        except NotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except APIException as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
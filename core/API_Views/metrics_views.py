@@ -0,0 +1,14 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from core.Services import metrics
+
+
+# Endpoint: /api/metrics/
+# API view for staff users to get the runtime metrics of the worker process serving the request
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def process_metrics(request):
+    return Response(metrics.snapshot(), status=status.HTTP_200_OK)
@@ -5,22 +5,19 @@ from rest_framework.exceptions import PermissionDenied, APIException, NotFound
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser
 
-# Q object helps build complex queries using logical operators to filter database records based on multiple conditions
-from django.db.models import Q
 # lets you directly manipulate database fields within database queries, leading to more efficient operations
 from django.db.models import F
 # Atomic transactions ensure that a series of database operations are completed together or not at all, maintaining data integrity.
 from django.db import transaction, DatabaseError
-# Managing file uploads and storage
-from django.core.files.storage import default_storage
 
 # Accessing Django Channels' channel layer for WebSocket integration
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
-from core.models import Post, Notification, Hashtag
-from core.serializers import PostSerializer, PostSerializerMinimal,HashtagSerializer, FollowSerializer
+from core.models import Post, Notification, Hashtag, User
+from core.serializers import PostSerializer, PostSerializerMinimal,HashtagSerializer, FollowSerializer, complete_image
 from .api_utility_functions import create_hashtags, remove_notification
+from core.Services import follow_graph, image_variants, media_store, mentions, sharded_counters
 from core.Pagination_Classes.paginations import LargePagination, SmallPagination
 
 
@@ -34,9 +31,12 @@ class PostListCreateView(generics.ListCreateAPIView):
     parser_classes = [MultiPartParser]
     pagination_class = LargePagination
 
-    # Set the user field of the serializer to the authenticated user
+    # Set the user field of the serializer to the authenticated user, completing the direct upload of the media (if
+    # any) in the same transaction as the post
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            complete_image(serializer, 'media', 'upload_id')
+            serializer.save(user=self.request.user)
 
     # Custom logic for creating a post
     def create(self, request, *args, **kwargs):
@@ -59,15 +59,22 @@ class PostListCreateView(generics.ListCreateAPIView):
         user_profile_privacy = request.user.profile_privacy
         # Set the visibility based on user's profile_privacy (it is already set to public by default)
         if user_profile_privacy == 'private':
-            request.data['visibility'] = 'private'
+            mutable_data['visibility'] = 'private'
 
         serializer = self.get_serializer(data=mutable_data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
 
+        # Notify the users mentioned in the post content
+        mentions.notify_mentions(request.user, serializer.instance.content, serializer.instance)
+
+        # Generate the resized variants of the media in the background
+        image_variants.schedule_variants(image_variants.POST_MEDIA, serializer.instance.id)
+
         # Increment the num_posts counter for the user using the Django F object
         request.user.num_posts = F('num_posts') + 1
         request.user.save()
+        sharded_counters.journal_changes(User, [request.user.id])
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -126,12 +133,26 @@ class PostDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
             # Update the post instance with the processed list of hashtags
             instance.hashtags.set(hashtag_ids)
 
-        # Delete the old media from the AWS S3 bucket if the user is updating it
-        new_media = serializer.validated_data.get('media')
-        if new_media and old_media:
-            default_storage.delete(old_media.name)
-
-        self.perform_update(serializer)
+        # Complete the direct upload of the new media (if any) and release the old media, queueing it and its variants
+        # for deletion from the AWS S3 bucket if no other post or user uses it, in the same transaction as the update
+        with transaction.atomic():
+            complete_image(serializer, 'media', 'upload_id')
+            new_media = serializer.validated_data.get('media')
+            if new_media and old_media and new_media == old_media.name:
+                # The same image was uploaded again, drop the extra reference and keep its variants and metadata
+                media_store.release(old_media.name)
+                serializer.validated_data.pop('media_width', None)
+                serializer.validated_data.pop('media_height', None)
+                new_media = None
+            elif new_media and old_media:
+                media_store.release(old_media.name, instance.media_variants)
+
+            if new_media:
+                serializer.save(media_variants={}, media_placeholder='')
+                # Generate the resized variants of the new media in the background
+                image_variants.schedule_variants(image_variants.POST_MEDIA, instance.id)
+            else:
+                self.perform_update(serializer)
 
         return Response(serializer.data)
 
@@ -140,13 +161,15 @@ class PostDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         if instance.user != self.request.user:
             raise PermissionDenied("You don't have permission to delete this post.")
 
-        default_storage.delete(instance.media.name)
-
-        instance.delete()
+        # Queue the media and its variants for deletion from the AWS S3 bucket if no other post or user uses it
+        with transaction.atomic():
+            media_store.release(instance.media.name, instance.media_variants)
+            instance.delete()
 
         # Decrement the num_posts counter for the user using F object
         self.request.user.num_posts = F('num_posts') - 1
         self.request.user.save()  # Save the user object with the updated counter
+        sharded_counters.journal_changes(User, [self.request.user.id])
 
 
 # Endpoint: /api/post/{post_id}/like/
@@ -169,9 +192,8 @@ def like_post(request, post_id):
             # Create the like relationship between the requesting user and the post
             post.likes.add(request.user)
 
-            # Increment the counter for the like count
-            post.like_count = F('like_count') + 1
-            post.save()  # Save the post to update the counter
+            # Increment the counter for the like count (through counter slots if the post is hot)
+            sharded_counters.add(Post, post.id, 'like_count', 1)
 
             # Create a new_like notification for the post author
             notification = Notification.objects.create(
@@ -192,8 +214,8 @@ def like_post(request, post_id):
                     "recipient": str(post.user.id),
                     "sender": str(request.user.id),
                     "message": f"{request.user.username} liked your post",
-                    "sender_profile_picture_url": request.user.profile_picture.url if request.user.profile_picture else None,
-                    "post_media_url": post.media.url if post.media else None,
+                    "sender_profile_picture_url": image_variants.variant_url(request.user, image_variants.PROFILE_PICTURE, 'thumbnail'),
+                    "post_media_url": image_variants.variant_url(post, image_variants.POST_MEDIA, 'thumbnail'),
                 }
             )
     except Exception as e:
@@ -223,9 +245,8 @@ def unlike_post(request, post_id):
             # Remove the like
             post.likes.remove(request.user)
 
-            # Decrement the counter for the like count
-            post.like_count = F('like_count') - 1
-            post.save()  # Save the post to update the counter
+            # Decrement the counter for the like count (through counter slots if the post is hot)
+            sharded_counters.add(Post, post.id, 'like_count', -1)
 
             # Find the corresponding 'new_like' notification
             notification = Notification.objects.filter(
@@ -301,7 +322,7 @@ class SearchHashtagPostsView(generics.ListAPIView):
 
         try:
             # Search for paginated posts with the specified hashtag and a public visibility
-            matched_posts = Post.objects.filter(hashtags=hashtag, visibility='public').only('id', 'media')
+            matched_posts = Post.objects.filter(hashtags=hashtag, visibility='public').only('id', 'media', 'media_variants', 'media_width', 'media_height', 'media_placeholder', 'like_count', 'comment_count')
             return matched_posts
         except Exception as e:
             # Handle unexpected errors
@@ -333,10 +354,12 @@ class ExplorePageView(generics.ListAPIView):
 
     def get_queryset(self):
         try:
-            # user__follower__follower=self.request.user excludes posts made by authors the requesting user is following
-            explore_posts = Post.objects.filter(visibility='public').exclude(
-                Q(user__follower__follower=self.request.user) | Q(user=self.request.user)
-            )
+            # Exclude posts made by the requesting user and by authors they follow or requested to follow
+            # (from the cached follow graph instead of joining Follow)
+            excluded_user_ids = [self.request.user.id,
+                                 *follow_graph.get_following_ids(self.request.user.id),
+                                 *follow_graph.get_pending_sent_ids(self.request.user.id)]
+            explore_posts = Post.objects.filter(visibility='public').exclude(user_id__in=excluded_user_ids)
             return explore_posts
         except Exception as e:
             # Handle unexpected errors
@@ -371,7 +394,7 @@ class PostLikersView(generics.ListAPIView):
             raise NotFound("Post not found")
 
         try:
-            users = post.likes.only('id', 'username', 'profile_picture')
+            users = post.likes.only('id', 'username', 'profile_picture', 'profile_picture_variants')
             return users
         except Exception as e:
             raise APIException()
@@ -0,0 +1,30 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from core.Services.presence_registry import get_presence, MAX_PRESENCE_LOOKUP
+
+
+# Endpoint: /api/presence/?user_ids={},{},{}
+# API view to get the online status and last seen time of a list of users in a single request
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def bulk_presence(request):
+    user_ids_query = request.query_params.get('user_ids', '')
+
+    try:
+        user_ids = [int(user_id) for user_id in user_ids_query.split(',') if user_id.strip()]
+    except ValueError:
+        return Response({"error": "user_ids must be a comma separated list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not user_ids:
+        return Response({"error": "At least one user id is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if len(user_ids) > MAX_PRESENCE_LOOKUP:
+        return Response({"error": f"A maximum of {MAX_PRESENCE_LOOKUP} users can be looked up at once"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    presence = get_presence(user_ids)
+
+    return Response({str(user_id): user_presence for user_id, user_presence in presence.items()}, status=status.HTTP_200_OK)
@@ -0,0 +1,52 @@
+from rest_framework import generics, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+# lets you directly manipulate database fields within database queries, leading to more efficient operations
+from django.db.models import F
+# Get the User model configured for this Django project
+from django.contrib.auth import get_user_model
+
+from core.models import Follow
+from core.serializers import UserSuggestionSerializer
+from core.Pagination_Classes.paginations import SmallPagination
+
+
+User = get_user_model()
+
+
+# Endpoint: /api/suggestions/users/?page={}
+# API view to get the "who to follow" suggestions of the requesting user, precomputed by the build_user_suggestions command
+class UserSuggestionListView(generics.ListAPIView):
+    serializer_class = UserSuggestionSerializer
+    pagination_class = SmallPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        try:
+            # Get the suggested users by relevance, leaving out the users the requesting user followed
+            # (or sent a follow request to) since the suggestions were built
+            return (
+                User.objects.filter(suggested_to__user_id=self.request.user.id)
+                .exclude(id__in=Follow.objects.filter(follower_id=self.request.user.id).values('following_id'))
+                .annotate(score=F('suggested_to__score'), mutual_count=F('suggested_to__mutual_count'))
+                .only('id', 'username', 'profile_picture', 'profile_picture_variants')
+                .order_by('-score', 'id')
+            )
+        except Exception as e:
+            raise APIException()
+
+    def list(self, request, *args, **kwargs):
+        try:
+            queryset = self.get_queryset()
+        except APIException as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
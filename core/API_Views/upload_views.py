@@ -0,0 +1,42 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from core.Services import direct_uploads
+
+
+# Endpoint: /api/uploads/
+# API view to open a direct upload of an image to the storage bucket.
+# Request body: purpose ("post_media" or "profile_picture"), filename, content_type, size (in bytes) and optionally
+# sha256 (hex SHA-256 of the file, lets the storage verify the upload and duplicate images be stored once).
+# The client PUTs the file to upload_url with the returned headers, then sends the returned id as "upload_id" when
+# creating the post, or as "profile_picture_upload_id" when updating the user
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload_session(request):
+    try:
+        size = int(request.data.get('size'))
+    except (TypeError, ValueError):
+        return Response({"error": "size must be the size of the file in bytes"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        session, upload_url, headers = direct_uploads.create_session(
+            request.user,
+            request.data.get('purpose'),
+            request.data.get('filename'),
+            request.data.get('content_type'),
+            size,
+            request.data.get('sha256'),
+        )
+    except direct_uploads.UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'id': session.id,
+        'key': session.key,
+        'upload_url': upload_url,
+        'method': 'PUT',
+        'headers': headers,
+        'expires_at': session.expires_at,
+    }, status=status.HTTP_201_CREATED)
@@ -6,21 +6,18 @@ from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.parsers import MultiPartParser, JSONParser
 
-# Atomic transactions ensure that a series of database operations are completed together or not at all, maintaining data integrity.
-from django.db import transaction, DatabaseError, IntegrityError
-# Managing file uploads and storage
-from django.core.files.storage import default_storage
+from django.db import DatabaseError, IntegrityError, transaction
 # Get the User model configured for this Django project
 from django.contrib.auth import get_user_model
 
-# Accessing Django Channels' channel layer for WebSocket integration
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-from core.models import Post, Follow, Notification
-from core.serializers import UserSerializer, PostSerializer, PostSerializerMinimal, FollowSerializerMinimal
+from core.models import Post, Follow
+from core.serializers import UserSerializer, PostSerializer, PostSerializerMinimal, FollowSerializerMinimal, complete_image
 from core.Custom_Permission_Classes.checkOwner import IsOwnerOrReadOnly
-from .api_utility_functions import update_follow_counters, notify_user
+from core.Services import follow_graph, image_variants, media_store, mentions, sharded_counters
+from core.Services.follow_request_acceptance import (
+    accept_all_pending_follow_requests, schedule_pending_follow_acceptance, INLINE_ACCEPT_LIMIT
+)
+from .api_utility_functions import search_users_by_username
 from core.Pagination_Classes.paginations import LargePagination, SmallPagination
 
 
@@ -59,11 +56,14 @@ class UserListCreateView(generics.ListCreateAPIView):
 
         # Obtain the password from the validated data to be hashed
         password = serializer.validated_data['password']
-        # Create the user instance using all fields from request data
-        user = User(**serializer.validated_data)
-        user.set_password(password)  # Hash the password
         try:
-            user.save()
+            # Store the profile picture in the same transaction as the user, so a failed save releases it
+            with transaction.atomic():
+                complete_image(serializer, 'profile_picture', 'profile_picture_upload_id')
+                # Create the user instance using all fields from request data
+                user = User(**serializer.validated_data)
+                user.set_password(password)  # Hash the password
+                user.save()
         except IntegrityError as e:
             # Check if it's an email or username duplicate error
             if 'unique constraint' in str(e):
@@ -76,6 +76,13 @@ class UserListCreateView(generics.ListCreateAPIView):
                 # Handle other IntegrityErrors if necessary
                 raise e  # Raise the original IntegrityError
 
+        # The username may have been remembered as not belonging to anyone by the mention index
+        mentions.forget_usernames(user.username)
+
+        # Generate the resized variants of the profile picture in the background
+        if user.profile_picture:
+            image_variants.schedule_variants(image_variants.PROFILE_PICTURE, user.id)
+
         # Save the serializer after creating the user
         serializer.instance = user
         headers = self.get_success_headers(serializer.data)
@@ -105,20 +112,45 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
     def perform_update(self, serializer):
         instance = serializer.instance
 
-        new_profile_picture = serializer.validated_data.get('profile_picture')
-
-        # Delete the old profile picture from the AWS S3 bucket if the user is updating it
-        if new_profile_picture and instance.profile_picture:
-            default_storage.delete(instance.profile_picture.name)
+        old_username = instance.username
+
+        # Complete the direct upload of the new profile picture (if any) and release the old profile picture, queueing
+        # it and its variants for deletion from the AWS S3 bucket if nothing else uses it, in the same transaction as
+        # the update
+        with transaction.atomic():
+            complete_image(serializer, 'profile_picture', 'profile_picture_upload_id')
+            new_profile_picture = serializer.validated_data.get('profile_picture')
+            if new_profile_picture and instance.profile_picture and new_profile_picture == instance.profile_picture.name:
+                # The same image was uploaded again, drop the extra reference and keep its variants and metadata
+                media_store.release(instance.profile_picture.name)
+                serializer.validated_data.pop('profile_picture_width', None)
+                serializer.validated_data.pop('profile_picture_height', None)
+                new_profile_picture = None
+            elif new_profile_picture and instance.profile_picture:
+                media_store.release(instance.profile_picture.name, instance.profile_picture_variants)
+
+            # Perform the update
+            if new_profile_picture:
+                serializer.save(partial=True, profile_picture_variants={}, profile_picture_placeholder='')
+                # Generate the resized variants of the new profile picture in the background
+                image_variants.schedule_variants(image_variants.PROFILE_PICTURE, instance.id)
+            else:
+                serializer.save(partial=True)
 
-        # Perform the update
-        serializer.save(partial=True)
+        # Drop both usernames from the mention index if the username changed
+        if instance.username != old_username:
+            mentions.forget_usernames(old_username, instance.username)
 
     # Custom logic for deleting a post
     def perform_destroy(self, instance):
-        # Delete the profile picture associated with the user from the AWS S3 Bucket
-        default_storage.delete(instance.profile_picture.name)
-        instance.delete()
+        with transaction.atomic():
+            # Release the profile picture and the media of the posts deleted along with the user, queueing the files
+            # nothing else uses for deletion from the AWS S3 Bucket
+            post_media = instance.user_posts.values_list('media', 'media_variants').iterator()
+            media_store.release_many([(instance.profile_picture.name, instance.profile_picture_variants), *post_media])
+            instance.delete()
+        # Mentions of the deleted user's username shouldn't resolve to them anymore
+        mentions.forget_usernames(instance.username)
 
 
 # Endpoint: /api/login/
@@ -162,11 +194,9 @@ class UserFeedView(generics.ListAPIView):
 
     def get_queryset(self):
         try:
-            # Get posts created by users the requesting user follows
-            feed_posts = Post.objects.filter(
-                user__follower__follower_id=self.request.user.id,
-                user__follower__follow_status='accepted'
-            )
+            # Get posts created by users the requesting user follows (from the cached follow graph instead of joining Follow)
+            following_ids = follow_graph.get_following_ids(self.request.user.id)
+            feed_posts = Post.objects.filter(user_id__in=list(following_ids))
             return feed_posts
         except Exception as e:
             # Handle unexpected errors
@@ -199,29 +229,46 @@ def user_profile(request, user_id):
 
     follow_status = False  # Keeps track of the requesting user's follow relationship to the user they are viewing
     can_view = True  # Keeps track of whether the requesting user can view this user's profile or not
+    followed_by = None  # Keeps track of the users the requesting user follows that also follow the user they are viewing
 
     # Check if the user is attempting to view their own profile
     if request.user.id == user_id:
         follow_status = "self"
     else:
-        follow_instance = request.user.following.filter(following=user).first()
-        if follow_instance:
-            follow_status = follow_instance.follow_status
+        follow_status = follow_graph.ViewerFollowState(request.user.id).status_of(user.id)
 
         if user.profile_privacy == 'private' and (follow_status is False or follow_status == 'pending'):
             can_view = False
 
+        # Get the number of mutual follows and a few of them to show as "Followed by ..."
+        mutual_count, mutual_ids = follow_graph.get_mutual_follows(request.user.id, user.id, user.num_followers)
+        mutual_users = User.objects.only('id', 'username', 'profile_picture', 'profile_picture_variants').in_bulk(mutual_ids) if mutual_ids else {}
+        followed_by = {
+            'count': mutual_count,
+            'users': [
+                {
+                    'id': mutual_user.id,
+                    'username': mutual_user.username,
+                    'profile_picture': image_variants.variant_url(mutual_user, image_variants.PROFILE_PICTURE, 'thumbnail'),
+                }
+                for mutual_user in (mutual_users.get(mutual_id) for mutual_id in mutual_ids) if mutual_user
+            ],
+        }
+
+    counters = sharded_counters.get_many([user], ('num_followers', 'num_following'))
+
     # Initialize the response_data dictionary
     response_data = {
         'username': user.username,
         'first_name': user.first_name,
         'last_name': user.last_name,
-        'profile_picture': user.profile_picture.url if user.profile_picture else None,
+        'profile_picture': image_variants.variant_url(user, image_variants.PROFILE_PICTURE, 'medium'),
         'bio': user.bio,
         'follow_status': follow_status,
+        'followed_by': followed_by,
         'can_view': can_view,
-        'num_followers': user.num_followers,
-        'num_following': user.num_following,
+        'num_followers': counters[(user.id, 'num_followers')],
+        'num_following': counters[(user.id, 'num_following')],
         'num_posts': user.num_posts,
         'posts': None,  # Initialize 'posts' as None
     }
@@ -232,7 +279,7 @@ def user_profile(request, user_id):
             paginator = LargePagination()
 
             # Paginate the queryset of the user's posts
-            users_posts = Post.objects.filter(user_id=user.id).only('id', 'media')
+            users_posts = Post.objects.filter(user_id=user.id).only('id', 'media', 'media_variants', 'media_width', 'media_height', 'media_placeholder', 'like_count', 'comment_count')
             page = paginator.paginate_queryset(users_posts, request)
 
             serializer = PostSerializerMinimal(page, many=True, context={'request': request})
@@ -277,48 +324,24 @@ def change_profile_privacy(request):
     if new_privacy != old_privacy:
         user.user_posts.filter(visibility=old_privacy).only('id', 'visibility').update(visibility=new_privacy)
 
-    # If user changes profile to public, accept all pending follow requests
+    # If user changes profile to public, accept all pending follow requests with set-based updates.
+    # Large backlogs are accepted by a background job so the request doesn't time out
+    accepting_in_background = False
     if new_privacy == 'public':
-        pending_follow_requests = Follow.objects.filter(following_id=user.id, follow_status='pending').select_related('follower', 'following')
-        for follow_request in pending_follow_requests:
+        pending_count = Follow.objects.filter(following_id=user.id, follow_status='pending').count()
+        if pending_count > INLINE_ACCEPT_LIMIT:
+            schedule_pending_follow_acceptance(user.id)
+            accepting_in_background = True
+        elif pending_count:
             try:
-                with transaction.atomic():
-                    follow_request.follow_status = 'accepted'
-                    follow_request.save()
-
-                    # Update the num_followers and num_following counters for the users
-                    update_follow_counters(follow_request.following, follow_request.follower)
-
-                    # Get the original follow_request notification to update it based on the selected user action
-                    notification = Notification.objects.only('id').get(recipient_id=follow_request.following.id,
-                                                            sender_id=follow_request.follower.id,
-                                                            notification_type='follow_request')
-
-                    # Update the original "follow_request" notification to "new_follower"
-                    notification.notification_type = 'new_follower'
-                    notification.save()
-
-                    # Notify user that changed their profile privacy to public of their new followers
-                    notify_user(follow_request.following, follow_request.follower, 'new_follower', "started following you")
-                    # Notify the users who had the pending follow requests that their follow request was accepted
-                    notify_user(follow_request.follower, follow_request.following, 'follow_accept', "accepted your follow request")
-
-                    # Notify the user who accepted the request via WebSocket (to apply necessary changes to their front-end)
-                    channel_layer = get_channel_layer()
-                    async_to_sync(channel_layer.group_send)(
-                        f"notifications_{follow_request.following.id}",
-                        {
-                            "type": "notification_follow_request_action",
-                            "action": "accept",
-                            "unique_identifier": str(notification.id),
-                        }
-                    )
+                accept_all_pending_follow_requests(user.id)
             except Exception as e:
-                # Log the exception, but continue processing other follow requests
-                print(f"Error processing follow request: {e}")
-                continue  # Move to the next follow request
+                # The privacy change is kept, remaining requests are picked up by the accept_pending_follow_requests command
+                return Response({"error": "An error occurred while accepting the pending follow requests"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return Response({'success': 'Profile privacy updated successfully'}, status=status.HTTP_200_OK)
+    return Response({'success': 'Profile privacy updated successfully',
+                     'accepting_follow_requests_in_background': accepting_in_background}, status=status.HTTP_200_OK)
 
 
 # Endpoint: /api/search/users/?username={}&page={}
@@ -335,8 +358,8 @@ class SearchUsersView(generics.ListAPIView):
             return User.objects.none()
 
         try:
-            # Search for users based on username
-            queryset = User.objects.filter(username__icontains=username).only('username', 'profile_picture')
+            # Search for users based on username, ordered by relevance
+            queryset = search_users_by_username(User.objects.only('username', 'profile_picture', 'profile_picture_variants'), username)
             return queryset
         except Exception as e:
             # Handle unexpected errors
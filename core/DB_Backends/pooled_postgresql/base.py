@@ -0,0 +1,35 @@
+import functools
+
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from . import pool
+from .creation import DatabaseCreation
+
+
+# PostgreSQL backend taking its connections from a per-process pool (see pool) instead of opening a new connection
+# every time Django connects, and giving them back instead of closing them.
+# Used with CONN_MAX_AGE = 0, so every request and every database_sync_to_async call returns its connection to the
+# pool when Django closes it, and connections are shared by all the threads of the process instead of being kept by
+# threads that may not use the database again (ex: the threads of the executor of database_sync_to_async).
+# The pool settings are read from the POOL dict of the database settings (see pool.DEFAULTS).
+class DatabaseWrapper(PostgreSQLDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        # Connections opened with different parameters (ex: to the test database) are kept in different pools
+        key = (self.alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+        return pool.get_pool(key, self.settings_dict.get('POOL'))
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).acquire(functools.partial(super().get_new_connection, conn_params))
+        # Set by the parent's get_new_connection for new connections only, connections from the pool kept their level
+        self.isolation_level = IsolationLevel(self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED))
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # A connection that failed may be broken, it is checked before going back to the pool
+                discard = self.errors_occurred and not self.is_usable()
+                self.get_pool(self.get_connection_params()).release(self.connection, discard=discard)
@@ -0,0 +1,11 @@
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgreSQLDatabaseCreation
+
+from . import pool
+
+
+class DatabaseCreation(PostgreSQLDatabaseCreation):
+    # PostgreSQL can't drop a database with open connections, the test database's connections kept by the pool are
+    # closed first
+    def _destroy_test_db(self, test_database_name, verbosity):
+        pool.close_idle_connections()
+        super()._destroy_test_db(test_database_name, verbosity)
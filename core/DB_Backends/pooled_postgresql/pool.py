@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from collections import deque
+
+from psycopg2 import extensions, OperationalError
+
+from core.Services import metrics
+
+
+# Process-wide pool of PostgreSQL connections shared by the threads of a worker process.
+# Django keeps one connection per thread and closes it at the end of every request (and every database_sync_to_async
+# call in the consumers, which run in a thread executor), so without a pool every request pays for a new connection
+# (TCP and TLS handshakes, authentication, backend process startup). The pooled backend takes connections from this
+# pool instead and gives them back when Django closes them. A connection is only ever used by one thread at a time.
+
+# Default pool settings, overridden by the POOL dict of the database settings
+DEFAULTS = {
+    # Number of connections kept open when idle, and maximum number of connections open at once in the process.
+    # MAX_SIZE should be at least the number of threads that use the database (ex: the thread executor of
+    # database_sync_to_async), or threads will wait for each other
+    'MIN_SIZE': 0,
+    'MAX_SIZE': 10,
+    # Seconds a thread waits for a free connection before giving up with an OperationalError
+    'TIMEOUT': 10,
+    # Connections idle for longer than this many seconds are checked with a query before being handed out
+    'HEALTH_CHECK_INTERVAL': 30,
+    # Connections above MIN_SIZE idle for longer than this many seconds are closed
+    'MAX_IDLE': 5 * 60,
+    # Connections are closed and replaced after this many seconds, so server side memory doesn't grow forever
+    'MAX_LIFETIME': 60 * 60,
+}
+
+
+# Connection kept by the pool, with the times it was opened and last returned
+class _PooledConnection:
+    __slots__ = ('connection', 'opened_at', 'released_at')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.opened_at = self.released_at = time.monotonic()
+
+
+class ConnectionPool:
+    def __init__(self, options=None):
+        self.options = {**DEFAULTS, **(options or {})}
+        self._condition = threading.Condition()
+        self._idle = deque()  # Idle connections, the most recently returned last
+        self._in_use = {}  # Pooled connections handed out, by connection id
+        self._opening = 0  # Connections being opened, counted in the size of the pool
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    # Take a connection from the pool, opening one with connect() if none is idle and the pool isn't full, or waiting
+    # for one to be returned otherwise. Raises OperationalError if no connection is available within TIMEOUT seconds
+    def acquire(self, connect):
+        start = time.monotonic()
+        deadline = start + self.options['TIMEOUT']
+        while True:
+            with self._condition:
+                while True:
+                    pooled = self._take_idle()
+                    if pooled is not None:
+                        break
+                    if self.size < self.options['MAX_SIZE']:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.increment('db_pool_timeouts')
+                        raise OperationalError(f"No database connection available within {self.options['TIMEOUT']} seconds, "
+                                               f"all {self.options['MAX_SIZE']} connections of the pool are in use")
+                    self._condition.wait(remaining)
+
+            if pooled is None:
+                pooled = self._open(connect)
+                break
+            # Checked outside of the lock, the check may wait on the network
+            if self._is_healthy(pooled):
+                break
+            with self._condition:
+                del self._in_use[id(pooled.connection)]
+                self._discard(pooled)
+                self._condition.notify()
+
+        metrics.observe('db_pool_wait_ms', (time.monotonic() - start) * 1000)
+        metrics.adjust_gauge('db_pool_connections_in_use', 1)
+        return pooled.connection
+
+    # Open a new connection counted in self._opening
+    def _open(self, connect):
+        try:
+            pooled = _PooledConnection(connect())
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._in_use[id(pooled.connection)] = pooled
+        metrics.increment('db_pool_connections_opened')
+        metrics.adjust_gauge('db_pool_connections_open', 1)
+        return pooled
+
+    # Take the most recently returned idle connection, closing the idle connections past their lifetime.
+    # Called with the lock held
+    def _take_idle(self):
+        now = time.monotonic()
+        while self._idle:
+            pooled = self._idle.pop()
+            if pooled.connection.closed or now - pooled.opened_at > self.options['MAX_LIFETIME']:
+                self._discard(pooled)
+                continue
+            self._in_use[id(pooled.connection)] = pooled
+            return pooled
+        return None
+
+    # Check a connection before handing it out, with a query if it was idle for a while (the server or a proxy may
+    # have closed it in the meantime)
+    def _is_healthy(self, pooled):
+        connection = pooled.connection
+        if connection.closed or connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - pooled.released_at < self.options['HEALTH_CHECK_INTERVAL']:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except Exception:
+            metrics.increment('db_pool_health_check_failures')
+            return False
+
+    # Close a connection leaving the pool. Called with the lock held or with a connection not in the pool anymore
+    def _discard(self, pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+        metrics.increment('db_pool_connections_closed')
+        metrics.adjust_gauge('db_pool_connections_open', -1)
+
+    # Give a connection back to the pool. Connections left in a transaction are rolled back, broken connections
+    # (or all connections if discard is True) are closed
+    def release(self, connection, discard=False):
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+        if pooled is None:
+            # Not opened by this pool (ex: the pool was reset after a fork)
+            connection.close()
+            return
+        metrics.adjust_gauge('db_pool_connections_in_use', -1)
+
+        if not discard and not connection.closed:
+            transaction_status = connection.get_transaction_status()
+            if transaction_status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR):
+                try:
+                    connection.rollback()
+                except Exception:
+                    discard = True
+            elif transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                discard = True
+
+        with self._condition:
+            if discard or connection.closed:
+                self._discard(pooled)
+            else:
+                pooled.released_at = time.monotonic()
+                self._idle.append(pooled)
+                self._trim_idle(pooled.released_at)
+            self._condition.notify()
+
+    # Close the connections above MIN_SIZE that have been idle for more than MAX_IDLE seconds. Called with the lock held
+    def _trim_idle(self, now):
+        while len(self._idle) > self.options['MIN_SIZE'] and now - self._idle[0].released_at > self.options['MAX_IDLE']:
+            self._discard(self._idle.popleft())
+
+    # Close the idle connections, connections in use are closed when given back
+    def close_idle(self):
+        with self._condition:
+            while self._idle:
+                self._discard(self._idle.popleft())
+
+    # Get the state of the pool
+    def stats(self):
+        with self._condition:
+            return {'idle': len(self._idle), 'in_use': len(self._in_use), 'max_size': self.options['MAX_SIZE']}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = None
+
+
+# Get the pool of the connections opened with the given parameters, creating it on first use. Pools are per process,
+# a forked process (ex: a worker of a preforking server) starts with empty pools instead of sharing connections
+def get_pool(key, options):
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(options)
+        return pool
+
+
+# Close the idle connections of every pool of the process (ex: before dropping a database)
+def close_idle_connections():
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    for pool in pools:
+        pool.close_idle()
@@ -0,0 +1,118 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.authtoken.models import Token
+
+
+# Routing of reads to the read replicas.
+# Reads made while handling a GET (or HEAD / OPTIONS) request go to a replica, everything else goes to the primary:
+# writes, reads in other requests (their reads validate the writes that follow), reads in a transaction, and reads
+# outside of requests (consumers, commands). Tokens are always read from the primary, a token created on login must
+# work on the next request.
+# Replicas lag behind the primary, so after a client writes, its reads stay on the primary for STICKY_SECONDS:
+# replica_routing_middleware records the write in the cache under the client's token (or session user), and sends the
+# client's next requests to the primary while the record exists, so users see their own new posts and comments.
+
+# Aliases of the replica databases, each request reads from one picked at random
+REPLICAS = list(getattr(settings, 'DATABASE_REPLICAS', []))
+# Seconds a client's reads stay on the primary after it writes, longer than the usual replication lag
+STICKY_SECONDS = getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 10)
+# Requests whose reads can go to a replica
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+# Routing state of the request being handled: the replica its reads go to (None for the primary) and whether it wrote.
+# A mutable object set once per request, so a write routed in a thread of the request (ex: by a sync view under ASGI)
+# is seen by the middleware whatever context the thread ran in
+class _RoutingState:
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+
+
+_state = ContextVar('replica_routing_state', default=None)
+
+
+def _sticky_key(client_key):
+    return f"db_primary_sticky_{hashlib.sha256(client_key.encode()).hexdigest()[:32]}"
+
+
+# Get the key identifying the client of a request for stickiness: its token, or its session cookie (admin)
+def _client_key(request):
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) == 2 and parts[0].lower() == 'token':
+        return f"token:{parts[1]}"
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    return f"session:{session_key}" if session_key else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or model is Token or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # The rest of the request reads its own writes
+            state.replica = None
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    # Replicas hold the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    # Replicas get their schema from the primary through replication
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in REPLICAS
+
+
+# Start routing a request, returns its routing state. The replica is picked once, so all the reads of the request
+# see the same replication state
+def _start(request, sticky):
+    use_replica = bool(REPLICAS) and request.method in READ_METHODS and not sticky
+    return _RoutingState(random.choice(REPLICAS) if use_replica else None)
+
+
+# Middleware setting the routing state of every request, for sync and async views
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            client_key = _client_key(request)
+            sticky = bool(REPLICAS) and client_key is not None and await cache.aget(_sticky_key(client_key)) is not None
+            state = _start(request, sticky)
+            context_token = _state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                _state.reset(context_token)
+            if state.wrote and client_key is not None and REPLICAS:
+                await cache.aset(_sticky_key(client_key), True, STICKY_SECONDS)
+            return response
+    else:
+        def middleware(request):
+            client_key = _client_key(request)
+            sticky = bool(REPLICAS) and client_key is not None and cache.get(_sticky_key(client_key)) is not None
+            state = _start(request, sticky)
+            context_token = _state.set(state)
+            try:
+                response = get_response(request)
+            finally:
+                _state.reset(context_token)
+            if state.wrote and client_key is not None and REPLICAS:
+                cache.set(_sticky_key(client_key), True, STICKY_SECONDS)
+            return response
+    return middleware
@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 
 class LargePagination(PageNumberPagination):
@@ -11,3 +11,11 @@ class SmallPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 20
+
+
+# Cursor pagination for message search results, ordered by relevance and then by most recent message
+class MessageSearchPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-rank', '-id')
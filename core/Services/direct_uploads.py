@@ -0,0 +1,216 @@
+import base64
+import io
+import os
+import re
+from datetime import timedelta
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from core.models import UploadSession, post_media_upload, user_profile_picture_upload
+from core.Services import image_processing, media_store, storage_deletions
+
+
+# Direct uploads of images to the storage bucket.
+# Instead of streaming the image through an API worker, the client opens an upload session, PUTs the file straight
+# to the bucket with the presigned URL of the session, then creates its post (or updates its profile) with the id of
+# the session. The session is verified against the uploaded object (size from a HEAD request, type from the file
+# signature in its first bytes) while the request is validated, then completed in the transaction saving its storage
+# key in the image field as is. The dimensions of the image are read from the same first bytes, which hold the image header.
+# Works with any S3 compatible storage, see AWS_S3_ENDPOINT_URL.
+# When the client declares the SHA-256 of the file, the storage rejects an upload with other content and completed
+# uploads are deduplicated like multipart uploads (see media_store): if the content is already stored, the uploaded
+# copy is deleted and the existing file is used.
+
+# Seconds the presigned URL of a session stays valid
+SESSION_EXPIRY = getattr(settings, 'UPLOAD_SESSION_EXPIRY_SECONDS', 15 * 60)
+# Largest file that can be uploaded, in bytes
+MAX_SIZE = getattr(settings, 'UPLOAD_MAX_SIZE_BYTES', 10 * 1024 * 1024)
+
+POST_MEDIA = 'post_media'
+PROFILE_PICTURE = 'profile_picture'
+
+# Function building the storage key of the uploads of each purpose, shared with the image fields
+UPLOAD_PATHS = {
+    POST_MEDIA: post_media_upload,
+    PROFILE_PICTURE: user_profile_picture_upload,
+}
+
+# Image types that can be uploaded, with their file extension and file signatures
+CONTENT_TYPES = {
+    'image/jpeg': ('.jpg', (b'\xff\xd8\xff',)),
+    'image/png': ('.png', (b'\x89PNG\r\n\x1a\n',)),
+    'image/gif': ('.gif', (b'GIF87a', b'GIF89a')),
+    'image/webp': ('.webp', ()),  # "RIFF", 4 bytes of size then "WEBP", checked separately
+}
+# Number of bytes read from the start of an uploaded object to check its signature and read its dimensions. Large
+# enough for the EXIF data that precedes the dimensions in JPEG files, images whose header doesn't fit get their
+# dimensions when their variants are generated
+HEADER_SIZE = 64 * 1024
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+# Error raised when an upload session can't be created or completed, its message is safe to show to the client
+class UploadError(Exception):
+    pass
+
+
+_client = None
+
+
+# Get the S3 client shared by the sessions (boto3 clients are thread safe)
+def _s3_client():
+    global _client
+    if _client is None:
+        _client = boto3.client(
+            's3',
+            endpoint_url=getattr(settings, 'AWS_S3_ENDPOINT_URL', None),
+            region_name=settings.AWS_REGION_NAME,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            config=Config(signature_version='s3v4'),
+        )
+    return _client
+
+
+# Detect the image type of a file from its first bytes, None if it isn't one of the accepted types
+def detect_content_type(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for content_type, (_, signatures) in CONTENT_TYPES.items():
+        if signatures and head.startswith(signatures):
+            return content_type
+    return None
+
+
+# Build the storage key of an upload from the client's file name, keeping it short enough for the image fields
+def _upload_key(purpose, filename, content_type):
+    extension, _ = CONTENT_TYPES[content_type]
+    stem, _ = os.path.splitext(os.path.basename(filename or ''))
+    stem = get_valid_filename(stem)[:40] if stem.strip() else 'upload'
+    return UPLOAD_PATHS[purpose](None, f"{stem}{extension}")
+
+
+# Convert a hex SHA-256 to the base64 form used by the S3 checksum headers
+def _checksum(sha256):
+    return base64.b64encode(bytes.fromhex(sha256)).decode()
+
+
+# Open an upload session for a user, sha256 optionally being the hex SHA-256 of the file.
+# Returns the session, the presigned URL to PUT the file to and the headers the PUT request has to be sent with
+def create_session(user, purpose, filename, content_type, size, sha256=None):
+    if purpose not in UPLOAD_PATHS:
+        raise UploadError(f"Invalid upload purpose, expected one of: {', '.join(UPLOAD_PATHS)}")
+    if content_type not in CONTENT_TYPES:
+        raise UploadError(f"Unsupported file type, expected one of: {', '.join(CONTENT_TYPES)}")
+    if not 0 < size <= MAX_SIZE:
+        raise UploadError(f"The file size must be between 1 and {MAX_SIZE} bytes")
+    sha256 = (sha256 or '').lower()
+    if sha256 and not SHA256_PATTERN.match(sha256):
+        raise UploadError("sha256 must be the hex SHA-256 of the file")
+
+    session = UploadSession.objects.create(
+        user=user,
+        purpose=purpose,
+        key=_upload_key(purpose, filename, content_type),
+        content_type=content_type,
+        size=size,
+        sha256=sha256,
+        expires_at=timezone.now() + timedelta(seconds=SESSION_EXPIRY),
+    )
+
+    # The content type, length and checksum are signed, so the PUT is rejected by the storage if the client sends others
+    params = {
+        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
+        'Key': session.key,
+        'ContentType': content_type,
+        'ContentLength': size,
+    }
+    headers = {'Content-Type': content_type}
+    if sha256:
+        params['ChecksumSHA256'] = headers['x-amz-checksum-sha256'] = _checksum(sha256)
+
+    upload_url = _s3_client().generate_presigned_url('put_object', Params=params, ExpiresIn=SESSION_EXPIRY, HttpMethod='PUT')
+    return session, upload_url, headers
+
+
+# Delete the session of an upload that failed verification so it can't be retried, and queue its object for deletion
+def _reject(session, message):
+    with transaction.atomic():
+        storage_deletions.delete_later([session.key])
+        session.delete()
+    raise UploadError(message)
+
+
+# Verify the uploaded object of a user's pending upload session, without completing it (see complete_upload).
+# Returns the session and the width and height of the image (None if they couldn't be read from its header)
+def verify_upload(upload_id, user, purpose):
+    session = UploadSession.objects.filter(id=upload_id, user_id=getattr(user, 'id', None), purpose=purpose).first()
+    if session is None:
+        raise UploadError("Upload not found")
+    if session.status != 'pending':
+        raise UploadError("This upload has already been used")
+    if session.expires_at <= timezone.now():
+        raise UploadError("This upload has expired")
+
+    client = _s3_client()
+    try:
+        head = client.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=session.key, ChecksumMode='ENABLED')
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            raise UploadError("The file has not been uploaded yet")
+        raise
+
+    if head['ContentLength'] != session.size or head['ContentLength'] > MAX_SIZE:
+        _reject(session, "The uploaded file doesn't have the declared size")
+
+    # Check the file signature rather than trusting the content type sent by the client
+    head_bytes = client.get_object(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=session.key, Range=f'bytes=0-{HEADER_SIZE - 1}',
+    )['Body'].read()
+    if detect_content_type(head_bytes) != session.content_type:
+        _reject(session, "The uploaded file is not a valid image of the declared type")
+    width, height = image_processing.read_size(io.BytesIO(head_bytes))
+
+    # Whether the storage verified the content of the file against the declared hash, used to deduplicate it
+    session.checksum_verified = bool(session.sha256) and head.get('ChecksumSHA256') == _checksum(session.sha256)
+    return session, width, height
+
+
+# Complete an upload session returned by verify_upload. Returns the storage key of the uploaded file, to be saved in
+# the image field the upload was made for. Must run in the transaction saving that field, so a failed save leaves the
+# session pending (its object is then deleted when the session expires) and releases the reference to the file
+def complete_upload(session):
+    # Complete the session with a conditional update, a concurrent request using the same session updates nothing
+    if not UploadSession.objects.filter(id=session.id, status='pending').update(status='completed'):
+        raise UploadError("This upload has already been used")
+
+    # Deduplicate the file if the storage verified its content against the declared hash
+    if getattr(session, 'checksum_verified', False):
+        return media_store.register(session.sha256, session.key, session.size)
+    return session.key
+
+
+# Delete the sessions that expired more than grace_seconds ago, queueing the objects uploaded to the sessions that
+# were never completed for deletion. Returns the number of sessions deleted
+def delete_expired_sessions(grace_seconds=60 * 60, batch_size=1000):
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    expired = UploadSession.objects.filter(expires_at__lt=cutoff)
+
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(expired.order_by('expires_at').values_list('id', 'key', 'status')[:batch_size])
+            if not batch:
+                return deleted
+
+            # The objects of completed sessions belong to the posts and profiles they were used for
+            storage_deletions.delete_later([key for _, key, session_status in batch if session_status == 'pending'])
+            deleted += UploadSession.objects.filter(id__in=[session_id for session_id, _, _ in batch]).delete()[0]
@@ -0,0 +1,227 @@
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from core.models import Follow
+
+
+# Cached follow graph adjacency service.
+# For every user we keep the ids of the users they follow, their followers, the follow requests they sent and the
+# follow requests they received, each as a sorted array of 64 bit integers (8 bytes per id when pickled in the cache).
+# Sets are versioned per user: every change to a user's follow relationships bumps their version (after the
+# transaction commits), so a set cached from a read that raced with a write is never served again.
+# Sets are read from the primary database: a read replica may not have the write that bumped the version yet, and the
+# stale set would be cached under the new version.
+
+FOLLOWING = 'following'  # Users the user follows (accepted)
+FOLLOWERS = 'followers'  # Users following the user (accepted)
+PENDING_SENT = 'pending_sent'  # Users the user sent a follow request to
+PENDING_RECEIVED = 'pending_received'  # Users that sent the user a follow request
+
+# Seconds an adjacency set stays in the cache
+FOLLOW_GRAPH_TTL = getattr(settings, 'FOLLOW_GRAPH_TTL_SECONDS', 60 * 60)
+# Number of sample users returned with a mutual follows count
+MUTUAL_FOLLOWS_SAMPLE_SIZE = getattr(settings, 'MUTUAL_FOLLOWS_SAMPLE_SIZE', 3)
+# Number of followers above which the mutual follows of a user are looked up in the Follow table instead of
+# loading the user's whole follower set
+MUTUAL_FOLLOWS_MAX_SET_SIZE = getattr(settings, 'MUTUAL_FOLLOWS_MAX_SET_SIZE', 100000)
+
+# Query used to build each adjacency set: (field filtered by the user's id, status, field holding the neighbour ids)
+_SET_QUERIES = {
+    FOLLOWING: ('follower_id', 'accepted', 'following_id'),
+    FOLLOWERS: ('following_id', 'accepted', 'follower_id'),
+    PENDING_SENT: ('follower_id', 'pending', 'following_id'),
+    PENDING_RECEIVED: ('following_id', 'pending', 'follower_id'),
+}
+
+
+def _version_key(user_id):
+    return f"follow_graph_version_{user_id}"
+
+
+def _set_key(user_id, kind, version):
+    return f"follow_graph_{kind}_{user_id}_v{version}"
+
+
+def _mutual_key(viewer_id, viewer_version, user_id, user_version):
+    return f"follow_graph_mutual_{viewer_id}_v{viewer_version}_{user_id}_v{user_version}"
+
+
+# Get the current version of a user's follow graph
+def get_version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Start from the current time so a version key evicted from the cache never reuses an older version
+        cache.add(_version_key(user_id), int(time.time() * 1000), None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+# Load an adjacency set of a user, from the cache if possible or from the Follow table otherwise
+def get_ids(user_id, kind):
+    key = _set_key(user_id, kind, get_version(user_id))
+    ids = cache.get(key)
+    if ids is None:
+        user_field, follow_status, neighbour_field = _SET_QUERIES[kind]
+        ids = array('q', Follow.objects.using(DEFAULT_DB_ALIAS).filter(**{user_field: user_id, 'follow_status': follow_status})
+                    .order_by(neighbour_field).values_list(neighbour_field, flat=True))
+        cache.set(key, ids, FOLLOW_GRAPH_TTL)
+    return ids
+
+
+def get_following_ids(user_id):
+    return get_ids(user_id, FOLLOWING)
+
+
+def get_follower_ids(user_id):
+    return get_ids(user_id, FOLLOWERS)
+
+
+def get_pending_sent_ids(user_id):
+    return get_ids(user_id, PENDING_SENT)
+
+
+def get_pending_received_ids(user_id):
+    return get_ids(user_id, PENDING_RECEIVED)
+
+
+# Check if an id is in a sorted adjacency set
+def contains(ids, user_id):
+    index = bisect_left(ids, user_id)
+    return index < len(ids) and ids[index] == user_id
+
+
+# Get the sorted ids present in both sorted adjacency sets
+def intersect(ids, other_ids):
+    # Look up every id of the smaller set in the larger one
+    smaller, larger = (ids, other_ids) if len(ids) <= len(other_ids) else (other_ids, ids)
+    return [user_id for user_id in smaller if contains(larger, user_id)]
+
+
+# Check if a user follows (accepted) another user
+def is_following(follower_id, following_id):
+    return contains(get_following_ids(follower_id), following_id)
+
+
+# Get the users followed by a viewer that also follow another user ("followed by ..." on a profile).
+# Returns the number of mutual follows and the ids of a few of them.
+# Cached per viewer and user pair under both of their graph versions, so a follow change by either user invalidates it.
+# followers_count is the user's follower counter, used to avoid loading the follower set of very popular users
+def get_mutual_follows(viewer_id, user_id, followers_count=None, sample_size=MUTUAL_FOLLOWS_SAMPLE_SIZE):
+    key = _mutual_key(viewer_id, get_version(viewer_id), user_id, get_version(user_id))
+    mutual = cache.get(key)
+    if mutual is None:
+        following = get_following_ids(viewer_id)
+        if not following:
+            mutual = (0, [])
+        elif followers_count is not None and followers_count > MUTUAL_FOLLOWS_MAX_SET_SIZE:
+            # Probe the Follow table with the viewer's (much smaller) following set instead
+            mutual_ids = Follow.objects.using(DEFAULT_DB_ALIAS).filter(
+                following_id=user_id, follow_status='accepted', follower_id__in=list(following)
+            ).order_by('follower_id').values_list('follower_id', flat=True)
+            mutual = (mutual_ids.count(), list(mutual_ids[:sample_size]))
+        else:
+            mutual_ids = intersect(following, get_follower_ids(user_id))
+            mutual = (len(mutual_ids), mutual_ids[:sample_size])
+        cache.set(key, mutual, FOLLOW_GRAPH_TTL)
+    return mutual
+
+
+# Async versions of the lookups above for async views, using the async cache and ORM APIs
+async def aget_version(user_id):
+    version = await cache.aget(_version_key(user_id))
+    if version is None:
+        await cache.aadd(_version_key(user_id), int(time.time() * 1000), None)
+        version = await cache.aget(_version_key(user_id))
+    return version
+
+
+async def aget_ids(user_id, kind):
+    key = _set_key(user_id, kind, await aget_version(user_id))
+    ids = await cache.aget(key)
+    if ids is None:
+        user_field, follow_status, neighbour_field = _SET_QUERIES[kind]
+        ids = array('q', [neighbour_id async for neighbour_id in Follow.objects.using(DEFAULT_DB_ALIAS).filter(
+            **{user_field: user_id, 'follow_status': follow_status}
+        ).order_by(neighbour_field).values_list(neighbour_field, flat=True)])
+        await cache.aset(key, ids, FOLLOW_GRAPH_TTL)
+    return ids
+
+
+async def aget_following_ids(user_id):
+    return await aget_ids(user_id, FOLLOWING)
+
+
+async def aget_pending_sent_ids(user_id):
+    return await aget_ids(user_id, PENDING_SENT)
+
+
+async def aget_mutual_follows(viewer_id, user_id, followers_count=None, sample_size=MUTUAL_FOLLOWS_SAMPLE_SIZE):
+    key = _mutual_key(viewer_id, await aget_version(viewer_id), user_id, await aget_version(user_id))
+    mutual = await cache.aget(key)
+    if mutual is None:
+        following = await aget_following_ids(viewer_id)
+        if not following:
+            mutual = (0, [])
+        elif followers_count is not None and followers_count > MUTUAL_FOLLOWS_MAX_SET_SIZE:
+            mutual_ids = Follow.objects.using(DEFAULT_DB_ALIAS).filter(
+                following_id=user_id, follow_status='accepted', follower_id__in=list(following)
+            ).order_by('follower_id').values_list('follower_id', flat=True)
+            mutual = (await mutual_ids.acount(), [follower_id async for follower_id in mutual_ids[:sample_size]])
+        else:
+            mutual_ids = intersect(following, await aget_ids(user_id, FOLLOWERS))
+            mutual = (len(mutual_ids), mutual_ids[:sample_size])
+        await cache.aset(key, mutual, FOLLOW_GRAPH_TTL)
+    return mutual
+
+
+# Follow relationships of a single viewing user, loaded once and reused for any number of membership checks
+# (ex: the follow status of every user in a paginated list)
+class ViewerFollowState:
+    def __init__(self, viewer_id):
+        self.viewer_id = viewer_id
+        self._following = None
+        self._pending_sent = None
+
+    @property
+    def following(self):
+        if self._following is None:
+            self._following = get_following_ids(self.viewer_id)
+        return self._following
+
+    @property
+    def pending_sent(self):
+        if self._pending_sent is None:
+            self._pending_sent = get_pending_sent_ids(self.viewer_id)
+        return self._pending_sent
+
+    # Get the viewer's follow status to a user: "self", "accepted", "pending" or False if they do not follow them
+    def status_of(self, user_id):
+        if user_id == self.viewer_id:
+            return "self"
+        if contains(self.following, user_id):
+            return "accepted"
+        if contains(self.pending_sent, user_id):
+            return "pending"
+        return False
+
+    # Get the viewer's follow status to each user of a list of users
+    def statuses_of(self, user_ids):
+        return {user_id: self.status_of(user_id) for user_id in user_ids}
+
+
+# Invalidate the cached follow graph of users whose follow relationships changed.
+# When called inside a transaction the invalidation happens once the transaction commits
+def invalidate(*user_ids):
+    def bump_versions():
+        for user_id in user_ids:
+            try:
+                cache.incr(_version_key(user_id))
+            except ValueError:
+                get_version(user_id)
+
+    transaction.on_commit(bump_versions)
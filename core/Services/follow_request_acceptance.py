@@ -0,0 +1,137 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, connection
+# lets you directly manipulate database fields within database queries, leading to more efficient operations
+from django.db.models import F
+from django.contrib.auth import get_user_model
+
+from core.models import Follow, Notification
+from core.Services import follow_graph, image_variants, sharded_counters
+from core.Services.socket_fanout import group_send_many
+
+
+logger = logging.getLogger(__name__)
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+# Number of pending follow requests accepted per transaction
+ACCEPT_BATCH_SIZE = getattr(settings, 'FOLLOW_REQUEST_ACCEPT_BATCH_SIZE', 500)
+# Users with more pending follow requests than this have them accepted by a background job instead of in the request
+INLINE_ACCEPT_LIMIT = getattr(settings, 'FOLLOW_REQUEST_INLINE_ACCEPT_LIMIT', 500)
+# Seconds the lock held by a running acceptance job stays valid without progress
+ACCEPT_LOCK_TTL = 5 * 60
+
+
+def _lock_key(user_id):
+    return f"accept_follow_requests_lock_{user_id}"
+
+
+# Accept one batch of a public user's pending follow requests with set-based updates.
+# Every batch is its own transaction and only touches requests that are still pending, so an interrupted job
+# can be resumed at any time by running it again. Returns the number of accepted follow requests
+def accept_pending_follow_requests_batch(user_id):
+    with transaction.atomic():
+        # Stop if the user switched back to private while the job was running
+        user = User.objects.filter(id=user_id, profile_privacy='public').only('id', 'username', 'profile_picture', 'profile_picture_variants').first()
+        if user is None:
+            return 0
+
+        # Lock the batch of pending follow requests, skipping rows locked by a concurrent batch
+        pending_follows = list(
+            Follow.objects.select_for_update(skip_locked=True)
+            .filter(following_id=user_id, follow_status='pending')
+            .order_by('id')
+            .values_list('id', 'follower_id')[:ACCEPT_BATCH_SIZE]
+        )
+        if not pending_follows:
+            return 0
+
+        follow_ids = [follow_id for follow_id, _ in pending_follows]
+        follower_ids = [follower_id for _, follower_id in pending_follows]
+
+        Follow.objects.filter(id__in=follow_ids).update(follow_status='accepted')
+
+        # Adjust the follow counters with one update for the user (through counter slots if the user is hot)
+        # and one for all of the new followers
+        sharded_counters.add(User, user_id, 'num_followers', len(follower_ids))
+        User.objects.filter(id__in=follower_ids).update(num_following=F('num_following') + 1)
+        sharded_counters.journal_changes(User, follower_ids)
+
+        # Turn the original "follow_request" notifications into "new_follower" notifications
+        follow_request_notifications = Notification.objects.filter(
+            recipient_id=user_id, sender_id__in=follower_ids, notification_type='follow_request'
+        )
+        converted_notification_ids = list(follow_request_notifications.values_list('id', flat=True))
+        Notification.objects.filter(id__in=converted_notification_ids).update(notification_type='new_follower')
+
+        # Inform the followers that their follow request was accepted
+        accept_notifications = Notification.objects.bulk_create([
+            Notification(recipient_id=follower_id, sender_id=user_id, notification_type='follow_accept')
+            for follower_id in follower_ids
+        ])
+
+        follow_graph.invalidate(user_id, *follower_ids)
+
+        # Notify the users via WebSocket once the batch is committed
+        sender_profile_picture_url = image_variants.variant_url(user, image_variants.PROFILE_PICTURE, 'thumbnail')
+        group_events = [
+            (f"notifications_{notification.recipient_id}", {
+                "type": "core.notification",
+                "unique_identifier": str(notification.id),
+                "notification_type": "follow_accept",
+                "recipient": str(notification.recipient_id),
+                "sender": str(user_id),
+                "message": f"{user.username} accepted your follow request",
+                "sender_profile_picture_url": sender_profile_picture_url,
+            })
+            for notification in accept_notifications
+        ]
+        # A single event lets the user who accepted the requests update all of the affected notifications at once
+        group_events.append((f"notifications_{user_id}", {
+            "type": "notification_follow_request_accept_batch",
+            "unique_identifiers": [str(notification_id) for notification_id in converted_notification_ids],
+        }))
+        transaction.on_commit(lambda: group_send_many(group_events))
+
+    return len(follow_ids)
+
+
+# Accept all of a public user's pending follow requests batch by batch.
+# Returns the number of accepted follow requests, or None if a job is already running for the user
+def accept_all_pending_follow_requests(user_id):
+    if not cache.add(_lock_key(user_id), True, ACCEPT_LOCK_TTL):
+        return None
+
+    total_accepted = 0
+    try:
+        while True:
+            accepted = accept_pending_follow_requests_batch(user_id)
+            if not accepted:
+                break
+            total_accepted += accepted
+            # Keep the lock alive while the job makes progress
+            cache.touch(_lock_key(user_id), ACCEPT_LOCK_TTL)
+    finally:
+        cache.delete(_lock_key(user_id))
+
+    return total_accepted
+
+
+# Accept a user's pending follow requests in a background thread so the request that triggered it isn't held up.
+# If the worker stops before finishing, the remaining requests are picked up by the
+# accept_pending_follow_requests management command
+def schedule_pending_follow_acceptance(user_id):
+    def run():
+        try:
+            accept_all_pending_follow_requests(user_id)
+        except Exception:
+            logger.exception("Error accepting the pending follow requests of user %s", user_id)
+        finally:
+            # The thread has its own database connection which must be closed when it is done
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
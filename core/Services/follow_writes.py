@@ -0,0 +1,71 @@
+from django.db import connection, connections, router
+from django.contrib.auth import get_user_model
+
+from core.models import Follow, Notification
+
+
+# Idempotent single-statement write path for follows.
+# Following and unfollowing are each one statement that both checks and writes (INSERT ... ON CONFLICT DO NOTHING and
+# DELETE ... RETURNING), so repeated or concurrent requests for the same pair (ex: a double tap, a client retry)
+# can never create a duplicate, raise an integrity error or count the same follow twice.
+# The statements run on the database the router picks for writes, so they count as writes for replica routing.
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+_FOLLOW_TABLE = connection.ops.quote_name(Follow._meta.db_table)
+_USER_TABLE = connection.ops.quote_name(User._meta.db_table)
+_NOTIFICATION_TABLE = connection.ops.quote_name(Notification._meta.db_table)
+
+
+# Create the follow of a user by another user, accepted right away if the followed user's profile is public and
+# pending otherwise. Returns (follow_status, created), or (None, False) if the followed user doesn't exist.
+# When the follow already exists its current status is returned with created set to False
+def create_follow(follower_id, following_id):
+    with connections[router.db_for_write(Follow)].cursor() as cursor:
+        # Insert the follow with the status derived from the followed user's privacy in the same statement,
+        # a follow that already exists for the pair is left as is
+        cursor.execute(
+            f"""
+            INSERT INTO {_FOLLOW_TABLE} (follower_id, following_id, follow_status)
+            SELECT %s, id, CASE WHEN profile_privacy = 'public' THEN 'accepted' ELSE 'pending' END
+            FROM {_USER_TABLE} WHERE id = %s
+            ON CONFLICT (follower_id, following_id) DO NOTHING
+            RETURNING follow_status
+            """,
+            [follower_id, following_id],
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0], True
+
+    # Nothing was inserted: the follow already exists or the user doesn't
+    follow_status = Follow.objects.filter(follower_id=follower_id, following_id=following_id).values_list('follow_status', flat=True).first()
+    return follow_status, False
+
+
+# Delete the follow (or follow request) of a user by another user.
+# Returns the status the deleted follow had, or None if there was no follow to delete
+def delete_follow(follower_id, following_id):
+    with connections[router.db_for_write(Follow)].cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {_FOLLOW_TABLE} WHERE follower_id = %s AND following_id = %s RETURNING follow_status",
+            [follower_id, following_id],
+        )
+        row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+# Delete the "follow_request" and "new_follower" notifications a follow sent to the followed user.
+# Returns the ids of the deleted notifications
+def delete_follow_notifications(follower_id, following_id):
+    with connections[router.db_for_write(Notification)].cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {_NOTIFICATION_TABLE}
+            WHERE sender_id = %s AND recipient_id = %s AND notification_type IN ('follow_request', 'new_follower')
+            RETURNING id
+            """,
+            [follower_id, following_id],
+        )
+        return [notification_id for notification_id, in cursor.fetchall()]
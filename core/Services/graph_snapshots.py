@@ -0,0 +1,265 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+
+from django.conf import settings
+from django.db.models import Max
+
+from core.models import Follow, Post
+
+
+# Compact on-disk snapshots of the social graphs for analytics and offline builders.
+# A full snapshot of a graph is stored in CSR format as two NumPy arrays:
+#  - offsets.npy: int64 array of length num_sources + 1, indexed by source id
+#  - targets.npy: int64 array of the target ids of every edge, grouped by source and sorted
+# so the targets of source s are targets[offsets[s]:offsets[s + 1]]. Both files are meant to be opened with
+# np.load(mmap_mode='r'), letting jobs read graphs far larger than their memory.
+# A delta snapshot stores the edges added and removed since a full snapshot as (source, target) int64 arrays.
+#
+# Layout: {GRAPH_SNAPSHOT_DIR}/{graph}/{snapshot name}/ with a meta.json describing the snapshot
+
+# Directory the snapshots are written to
+SNAPSHOT_DIR = getattr(settings, 'GRAPH_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'graph_snapshots'))
+# Number of rows fetched per round trip from the server-side cursor
+STREAM_CHUNK_SIZE = getattr(settings, 'GRAPH_SNAPSHOT_CHUNK_SIZE', 10000)
+
+FULL = 'full'
+DELTA = 'delta'
+
+
+# Graphs that can be exported, each returning its edge queryset, source id field and target id field.
+# Node ids are used directly as array indices
+def _follow_graph():
+    return (Follow.objects.filter(follow_status='accepted'), 'follower_id', 'following_id')
+
+
+def _like_graph():
+    return (Post.likes.through.objects.all(), 'user_id', 'post_id')
+
+
+GRAPHS = {
+    'follow': _follow_graph,  # User -> users they follow
+    'like': _like_graph,  # User -> posts they liked
+}
+
+
+# Stream the edges of a graph as (source, target) arrays ordered by source then target, one chunk at a time.
+# .iterator() uses a server-side cursor on PostgreSQL so the edges are never all loaded in memory
+def _stream_edges(graph, chunk_size):
+    edges, source_field, target_field = GRAPHS[graph]()
+    rows = edges.order_by(source_field, target_field).values_list(source_field, target_field).iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield np.array(chunk, dtype=np.int64)
+            chunk = []
+    if chunk:
+        yield np.array(chunk, dtype=np.int64)
+
+
+# Get the number of source nodes of a graph (largest source id + 1)
+def _num_sources(graph):
+    edges, source_field, target_field = GRAPHS[graph]()
+    max_id = edges.aggregate(max_id=Max(source_field))['max_id']
+    return (max_id or 0) + 1
+
+
+def _graph_dir(graph):
+    return os.path.join(SNAPSHOT_DIR, graph)
+
+
+def _new_snapshot_name(kind):
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    return timestamp if kind == FULL else f"{timestamp}-{DELTA}"
+
+
+# Move a fully written snapshot directory into place so readers never see a partial snapshot
+def _publish(graph, temp_dir, name, meta):
+    with open(os.path.join(temp_dir, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    snapshot_dir = os.path.join(_graph_dir(graph), name)
+    os.rename(temp_dir, snapshot_dir)
+    return snapshot_dir
+
+
+def _temp_dir(graph, name):
+    temp_dir = os.path.join(_graph_dir(graph), f".{name}.tmp")
+    os.makedirs(temp_dir)
+    return temp_dir
+
+
+# Export a full CSR snapshot of a graph. Returns the snapshot directory
+def export_full_snapshot(graph, chunk_size=STREAM_CHUNK_SIZE):
+    name = _new_snapshot_name(FULL)
+    temp_dir = _temp_dir(graph, name)
+
+    try:
+        # Count the edges of every source and append the targets to a raw file while streaming
+        counts = np.zeros(_num_sources(graph), dtype=np.int64)
+        num_edges = 0
+        max_target = -1
+        raw_targets_path = os.path.join(temp_dir, 'targets.bin')
+        with open(raw_targets_path, 'wb') as raw_targets:
+            for edges in _stream_edges(graph, chunk_size):
+                if edges[:, 0].max() >= len(counts):
+                    # Sources created after the count was taken
+                    counts = np.concatenate([counts, np.zeros(edges[:, 0].max() + 1 - len(counts), dtype=np.int64)])
+                np.add.at(counts, edges[:, 0], 1)
+                edges[:, 1].tofile(raw_targets)
+                num_edges += len(edges)
+                max_target = max(max_target, int(edges[:, 1].max()))
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        np.save(os.path.join(temp_dir, 'offsets.npy'), offsets)
+
+        # Copy the raw targets into a .npy file in bounded chunks
+        raw = np.memmap(raw_targets_path, dtype=np.int64, mode='r', shape=(num_edges,)) if num_edges else np.zeros(0, dtype=np.int64)
+        targets = np.lib.format.open_memmap(os.path.join(temp_dir, 'targets.npy'), mode='w+', dtype=np.int64, shape=(num_edges,))
+        for start in range(0, num_edges, chunk_size * 100):
+            targets[start:start + chunk_size * 100] = raw[start:start + chunk_size * 100]
+        targets.flush()
+        del raw, targets
+        os.remove(raw_targets_path)
+
+        return _publish(graph, temp_dir, name, {
+            'graph': graph,
+            'kind': FULL,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'num_sources': len(counts),
+            'num_targets': max_target + 1,
+            'num_edges': num_edges,
+        })
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+
+# Get the names of the snapshots of a graph of the given kind, oldest first
+def list_snapshots(graph, kind=FULL):
+    graph_dir = _graph_dir(graph)
+    if not os.path.isdir(graph_dir):
+        return []
+    names = [name for name in os.listdir(graph_dir) if not name.startswith('.')]
+    return sorted(name for name in names if name.endswith(f"-{DELTA}") == (kind == DELTA))
+
+
+# A snapshot of a graph opened with memory-mapped arrays
+class GraphSnapshot:
+    def __init__(self, graph, name):
+        self.graph = graph
+        self.name = name
+        self.path = os.path.join(_graph_dir(graph), name)
+        with open(os.path.join(self.path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+
+    def load(self, array_name):
+        return np.load(os.path.join(self.path, f"{array_name}.npy"), mmap_mode='r')
+
+    # CSR arrays of a full snapshot
+    @property
+    def offsets(self):
+        return self.load('offsets')
+
+    @property
+    def targets(self):
+        return self.load('targets')
+
+    # Get the sorted target ids of a source in a full snapshot
+    def neighbours(self, source_id, offsets=None, targets=None):
+        offsets = self.offsets if offsets is None else offsets
+        if source_id + 1 >= len(offsets):
+            return np.zeros(0, dtype=np.int64)
+        targets = self.targets if targets is None else targets
+        return targets[offsets[source_id]:offsets[source_id + 1]]
+
+
+# Open a snapshot of a graph, the latest full snapshot if no name is given (None if there is none)
+def load_snapshot(graph, name=None):
+    if name is None:
+        names = list_snapshots(graph, FULL)
+        if not names:
+            return None
+        name = names[-1]
+    return GraphSnapshot(graph, name)
+
+
+# Get the delta snapshots taken on top of a full snapshot, oldest first
+def load_deltas(graph, base_name):
+    deltas = [GraphSnapshot(graph, name) for name in list_snapshots(graph, DELTA)]
+    return [delta for delta in deltas if delta.meta['base'] == base_name]
+
+
+# Export the edges added and removed since the latest full snapshot of a graph. Returns the snapshot directory
+def export_delta_snapshot(graph, chunk_size=STREAM_CHUNK_SIZE):
+    base = load_snapshot(graph)
+    if base is None:
+        raise ValueError(f"No full snapshot of the {graph} graph to compute a delta against")
+
+    offsets, base_targets = base.offsets, base.targets
+    added, removed = [], []
+
+    # Compare the current targets of every source with the snapshot, walking both in source order
+    def compare(source_id, current_targets):
+        previous_targets = base.neighbours(source_id, offsets, base_targets)
+        new = np.setdiff1d(current_targets, previous_targets, assume_unique=True)
+        gone = np.setdiff1d(previous_targets, current_targets, assume_unique=True)
+        if len(new):
+            added.append(np.column_stack([np.full(len(new), source_id, dtype=np.int64), new]))
+        if len(gone):
+            removed.append(np.column_stack([np.full(len(gone), source_id, dtype=np.int64), gone]))
+
+    # Sources that have no edges anymore lost every target they had in the snapshot
+    def compare_gap(from_source_id, to_source_id):
+        to_source_id = min(to_source_id, len(offsets) - 1)
+        if from_source_id >= to_source_id:
+            return
+        gap_counts = np.diff(offsets[from_source_id:to_source_id + 1])
+        for source_id in np.flatnonzero(gap_counts) + from_source_id:
+            compare(int(source_id), np.zeros(0, dtype=np.int64))
+
+    next_source_id = 0
+    pending_source_id, pending_targets = None, []
+    for edges in _stream_edges(graph, chunk_size):
+        # Split the chunk into runs of edges of the same source
+        boundaries = np.flatnonzero(np.diff(edges[:, 0])) + 1
+        for run in np.split(edges, boundaries):
+            source_id = int(run[0, 0])
+            if source_id == pending_source_id:
+                pending_targets.append(run[:, 1])
+                continue
+            if pending_source_id is not None:
+                compare(pending_source_id, np.concatenate(pending_targets))
+                next_source_id = pending_source_id + 1
+            compare_gap(next_source_id, source_id)
+            pending_source_id, pending_targets = source_id, [run[:, 1]]
+
+    if pending_source_id is not None:
+        compare(pending_source_id, np.concatenate(pending_targets))
+        next_source_id = pending_source_id + 1
+    compare_gap(next_source_id, len(offsets) - 1)
+
+    name = _new_snapshot_name(DELTA)
+    temp_dir = _temp_dir(graph, name)
+    try:
+        added = np.concatenate(added) if added else np.zeros((0, 2), dtype=np.int64)
+        removed = np.concatenate(removed) if removed else np.zeros((0, 2), dtype=np.int64)
+        np.save(os.path.join(temp_dir, 'added.npy'), added)
+        np.save(os.path.join(temp_dir, 'removed.npy'), removed)
+
+        return _publish(graph, temp_dir, name, {
+            'graph': graph,
+            'kind': DELTA,
+            'base': base.name,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'num_added': len(added),
+            'num_removed': len(removed),
+        })
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
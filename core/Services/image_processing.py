@@ -0,0 +1,80 @@
+import base64
+import io
+
+from PIL import Image, ImageOps
+
+
+# Image processing functions run in worker processes.
+# This module only depends on Pillow (no Django imports) so worker processes can import it without setting up Django.
+
+# Quality of the WebP images produced
+WEBP_QUALITY = 80
+# Largest side and quality of the placeholders, small enough for a placeholder to stay a few hundred bytes
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+# EXIF orientations that rotate the image by 90 or 270 degrees, swapping its width and height
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+_EXIF_ORIENTATION = 0x0112
+
+
+# Get the displayed (width, height) of an image from its header without decoding it, taking its EXIF orientation
+# into account. fp is a file object positioned at the start of the image, returns (None, None) if it can't be read
+def read_size(fp):
+    try:
+        with Image.open(fp) as image:
+            width, height = image.size
+            if image.getexif().get(_EXIF_ORIENTATION) in _ROTATED_ORIENTATIONS:
+                return height, width
+            return width, height
+    except (OSError, ValueError, SyntaxError):
+        return None, None
+
+
+# Open an image from its bytes, applying the orientation stored in its EXIF data
+def open_image(data):
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    # WebP supports RGB and RGBA, convert palette, greyscale, CMYK... images
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+
+# Resize an image to a maximum width, keeping its aspect ratio and never upscaling it, and encode it as WebP or JPEG
+def encode_resized(image, width, quality=WEBP_QUALITY, image_format='WEBP'):
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        # JPEG has no transparency, flatten transparent images on a white background
+        if image.mode == 'RGBA':
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image.save(output, format='JPEG', quality=quality, progressive=True, optimize=True)
+    else:
+        image.save(output, format='WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+
+# Resize an image given as bytes to a maximum width and encode it as WebP or JPEG
+def render_resized(data, width, image_format='WEBP', quality=WEBP_QUALITY):
+    return encode_resized(open_image(data), width, quality, image_format)
+
+
+# Render a tiny blurred-looking version of an image as a WebP data URI, shown by clients while the image loads
+def render_placeholder(image):
+    placeholder = image.copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    output = io.BytesIO()
+    placeholder.save(output, format='WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+# Render the variants of an image given as {variant name: maximum width} and describe the image.
+# Returns the WebP bytes of each variant by name, and the displayed width, height and placeholder of the image
+def render_variants(data, widths, quality=WEBP_QUALITY):
+    image = open_image(data)
+    variants = {name: encode_resized(image, width, quality) for name, width in widths.items()}
+    return variants, image.width, image.height, render_placeholder(image)
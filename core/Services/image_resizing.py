@@ -0,0 +1,175 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from core.Services import image_processing, image_variants
+
+
+# On-demand resizing of stored images.
+# Instead of generating every size of every image in advance, a resized copy of an image is rendered in the image
+# worker processes the first time it is requested, then kept in a disk cache shared by the processes of the host.
+# Cache files are named after the storage key of the image, the width and the format: content-addressed keys (see
+# media_store) change whenever the image changes, so a cached file never goes stale and is only removed to keep the
+# cache under its size limit, least recently used first (the modification time of a file is its last use).
+
+# Directory of the cache and total size of the cached files above which the least recently used ones are evicted
+CACHE_DIR = getattr(settings, 'IMAGE_RESIZE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'image_cache'))
+CACHE_MAX_BYTES = getattr(settings, 'IMAGE_RESIZE_CACHE_MAX_BYTES', 1024 * 1024 * 1024)
+# Widths that can be requested, any other width would let clients fill the cache with arbitrary sizes
+WIDTHS = tuple(getattr(settings, 'IMAGE_RESIZE_WIDTHS', (160, 320, 640, 1080)))
+# Formats that can be requested: content type, file extension and Pillow format
+FORMATS = {
+    'webp': ('image/webp', '.webp', 'WEBP'),
+    'jpeg': ('image/jpeg', '.jpg', 'JPEG'),
+}
+
+# Seconds between two updates of the last use of a cached file, so cache hits don't write to the disk every time
+TOUCH_INTERVAL = 60 * 60
+# Share of the size limit the cache is brought back to when it is exceeded, so eviction doesn't run on every render
+EVICTION_TARGET = 0.9
+
+_lock = threading.Lock()
+# Total size of the cache in bytes, counted by scanning the cache the first time a file is added
+_cache_size = None
+# Whether a thread is scanning the cache (outside of the lock), and the size of the files added meanwhile
+_scanning = False
+_added_during_scan = 0
+# Futures of the renders in progress by cache path, concurrent requests for the same image wait for a single render
+_pending = {}
+
+
+# Get the name of the cached file of an image resized to a width in a format, relative to CACHE_DIR
+def cache_name(key, width, image_format):
+    digest = hashlib.sha256(f"{key}\0{width}\0{image_format}".encode()).hexdigest()
+    return os.path.join(digest[:2], digest + FORMATS[image_format][1])
+
+
+# List the cached files as (last use, size, path)
+def _scan():
+    files = []
+    for directory, _, names in os.walk(CACHE_DIR):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+# Delete the least recently used files until the cache is under its target size. Returns the size left
+def _evict(files):
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= CACHE_MAX_BYTES * EVICTION_TARGET:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+# Count a file added to the cache, evicting files if the cache exceeds its size limit. Other processes add files to
+# the same cache, so the size is counted again from the disk whenever files are evicted. The disk is scanned by one
+# thread at a time outside of the lock, which the requests looking up the renders in progress wait on
+def _added(size):
+    global _cache_size, _scanning, _added_during_scan
+    with _lock:
+        if _scanning:
+            _added_during_scan += size
+            return
+        if _cache_size is not None:
+            _cache_size += size
+            if _cache_size <= CACHE_MAX_BYTES:
+                return
+        # The added file is already in the cache, so the scan counts it
+        _scanning = True
+        _added_during_scan = 0
+
+    total = None
+    try:
+        files = _scan()
+        total = sum(size for _, size, _ in files)
+        if total > CACHE_MAX_BYTES:
+            total = _evict(files)
+    finally:
+        with _lock:
+            if total is not None:
+                _cache_size = total + _added_during_scan
+            _scanning = False
+
+
+# Open a cached file, marking it as used. Returns None if it isn't cached
+def _open_cached(path):
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    if os.fstat(file.fileno()).st_mtime < time.time() - TOUCH_INTERVAL:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+    return file
+
+
+# Render an image resized to a width in a format and write it to the cache. Returns the written file opened for
+# reading, opened before it is visible to other processes so it can't be evicted before being read
+def _render(key, width, image_format, path):
+    with default_storage.open(key, 'rb') as original:
+        data = original.read()
+    content = image_variants.render(image_processing.render_resized, data, width, FORMATS[image_format][2]).result()
+
+    # Write to a temporary file renamed once complete, so other processes never read a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as temporary:
+            temporary.write(content)
+        file = open(temporary_path, 'rb')
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    _added(len(content))
+    return file
+
+
+# Get an image resized to a width in a format, rendering it if it isn't cached.
+# Returns the cached file opened for reading (the open file stays readable even if it is evicted meanwhile) and its
+# path relative to CACHE_DIR
+def open_resized(key, width, image_format):
+    name = cache_name(key, width, image_format)
+    path = os.path.join(CACHE_DIR, name)
+    while True:
+        file = _open_cached(path)
+        if file is not None:
+            return file, name
+
+        with _lock:
+            future = _pending.get(path)
+            if future is None:
+                future = _pending[path] = Future()
+                break
+        # Another request is rendering the same image, use its render once the file is cached
+        future.result()
+
+    try:
+        file = _render(key, width, image_format, path)
+        future.set_result(None)
+        return file, name
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _pending.pop(path, None)
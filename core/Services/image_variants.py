@@ -0,0 +1,165 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction, connection
+from django.contrib.auth import get_user_model
+
+from core.models import MediaObject, Post
+from core.Services import image_processing, storage_deletions
+from core.Services.media_urls import media_url
+
+
+# Background pipeline producing resized WebP variants of post media and profile pictures.
+# Once the transaction saving a new image commits, a dispatcher thread reads the original from storage, renders
+# the variants with Pillow in a pool of worker processes (keeping the CPU heavy work off the request and web
+# processes), saves them next to the original and stores their storage keys on the model, along with the size of
+# the image and its placeholder (see image_processing) which are rendered from the same decoded image.
+
+logger = logging.getLogger(__name__)
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+# Maximum width of each variant, by variant name
+POST_VARIANT_WIDTHS = getattr(settings, 'POST_MEDIA_VARIANT_WIDTHS', {'thumbnail': 320, 'medium': 1080})
+AVATAR_VARIANT_WIDTHS = getattr(settings, 'PROFILE_PICTURE_VARIANT_WIDTHS', {'thumbnail': 150, 'medium': 400})
+# Number of worker processes rendering variants
+WORKER_PROCESSES = getattr(settings, 'IMAGE_VARIANT_WORKERS', 2)
+
+POST_MEDIA = 'post_media'
+PROFILE_PICTURE = 'profile_picture'
+
+# Images with variants: model, image field, field storing the variant keys and variant widths.
+# The size and placeholder of the image are stored in the {image field}_width, _height and _placeholder fields
+TARGETS = {
+    POST_MEDIA: (Post, 'media', 'media_variants', POST_VARIANT_WIDTHS),
+    PROFILE_PICTURE: (User, 'profile_picture', 'profile_picture_variants', AVATAR_VARIANT_WIDTHS),
+}
+
+_process_pool = None
+_dispatcher = None
+
+
+# Worker processes are spawned rather than forked so they don't inherit the web process's threads and connections
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def _get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = ThreadPoolExecutor(max_workers=WORKER_PROCESSES, thread_name_prefix='image-variants')
+    return _dispatcher
+
+
+# Build the storage key of a variant from the key of the original and its width
+# (ex: posts/{id}/photo.jpg -> posts/{id}/photo_320w.webp). The key only depends on the original and the width,
+# so images sharing a stored file (see media_store) also share variant files of the same width
+def variant_name(original_name, width):
+    stem, _ = os.path.splitext(original_name)
+    return f"{stem}_{width}w.webp"
+
+
+# Get the storage keys of the variants an original can have at every width of every image field, the variants of a
+# file shared by different image fields (see media_store) are rendered at the widths of each of them
+def all_variant_names(original_name):
+    widths = {width for _, _, _, target_widths in TARGETS.values() for width in target_widths.values()}
+    return [variant_name(original_name, width) for width in sorted(widths)]
+
+
+# Get the URL of a variant of an image, falling back to the original while the variants are being generated
+def variant_url(instance, kind, variant):
+    _, field, variants_field, _ = TARGETS[kind]
+    image = getattr(instance, field)
+    if not image:
+        return None
+    key = (getattr(instance, variants_field) or {}).get(variant)
+    return media_url(key or image.name)
+
+
+# Get the URLs of every variant of an image
+def variant_urls(instance, kind):
+    _, _, variants_field, _ = TARGETS[kind]
+    return {variant: media_url(key) for variant, key in (getattr(instance, variants_field) or {}).items()}
+
+
+# Queue variant files for deletion from storage (see storage_deletions)
+def delete_variants(keys):
+    storage_deletions.delete_later((keys or {}).values())
+
+
+# Run an image processing function (see image_processing) in the worker processes. Returns a future of its result
+def render(function, *args):
+    return _get_process_pool().submit(function, *args)
+
+
+# Names of the fields storing the width, height and placeholder of an image field
+def metadata_fields(field):
+    return f'{field}_width', f'{field}_height', f'{field}_placeholder'
+
+
+# Render and store the variants, size and placeholder of the current image of a row. Returns the stored variant keys
+def generate_variants(kind, object_id):
+    model, field, variants_field, widths = TARGETS[kind]
+    width_field, height_field, placeholder_field = metadata_fields(field)
+    instance = model.objects.filter(pk=object_id).only('id', field, variants_field).first()
+    if instance is None or not getattr(instance, field):
+        return {}
+
+    original_name = getattr(instance, field).name
+    other_rows = model.objects.filter(**{field: original_name}).exclude(pk=object_id)
+
+    # Reuse the variants and metadata of another row referencing the same stored file
+    rendered_row = (
+        other_rows.exclude(**{variants_field: {}}).exclude(**{placeholder_field: ''})
+        .values(variants_field, width_field, height_field, placeholder_field).first()
+    )
+    if rendered_row:
+        keys = rendered_row.pop(variants_field)
+        metadata = rendered_row
+    else:
+        with default_storage.open(original_name, 'rb') as original:
+            data = original.read()
+
+        rendered, width, height, placeholder = render(image_processing.render_variants, data, widths).result()
+        keys = {
+            variant: default_storage.save(variant_name(original_name, widths[variant]), ContentFile(content))
+            for variant, content in rendered.items()
+        }
+        metadata = {width_field: width, height_field: height, placeholder_field: placeholder}
+
+    # Only store the variants if the image wasn't replaced while they were being rendered
+    if not model.objects.filter(pk=object_id, **{field: original_name}).update(**{variants_field: keys}, **metadata):
+        # Variants of a file still in use belong to the rows using it
+        if not (other_rows.exists() or MediaObject.objects.filter(key=original_name).exists()):
+            delete_variants(keys)
+        return {}
+
+    # Variants of a previous render of the same image (ex: a backfill ran twice) are no longer referenced, unless the
+    # file is shared with other rows that may still use them
+    if not (other_rows.exists() or MediaObject.objects.filter(key=original_name, ref_count__gt=1).exists()):
+        delete_variants({variant: key for variant, key in (getattr(instance, variants_field) or {}).items() if key not in keys.values()})
+    return keys
+
+
+def _run(kind, object_id):
+    try:
+        generate_variants(kind, object_id)
+    except Exception:
+        logger.exception("Generating the %s variants of %s failed", kind, object_id)
+    finally:
+        # Dispatcher threads get their own database connection, close it once the job is done
+        connection.close()
+
+
+# Generate the variants of a row's image in the background once the current transaction commits
+def schedule_variants(kind, object_id):
+    transaction.on_commit(lambda: _get_dispatcher().submit(_run, kind, object_id))
@@ -0,0 +1,104 @@
+import hashlib
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from core.models import MediaObject, media_content_key, media_content_sha256
+from core.Services import image_variants, storage_deletions
+
+
+# Content-addressed storage of uploaded images.
+# Uploaded files are hashed chunk by chunk as they are read and stored under their SHA-256 (media/ab/abcd....jpg),
+# with a MediaObject row counting the image fields that reference the file. Uploading content that is already stored
+# only adds a reference, the file is never sent to the storage again. Releasing a reference (ex: deleting a post)
+# queues the file and its resized variants for deletion (see storage_deletions) once the last reference is gone.
+# Files stored before content addressing (or through upload sessions without a checksum) have no MediaObject and
+# are deleted as soon as they are released.
+
+
+# Compute the SHA-256 of an uploaded file, reading it in chunks
+def hash_file(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+# Add a reference to the stored file with the given hash. Returns its storage key, None if it isn't stored
+def _add_reference(sha256):
+    with transaction.atomic():
+        media = MediaObject.objects.select_for_update().filter(sha256=sha256).first()
+        if media is None:
+            return None
+        MediaObject.objects.filter(pk=media.pk).update(ref_count=F('ref_count') + 1)
+        return media.key
+
+
+# Record a reference to a file that was just stored under key. If the same content was stored concurrently under
+# another key, the new copy is deleted and the key of the existing file is returned instead
+def register(sha256, key, size):
+    with transaction.atomic():
+        media, created = MediaObject.objects.select_for_update().get_or_create(
+            sha256=sha256, defaults={'key': key, 'size': size},
+        )
+        if not created:
+            MediaObject.objects.filter(pk=media.pk).update(ref_count=F('ref_count') + 1)
+
+        # The content was stored concurrently under another key, the new copy is not needed
+        if media.key != key:
+            storage_deletions.delete_later([key])
+    return media.key
+
+
+# Store an uploaded file unless the same content is already stored. Returns the storage key to save in the image field.
+# Call it in the transaction saving the image field, so a failed save doesn't leave a reference nothing uses
+def store(file):
+    sha256 = hash_file(file)
+    key = _add_reference(sha256)
+    if key is not None:
+        return key
+
+    key = default_storage.save(media_content_key(sha256, file.name), file)
+    return register(sha256, key, file.size)
+
+
+# Release references to stored files, given as (key, variants) pairs with variants the dict of variant keys of the
+# image field. Files losing their last reference are queued for deletion along with their variants, in the current
+# transaction. Content-addressed files can be shared by image fields with different variant widths (ex: a post media
+# and a profile picture), so the variants of every width are queued, not only those of the released fields.
+# Returns the keys of the files queued for deletion
+def release_many(images):
+    variants_by_key = {}
+    references = Counter()
+    for key, variants in images:
+        if key:
+            references[key] += 1
+            variants_by_key.setdefault(key, set()).update((variants or {}).values())
+    if not references:
+        return []
+
+    with transaction.atomic():
+        stored = {media.key: media for media in MediaObject.objects.select_for_update().filter(key__in=references).order_by('id')}
+        still_used = []
+        for key, count in references.items():
+            media = stored.get(key)
+            if media is not None and media.ref_count > count:
+                media.ref_count -= count
+                still_used.append(media)
+        MediaObject.objects.bulk_update(still_used, ['ref_count'])
+
+        orphaned = [key for key in references if key not in {media.key for media in still_used}]
+        MediaObject.objects.filter(key__in=orphaned).delete()
+        for key in orphaned:
+            if media_content_sha256(key):
+                variants_by_key[key].update(image_variants.all_variant_names(key))
+        storage_deletions.delete_later(orphaned + [variant for key in orphaned for variant in variants_by_key[key]])
+    return orphaned
+
+
+# Release a reference to a stored file, see release_many. Returns True if the file was queued for deletion
+def release(key, variants=None):
+    return bool(release_many([(key, variants)]))
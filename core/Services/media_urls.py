@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.encoding import filepath_to_uri
+
+
+# Fast URL generation for stored media.
+# Going through the storage for every URL (S3Boto3Storage.url normalizes the name and, when URLs are signed, builds
+# a presigned request with botocore) is slow when serializing pages of posts with several images each. Public URLs
+# (a CDN, the bucket's custom domain or local files) are built by concatenating the storage key to a base URL
+# computed once. Signed URLs are still generated by the storage but cached per process until shortly before they
+# expire, so the same image isn't signed again for every response.
+
+# Base URL of a CDN serving the media files publicly (ex: https://cdn.example.com/), used instead of the storage's URLs
+CDN_URL = getattr(settings, 'MEDIA_CDN_URL', None)
+# Number of signed URLs kept in the cache of each process
+SIGNED_URL_CACHE_SIZE = getattr(settings, 'MEDIA_SIGNED_URL_CACHE_SIZE', 10000)
+# Set to False to build every URL through the storage
+ENABLED = getattr(settings, 'MEDIA_URL_BUILDER_ENABLED', True)
+
+# Key whose URL is used to find the base URL of the storage
+_PROBE_NAME = '__media_url_probe__'
+
+_base_url = None
+_signed = None
+_signed_urls = OrderedDict()
+_signed_urls_lock = threading.Lock()
+
+
+# Check if the URLs of the default storage are signed (S3 query string authentication, CloudFront signed URLs)
+def _storage_signs_urls():
+    if not getattr(default_storage, 'querystring_auth', False):
+        return False
+    return not getattr(default_storage, 'custom_domain', None) or getattr(default_storage, 'cloudfront_signer', None) is not None
+
+
+def _configure():
+    global _base_url, _signed
+    if CDN_URL:
+        _base_url, _signed = CDN_URL.rstrip('/') + '/', False
+    elif _storage_signs_urls():
+        _signed = True
+    else:
+        # The URL of any key is the base URL followed by the key
+        _base_url, _signed = default_storage.url(_PROBE_NAME)[:-len(_PROBE_NAME)], False
+
+
+# Get a signed URL from the storage, reusing the one signed earlier for the same key until it is close to expiring
+def _signed_url(name):
+    now = time.monotonic()
+    with _signed_urls_lock:
+        cached = _signed_urls.get(name)
+        if cached is not None and cached[1] > now:
+            _signed_urls.move_to_end(name)
+            return cached[0]
+
+    url = default_storage.url(name)
+    # Stop serving the URL once half of its lifetime has passed, so clients always get some time to use it
+    expire = getattr(default_storage, 'querystring_expire', 3600)
+    with _signed_urls_lock:
+        _signed_urls[name] = (url, now + expire / 2)
+        _signed_urls.move_to_end(name)
+        while len(_signed_urls) > SIGNED_URL_CACHE_SIZE:
+            _signed_urls.popitem(last=False)
+    return url
+
+
+# Get the URL of a stored file from its storage key (None for an empty key)
+def media_url(name):
+    if not name:
+        return None
+    if not ENABLED:
+        return default_storage.url(name)
+    if _signed is None:
+        _configure()
+    if _signed:
+        return _signed_url(name)
+    return _base_url + filepath_to_uri(name)
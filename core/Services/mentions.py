@@ -0,0 +1,127 @@
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.contrib.auth import get_user_model
+
+from core.models import Notification
+from core.Services import follow_graph, image_variants
+from core.Services.socket_fanout import group_send_many
+
+
+# @mentions in posts and comments.
+# Mentioned usernames are resolved to user ids in bulk through a cached username index (one cache round trip, plus
+# one query for the usernames that weren't cached), and the mentioned users are notified with a single bulk insert
+# and a single batched WebSocket fan-out.
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+# Maximum number of users notified for the mentions of a single post or comment
+MAX_MENTIONS = getattr(settings, 'MENTIONS_MAX_PER_POST', 10)
+# Seconds a username to id mapping stays in the cache, and how long a username that doesn't exist is remembered
+USERNAME_INDEX_TTL = getattr(settings, 'MENTIONS_USERNAME_INDEX_TTL_SECONDS', 60 * 60)
+MISSING_USERNAME_TTL = getattr(settings, 'MENTIONS_MISSING_USERNAME_TTL_SECONDS', 60)
+
+# An @ not preceded by a word character (so emails aren't mentions) followed by a username
+MENTION_PATTERN = re.compile(r'(?<![\w@])@([\w.+-]+)')
+
+# Cached id of usernames that don't belong to any user
+_MISSING = 0
+
+
+def _username_key(username):
+    return f"mention_username_{username}"
+
+
+# Get the distinct usernames mentioned in a text in order of appearance, at most MAX_MENTIONS of them
+def parse_mentions(text):
+    usernames = []
+    for match in MENTION_PATTERN.finditer(text or ''):
+        # Usernames are stored in lowercase, and a trailing period is punctuation ("thanks @bob.")
+        username = match.group(1).rstrip('.').lower()
+        if username and username not in usernames:
+            usernames.append(username)
+            if len(usernames) == MAX_MENTIONS:
+                break
+    return usernames
+
+
+# Resolve usernames to user ids, returning a {username: user_id} dict of the usernames that belong to a user
+def resolve_usernames(usernames):
+    if not usernames:
+        return {}
+
+    cached = cache.get_many([_username_key(username) for username in usernames])
+    user_ids = {}
+    missing = []
+    for username in usernames:
+        user_id = cached.get(_username_key(username))
+        if user_id is None:
+            missing.append(username)
+        elif user_id != _MISSING:
+            user_ids[username] = user_id
+
+    if missing:
+        found = dict(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        user_ids.update(found)
+        cache.set_many({_username_key(username): user_id for username, user_id in found.items()}, USERNAME_INDEX_TTL)
+        cache.set_many({_username_key(username): _MISSING for username in missing if username not in found}, MISSING_USERNAME_TTL)
+
+    return user_ids
+
+
+# Remove usernames from the username index (ex: after a user changes their username or deletes their account)
+def forget_usernames(*usernames):
+    cache.delete_many([_username_key(username) for username in usernames if username])
+
+
+# Notify the users mentioned in the content of a post or comment.
+# Users mentioned on a private post are only notified if they follow its author and can therefore see it.
+# Returns the number of users notified
+def notify_mentions(sender, content, post, comment=None):
+    user_ids = resolve_usernames(parse_mentions(content))
+    recipient_ids = [user_id for user_id in user_ids.values() if user_id != sender.id]
+
+    if post.visibility == 'private':
+        follower_ids = follow_graph.get_follower_ids(post.user_id)
+        recipient_ids = [user_id for user_id in recipient_ids if user_id == post.user_id or follow_graph.contains(follower_ids, user_id)]
+
+    if not recipient_ids:
+        return 0
+
+    notifications = Notification.objects.bulk_create([
+        Notification(
+            recipient_id=recipient_id,
+            sender=sender,
+            notification_type='new_mention',
+            notification_post=post,
+            notification_comment=comment,
+        )
+        for recipient_id in recipient_ids
+    ])
+
+    message = f"{sender.username} mentioned you in a {'comment' if comment is not None else 'post'}"
+    sender_profile_picture_url = image_variants.variant_url(sender, image_variants.PROFILE_PICTURE, 'thumbnail')
+    post_media_url = image_variants.variant_url(post, image_variants.POST_MEDIA, 'thumbnail')
+    group_events = [
+        (
+            f"notifications_{notification.recipient_id}",
+            {
+                "type": "core.notification",
+                "unique_identifier": str(notification.id),
+                "notification_type": "new_mention",
+                "recipient": str(notification.recipient_id),
+                "sender": str(sender.id),
+                "message": message,
+                "sender_profile_picture_url": sender_profile_picture_url,
+                "post_media_url": post_media_url,
+            }
+        )
+        for notification in notifications
+    ]
+
+    # Notify the mentioned users via WebSocket once the notifications are committed
+    transaction.on_commit(lambda: group_send_many(group_events))
+    return len(notifications)
@@ -0,0 +1,82 @@
+from django.conf import settings
+
+from core.models import Message
+
+
+# Maximum number of messages sent to a client in a single replay frame
+REPLAY_BATCH_SIZE = getattr(settings, 'MESSAGE_REPLAY_BATCH_SIZE', 100)
+
+
+# Build the room group name of the conversation between 2 users
+def conversation_group_name(user_id, other_user_id):
+    return f"group_{min(user_id, other_user_id)}_{max(user_id, other_user_id)}"
+
+
+# Messages a client missed are found by their delivery state: a message stays undelivered until the receiver's client
+# acknowledges its id. Message ids are assigned when a message is inserted, not when it commits, so a message can
+# commit after messages with higher ids and ids are not a delivery sequence. They are only used as a cursor to page
+# through the undelivered messages of a replay, a message committed behind the cursor is replayed the next time.
+# Parse a message id (a replay cursor or an acknowledged message) sent by a client, returning None if it isn't valid
+def parse_sequence(value):
+    try:
+        sequence = int(value)
+    except (TypeError, ValueError):
+        return None
+    return sequence if sequence >= 0 else None
+
+
+# Convert a message's values into the frame representation sent to WebSocket clients
+def serialize_message(message):
+    return {
+        "unique_identifier": str(message["id"]),
+        "sender": message["sender_id"],
+        "receiver": message["receiver_id"],
+        "content": message["content"],
+        "created_at": message["created_at"].isoformat(),
+        "is_read": message["is_read"],
+    }
+
+
+# Fetch a batch of messages in ascending sequence order and whether more messages remain after the batch
+def _fetch_batch(messages):
+    batch = list(
+        messages.order_by('id').values('id', 'sender_id', 'receiver_id', 'content', 'created_at', 'is_read')[:REPLAY_BATCH_SIZE + 1]
+    )
+    has_more = len(batch) > REPLAY_BATCH_SIZE
+    return [serialize_message(message) for message in batch[:REPLAY_BATCH_SIZE]], has_more
+
+
+# Get the messages a user has not acknowledged yet, optionally limited to their conversation with another user.
+# after is the id of the last message of the previous batch of the same replay
+def get_undelivered_messages(user_id, other_user_id=None, after=None):
+    # Uses the partial index on undelivered messages, so the lookup stays small no matter how long the history is
+    messages = Message.objects.filter(receiver_id=user_id, is_delivered=False)
+    if other_user_id is not None:
+        messages = messages.filter(sender_id=other_user_id)
+    if after is not None:
+        messages = messages.filter(id__gt=after)
+    return _fetch_batch(messages)
+
+
+# Mark the messages a user acknowledged by their ids as delivered.
+# Returns the newly delivered message ids grouped by their sender so the senders can be informed
+def acknowledge_delivery(user_id, message_ids):
+    if not message_ids:
+        return {}
+    delivered = list(
+        Message.objects.filter(receiver_id=user_id, is_delivered=False, id__in=message_ids).order_by('id').values_list('id', 'sender_id')
+    )
+    if not delivered:
+        return {}
+
+    Message.objects.filter(id__in=[message_id for message_id, _ in delivered]).update(is_delivered=True)
+
+    delivered_by_sender = {}
+    for message_id, sender_id in delivered:
+        delivered_by_sender.setdefault(sender_id, []).append(str(message_id))
+    return delivered_by_sender
+
+
+# Mark a message as read (and therefore delivered) if the user is its receiver
+def mark_message_as_read(user_id, message_id):
+    Message.objects.filter(id=message_id, receiver_id=user_id, is_read=False).update(is_read=True, is_delivered=True)
@@ -0,0 +1,48 @@
+import os
+import threading
+from collections import defaultdict
+
+
+# Lightweight in-process metrics registry.
+# Every worker process keeps its own values, which are exposed through the staff-only metrics endpoint.
+_lock = threading.Lock()
+_counters = defaultdict(int)  # Monotonically increasing counts (ex: dropped events)
+_gauges = {}  # Current values that go up and down, along with the highest value seen (ex: queued events)
+_observations = {}  # Count, sum and max of observed values (ex: queue depth on enqueue, wait times)
+
+
+# Increment a counter by the given amount
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+# Adjust a gauge by the given amount (positive or negative) and keep track of its maximum value
+def adjust_gauge(name, amount):
+    with _lock:
+        gauge = _gauges.setdefault(name, {"value": 0, "max": 0})
+        gauge["value"] += amount
+        gauge["max"] = max(gauge["max"], gauge["value"])
+
+
+# Record a single observed value for a metric
+def observe(name, value):
+    with _lock:
+        observation = _observations.setdefault(name, {"count": 0, "sum": 0, "max": 0})
+        observation["count"] += 1
+        observation["sum"] += value
+        observation["max"] = max(observation["max"], value)
+
+
+# Get a copy of all the metrics of this process
+def snapshot():
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "counters": dict(_counters),
+            "gauges": {name: dict(gauge) for name, gauge in _gauges.items()},
+            "observations": {
+                name: dict(observation, avg=observation["sum"] / observation["count"] if observation["count"] else 0)
+                for name, observation in _observations.items()
+            },
+        }
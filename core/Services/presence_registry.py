@@ -0,0 +1,86 @@
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+# Presence is stored in the configured cache (Redis in production, local memory works for a single node)
+# so no database writes are made for connects, disconnects or heartbeats
+from django.core.cache import cache
+
+
+# Seconds a user stays online without a heartbeat from any of their connections
+PRESENCE_TTL = getattr(settings, 'PRESENCE_TTL_SECONDS', 60)
+# Seconds the last seen timestamp of an offline user is kept
+LAST_SEEN_TTL = getattr(settings, 'PRESENCE_LAST_SEEN_TTL_SECONDS', 60 * 60 * 24 * 7)
+# Maximum number of users that can be looked up in a single bulk presence request
+MAX_PRESENCE_LOOKUP = getattr(settings, 'PRESENCE_MAX_LOOKUP', 100)
+
+
+def _online_key(user_id):
+    return f"presence_online_{user_id}"
+
+
+def _connections_key(user_id):
+    return f"presence_connections_{user_id}"
+
+
+def _last_seen_key(user_id):
+    return f"presence_last_seen_{user_id}"
+
+
+# Register a new WebSocket connection for a user and mark them as online
+def mark_online(user_id):
+    connections_key = _connections_key(user_id)
+
+    # Keep a count of the user's open connections so closing one socket does not mark them offline
+    cache.add(connections_key, 0, PRESENCE_TTL)
+    try:
+        cache.incr(connections_key)
+    except ValueError:
+        # The counter expired between the add and the incr
+        cache.set(connections_key, 1, PRESENCE_TTL)
+    cache.touch(connections_key, PRESENCE_TTL)
+
+    cache.set(_online_key(user_id), time.time(), PRESENCE_TTL)
+
+
+# Refresh the TTL of a user's presence, called whenever one of their connections sends a heartbeat
+def heartbeat(user_id):
+    cache.set(_online_key(user_id), time.time(), PRESENCE_TTL)
+
+    # Restore the connection counter if it expired while the connection was still open
+    if not cache.touch(_connections_key(user_id), PRESENCE_TTL):
+        cache.set(_connections_key(user_id), 1, PRESENCE_TTL)
+
+
+# Unregister a WebSocket connection, marking the user offline once their last connection closes
+def mark_offline(user_id):
+    connections_key = _connections_key(user_id)
+
+    try:
+        remaining_connections = cache.decr(connections_key)
+    except ValueError:
+        # The counter already expired, so there are no other live connections we know about
+        remaining_connections = 0
+
+    if remaining_connections <= 0:
+        cache.delete_many([connections_key, _online_key(user_id)])
+        cache.set(_last_seen_key(user_id), time.time(), LAST_SEEN_TTL)
+
+
+# Get the presence of a list of users with a single round trip to the cache
+# Returns a dictionary mapping each user id to whether they are online and when they were last seen
+def get_presence(user_ids):
+    user_ids = list(dict.fromkeys(user_ids))[:MAX_PRESENCE_LOOKUP]
+
+    keys = [_online_key(user_id) for user_id in user_ids] + [_last_seen_key(user_id) for user_id in user_ids]
+    cached = cache.get_many(keys)
+
+    presence = {}
+    for user_id in user_ids:
+        online_since = cached.get(_online_key(user_id))
+        last_seen = online_since or cached.get(_last_seen_key(user_id))
+        presence[user_id] = {
+            "online": online_since is not None,
+            "last_seen": datetime.fromtimestamp(last_seen, tz=timezone.utc).isoformat() if last_seen else None,
+        }
+    return presence
@@ -0,0 +1,274 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from core.models import CounterJournal, CounterShard
+
+
+# Sharded counters for hot rows.
+# Counter updates normally go straight to the counter field of the row (UPDATE ... SET like_count = like_count + 1).
+# When a counter of a row receives more than COUNTER_HOT_THRESHOLD updates within a window, the row is marked as
+# sharded and its counter updates are spread over COUNTER_SHARDS CounterShard slots picked at random, so concurrent
+# requests lock different rows. Reads add the cached sum of the slots to the row's value (whether or not the row is
+# marked as sharded, the marker only routes updates), and fold_shards()
+# (run periodically by the fold_counter_shards command) moves the slot totals back into the row.
+# Every row whose counters change is recorded in the CounterJournal table (at most once per JOURNAL_INTERVAL), so
+# incremental runs of reconcile_counters check the rows that changed, decrements included.
+
+# Number of counter slots used for the counters of a hot row
+SHARD_COUNT = getattr(settings, 'COUNTER_SHARDS', 16)
+# Number of updates to a counter within the window above which the row switches to sharded slots
+HOT_THRESHOLD = getattr(settings, 'COUNTER_HOT_THRESHOLD', 20)
+HOT_WINDOW = getattr(settings, 'COUNTER_HOT_WINDOW_SECONDS', 10)
+# Seconds the summed value of the slots of a row is cached for reads
+READ_CACHE_TTL = getattr(settings, 'COUNTER_READ_CACHE_SECONDS', 5)
+# Seconds a row stays marked as sharded without updates, long enough for its slots to always be folded first
+SHARDED_TTL = getattr(settings, 'COUNTER_SHARDED_TTL_SECONDS', 60 * 60 * 24)
+# Seconds during which further changes to the counters of a journaled row are not journaled again
+JOURNAL_INTERVAL = getattr(settings, 'COUNTER_JOURNAL_INTERVAL_SECONDS', 60)
+
+
+def _object_type(model):
+    return model._meta.label_lower
+
+
+def _rate_key(object_type, object_id, field, window):
+    return f"counter_rate_{object_type}_{object_id}_{field}_{window}"
+
+
+def _sharded_key(object_type, object_id):
+    return f"counter_sharded_{object_type}_{object_id}"
+
+
+def _sums_key(object_type, object_id):
+    return f"counter_shard_sums_{object_type}_{object_id}"
+
+
+def _journaled_key(object_type, object_id):
+    return f"counter_journaled_{object_type}_{object_id}"
+
+
+# Record that the counters of rows of a model changed, once the surrounding transaction commits (a rolled back change
+# leaves nothing to reconcile). Rows journaled less than JOURNAL_INTERVAL seconds ago are skipped, reconcile_counters
+# only consumes entries older than JOURNAL_INTERVAL so the changes skipped meanwhile are checked with the entry
+def journal_changes(model, object_ids):
+    object_type = _object_type(model)
+
+    def journal():
+        entries = [
+            CounterJournal(object_type=object_type, object_id=object_id)
+            for object_id in set(object_ids) if cache.add(_journaled_key(object_type, object_id), True, JOURNAL_INTERVAL)
+        ]
+        CounterJournal.objects.bulk_create(entries)
+
+    transaction.on_commit(journal)
+
+
+# Count an update to a counter in the current window and check if the counter is hot
+def _is_hot(object_type, object_id, field):
+    key = _rate_key(object_type, object_id, field, int(time.time() // HOT_WINDOW))
+    cache.add(key, 0, HOT_WINDOW * 2)
+    try:
+        updates = cache.incr(key)
+    except ValueError:
+        # The counter expired between the add and the incr
+        cache.set(key, 1, HOT_WINDOW * 2)
+        updates = 1
+    return updates > HOT_THRESHOLD
+
+
+# Add an amount to a random counter slot of a row
+def _add_to_shard(object_type, object_id, field, amount):
+    # Keep the row marked as sharded while it receives updates
+    cache.set(_sharded_key(object_type, object_id), True, SHARDED_TTL)
+
+    lookup = {'object_type': object_type, 'object_id': object_id, 'field': field, 'shard': random.randrange(SHARD_COUNT)}
+    if CounterShard.objects.filter(**lookup).update(delta=F('delta') + amount):
+        return
+    try:
+        # Savepoint so a concurrent creation of the same slot doesn't break the surrounding transaction
+        with transaction.atomic():
+            CounterShard.objects.create(delta=amount, **lookup)
+    except IntegrityError:
+        CounterShard.objects.filter(**lookup).update(delta=F('delta') + amount)
+
+
+# Add an amount (negative to subtract) to a counter field of a row.
+# Rows that are hot or already sharded are updated through their counter slots, other rows are updated in place
+def add(model, object_id, field, amount=1):
+    object_type = _object_type(model)
+    journal_changes(model, [object_id])
+
+    if _is_hot(object_type, object_id, field) or cache.get(_sharded_key(object_type, object_id)):
+        _add_to_shard(object_type, object_id, field, amount)
+        return
+
+    rows = model.objects.filter(pk=object_id)
+    if amount < 0:
+        # Counter fields are unsigned, if part of the counter still sits in slots that were not folded yet
+        # (ex: the sharded marker was evicted from the cache) the decrement goes to a slot instead
+        rows = rows.filter(**{f'{field}__gte': -amount})
+    if not rows.update(**{field: F(field) + amount}):
+        _add_to_shard(object_type, object_id, field, amount)
+
+
+# Apply several counter changes, given as (object_id, field, amount) tuples, to rows of a model.
+# Changes to hot or sharded rows go to counter slots, the others are applied together in a single UPDATE statement.
+# Like add(), an in place decrement that would take a counter below 0 (part of the counter sits in slots whose sharded
+# marker was evicted from the cache) goes to a counter slot instead
+def add_many(model, changes):
+    object_type = _object_type(model)
+    journal_changes(model, [object_id for object_id, _, _ in changes])
+
+    in_place = []
+    for object_id, field, amount in changes:
+        if _is_hot(object_type, object_id, field) or cache.get(_sharded_key(object_type, object_id)):
+            _add_to_shard(object_type, object_id, field, amount)
+        else:
+            in_place.append((object_id, field, amount))
+
+    if not in_place:
+        return
+
+    with transaction.atomic():
+        decremented_ids = {object_id for object_id, _, amount in in_place if amount < 0}
+        if decremented_ids:
+            # Lock the decremented rows (in primary key order, like concurrent updates) while checking their values
+            fields = {field for _, field, amount in in_place if amount < 0}
+            current = {
+                row['pk']: row for row in
+                model.objects.select_for_update().filter(pk__in=decremented_ids).order_by('pk').values('pk', *fields)
+            }
+            applied = []
+            for object_id, field, amount in in_place:
+                if amount < 0 and object_id in current:
+                    if current[object_id][field] < -amount:
+                        _add_to_shard(object_type, object_id, field, amount)
+                        continue
+                    current[object_id][field] += amount
+                applied.append((object_id, field, amount))
+            in_place = applied
+
+        in_place_by_field = {}
+        for object_id, field, amount in in_place:
+            in_place_by_field.setdefault(field, {}).setdefault(object_id, 0)
+            in_place_by_field[field][object_id] += amount
+
+        updates = {
+            field: F(field) + Case(*(When(pk=object_id, then=Value(amount)) for object_id, amount in amounts.items()),
+                                   default=Value(0), output_field=IntegerField())
+            for field, amounts in in_place_by_field.items()
+        }
+        object_ids = {object_id for object_id, _, _ in in_place}
+        if object_ids:
+            model.objects.filter(pk__in=object_ids).update(**updates)
+
+
+# Query the summed slots of the counters of rows, returns {object_id: {field: total}} with an entry for every row
+def _query_shard_sums(object_type, object_ids):
+    sums = {object_id: {} for object_id in object_ids}
+    for object_id, field, total in (
+        CounterShard.objects.filter(object_type=object_type, object_id__in=object_ids)
+        .values('object_id', 'field').annotate(total=Sum('delta')).values_list('object_id', 'field', 'total')
+    ):
+        sums[object_id][field] = total
+    return sums
+
+
+# Add the summed slots to the counter values of instances, returns {(pk, field): value}
+def _counter_values(instances, fields, sums):
+    return {
+        (instance.pk, field): max(getattr(instance, field) + sums[instance.pk].get(field, 0), 0)
+        for instance in instances for field in fields
+    }
+
+
+# Get the values of counter fields of several instances of a model, including their counter slots, with one cache
+# request for the cached slot sums of every instance and one query for the instances whose sums aren't cached.
+# Reads don't rely on the sharded marker (an evicted marker would hide slots that were not folded yet): the sums of
+# rows without slots are cached too, as empty sums. Returns {(pk, field): value}
+def get_many(instances, fields):
+    if not instances:
+        return {}
+    object_type = _object_type(type(instances[0]))
+    keys = {instance.pk: _sums_key(object_type, instance.pk) for instance in instances}
+
+    cached = cache.get_many(list(keys.values()))
+    sums = {object_id: cached[key] for object_id, key in keys.items() if key in cached}
+    missing = [object_id for object_id in keys if object_id not in sums]
+    if missing:
+        queried = _query_shard_sums(object_type, missing)
+        cache.set_many({keys[object_id]: object_sums for object_id, object_sums in queried.items()}, READ_CACHE_TTL)
+        sums.update(queried)
+    return _counter_values(instances, fields, sums)
+
+
+# Get the value of a counter field of a model instance, including its counter slots
+def get(instance, field):
+    return get_many([instance], (field,))[(instance.pk, field)]
+
+
+# Async version of get_many for async views
+async def aget_many(instances, fields):
+    if not instances:
+        return {}
+    object_type = _object_type(type(instances[0]))
+    keys = {instance.pk: _sums_key(object_type, instance.pk) for instance in instances}
+
+    cached = await cache.aget_many(list(keys.values()))
+    sums = {object_id: cached[key] for object_id, key in keys.items() if key in cached}
+    missing = [object_id for object_id in keys if object_id not in sums]
+    if missing:
+        queried = {object_id: {} for object_id in missing}
+        async for object_id, field, total in (
+            CounterShard.objects.filter(object_type=object_type, object_id__in=missing)
+            .values('object_id', 'field').annotate(total=Sum('delta')).values_list('object_id', 'field', 'total')
+        ):
+            queried[object_id][field] = total
+        await cache.aset_many({keys[object_id]: object_sums for object_id, object_sums in queried.items()}, READ_CACHE_TTL)
+        sums.update(queried)
+    return _counter_values(instances, fields, sums)
+
+
+# Move the totals of the counter slots back into the counter fields of their rows and delete the slots.
+# Rows that are no longer hot stop being sharded. Returns the number of rows folded
+def fold_shards(model, object_ids=None):
+    object_type = _object_type(model)
+    shards = CounterShard.objects.filter(object_type=object_type)
+    if object_ids is not None:
+        shards = shards.filter(object_id__in=object_ids)
+
+    folded = 0
+    for object_id in list(shards.values_list('object_id', flat=True).distinct().order_by('object_id')):
+        with transaction.atomic():
+            # Lock the slots while they are read and deleted, an update racing with the fold either lands before
+            # the lock and is folded, or waits for the delete, finds no slot and creates a new one
+            slots = CounterShard.objects.filter(object_type=object_type, object_id=object_id)
+            totals = {}
+            for field, delta in slots.select_for_update().values_list('field', 'delta'):
+                totals[field] = totals.get(field, 0) + delta
+            slots.delete()
+
+            # Clamped at 0 since counter fields are unsigned, drift below 0 is left for reconcile_counters to repair
+            changes = {field: Greatest(F(field) + total, 0) for field, total in totals.items() if total}
+            if changes:
+                # Rows deleted in the meantime (ex: a deleted post) simply have their slots dropped
+                model.objects.filter(pk=object_id).update(**changes)
+
+        def clear_sharded(object_id=object_id, fields=tuple(totals)):
+            cache.delete(_sums_key(object_type, object_id))
+            window = int(time.time() // HOT_WINDOW)
+            still_hot = any((cache.get(_rate_key(object_type, object_id, field, window)) or 0) > HOT_THRESHOLD
+                            for field in fields)
+            if not still_hot:
+                cache.delete(_sharded_key(object_type, object_id))
+
+        transaction.on_commit(clear_sharded)
+        folded += 1
+
+    return folded
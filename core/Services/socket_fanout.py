@@ -0,0 +1,27 @@
+import asyncio
+
+from django.conf import settings
+# Accessing Django Channels' channel layer for WebSocket integration
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+
+# Maximum number of group_send calls in flight at once when fanning out a batch of events
+FANOUT_CONCURRENCY = getattr(settings, 'WEBSOCKET_FANOUT_CONCURRENCY', 100)
+
+
+# Send a batch of (group name, event) pairs to the channel layer in a single event loop round trip.
+# Events are sent concurrently in chunks instead of paying a separate async_to_sync call for each of them
+def group_send_many(group_events):
+    group_events = list(group_events)
+    if not group_events:
+        return
+
+    channel_layer = get_channel_layer()
+
+    async def send_all():
+        for start in range(0, len(group_events), FANOUT_CONCURRENCY):
+            chunk = group_events[start:start + FANOUT_CONCURRENCY]
+            await asyncio.gather(*(channel_layer.group_send(group, event) for group, event in chunk))
+
+    async_to_sync(send_all)()
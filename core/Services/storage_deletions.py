@@ -0,0 +1,115 @@
+import logging
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import MediaObject, StorageDeletion, media_content_sha256
+
+
+# Deferred deletion of storage objects.
+# Requests never delete files from the storage themselves: the keys of the files they orphan are queued as
+# StorageDeletion rows in the same transaction as the change (so a rolled back request deletes nothing and a
+# committed one never forgets a file), and the process_storage_deletions command deletes them in batches with one
+# multi-object delete request per batch, retrying failed keys with an exponential backoff.
+
+logger = logging.getLogger(__name__)
+
+# Number of keys deleted per batch (S3 accepts at most 1000 keys per DeleteObjects request)
+BATCH_SIZE = min(getattr(settings, 'STORAGE_DELETION_BATCH_SIZE', 1000), 1000)
+# Number of failed attempts after which a deletion is left in the queue for inspection
+MAX_ATTEMPTS = getattr(settings, 'STORAGE_DELETION_MAX_ATTEMPTS', 8)
+# Delay before the first retry of a failed deletion, doubled after every failed attempt
+RETRY_DELAY = getattr(settings, 'STORAGE_DELETION_RETRY_SECONDS', 60)
+MAX_RETRY_DELAY = 60 * 60 * 24
+
+
+# Queue storage keys for deletion once the current transaction commits. Empty keys are ignored
+def delete_later(keys):
+    deletions = [StorageDeletion(key=key) for key in dict.fromkeys(keys) if key]
+    if deletions:
+        StorageDeletion.objects.bulk_create(deletions)
+    return len(deletions)
+
+
+# Get the keys of content-addressed files (or of their variants) whose content was stored again after they were
+# queued, those files are in use and must not be deleted
+def _reused_keys(keys):
+    sha256_by_key = {key: media_content_sha256(key) for key in keys}
+    stored = set(MediaObject.objects.filter(sha256__in={sha256 for sha256 in sha256_by_key.values() if sha256}).values_list('sha256', flat=True))
+    return {key for key, sha256 in sha256_by_key.items() if sha256 in stored}
+
+
+# Delete keys from the storage. Returns a {key: error message} dict of the keys that could not be deleted
+def _delete_objects(keys):
+    bucket = getattr(default_storage, 'bucket', None)
+    if bucket is None:
+        # Storages without multi-object deletes (ex: local files in development)
+        errors = {}
+        for key in keys:
+            try:
+                default_storage.delete(key)
+            except OSError as e:
+                errors[key] = str(e)
+        return errors
+
+    # Object keys include the storage's location prefix, if any
+    keys_by_object_key = {default_storage._normalize_name(key): key for key in keys}
+    try:
+        response = bucket.meta.client.delete_objects(
+            Bucket=bucket.name,
+            Delete={'Objects': [{'Key': object_key} for object_key in keys_by_object_key], 'Quiet': True},
+        )
+    except (BotoCoreError, ClientError) as e:
+        return {key: str(e) for key in keys}
+
+    # In quiet mode only the keys that failed are listed, keys that don't exist count as deleted
+    return {
+        keys_by_object_key.get(error['Key'], error['Key']): f"{error.get('Code')}: {error.get('Message')}"
+        for error in response.get('Errors', [])
+    }
+
+
+# Delete one batch of the due deletions. Returns the number of deletions processed, 0 when none are due
+def process_batch(batch_size=BATCH_SIZE):
+    now = timezone.now()
+    with transaction.atomic():
+        # Skip the rows locked by other workers so several workers can drain the queue together
+        deletions = list(
+            StorageDeletion.objects.filter(next_attempt_at__lte=now, attempts__lt=MAX_ATTEMPTS)
+            .select_for_update(skip_locked=True).order_by('next_attempt_at', 'id')[:min(batch_size, 1000)]
+        )
+        if not deletions:
+            return 0
+
+        keys = {deletion.key for deletion in deletions}
+        to_delete = sorted(keys - _reused_keys(keys))
+        errors = _delete_objects(to_delete) if to_delete else {}
+
+        failed = []
+        for deletion in deletions:
+            if deletion.key in errors:
+                deletion.attempts += 1
+                deletion.last_error = errors[deletion.key][:1000]
+                deletion.next_attempt_at = now + timedelta(seconds=min(RETRY_DELAY * 2 ** (deletion.attempts - 1), MAX_RETRY_DELAY))
+                failed.append(deletion)
+        StorageDeletion.objects.filter(id__in=[deletion.id for deletion in deletions if deletion.key not in errors]).delete()
+        StorageDeletion.objects.bulk_update(failed, ['attempts', 'last_error', 'next_attempt_at'])
+
+    for deletion in failed:
+        logger.warning("Deleting %s from the storage failed (attempt %s): %s", deletion.key, deletion.attempts, deletion.last_error)
+    return len(deletions)
+
+
+# Process the due deletions until none are left. Returns the number of deletions processed
+def process_due_deletions(batch_size=BATCH_SIZE):
+    processed = 0
+    while True:
+        batch = process_batch(batch_size)
+        if not batch:
+            return processed
+        processed += batch
@@ -0,0 +1,189 @@
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.db import transaction
+from django.contrib.auth import get_user_model
+
+from core.models import Follow, UserSuggestion
+from core.Services.graph_snapshots import load_snapshot
+
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+
+# Offline "who to follow" recommendations.
+# The accepted follow edges are loaded into a sparse adjacency matrix A (A[i, j] = 1 when user i follows user j)
+# and every user gets two scores for the users they don't follow yet:
+#  - friend of friend: A @ A, the number of users they follow that follow the candidate
+#  - co-follow: (A @ A.T) @ A, the candidates followed by users who follow the same people they do,
+#    weighted by how many follows they share. Accounts with more than CO_FOLLOW_MAX_DEGREE followers are left out of
+#    the shared follows: following one brings all of its followers into the product (making it dense), and says
+#    little about a user's taste
+# Both scores are normalized per user and combined, and the top N candidates are stored as UserSuggestion rows.
+# Users are scored in chunks bounded by their number of rows and by the estimated size of their intermediate products.
+
+# Number of suggestions stored per user
+SUGGESTIONS_PER_USER = getattr(settings, 'USER_SUGGESTIONS_PER_USER', 50)
+# Weight of the co-follow score relative to the friend of friend score
+CO_FOLLOW_WEIGHT = getattr(settings, 'USER_SUGGESTIONS_CO_FOLLOW_WEIGHT', 0.5)
+# Number of followers above which an account is left out of the co-follow score
+CO_FOLLOW_MAX_DEGREE = getattr(settings, 'USER_SUGGESTIONS_CO_FOLLOW_MAX_DEGREE', 10000)
+# Maximum number of users scored per matrix product
+SCORING_CHUNK_SIZE = getattr(settings, 'USER_SUGGESTIONS_CHUNK_SIZE', 1000)
+# Maximum estimated number of nonzero entries of the intermediate matrices of a chunk, bounds the memory they use
+SCORING_CHUNK_NNZ = getattr(settings, 'USER_SUGGESTIONS_CHUNK_NNZ', 20_000_000)
+
+
+# Load the accepted follow edges into a CSR adjacency matrix.
+# Returns the user id of each row/column index and the matrix
+def load_follow_matrix():
+    edges = np.fromiter(
+        (user_id for edge in Follow.objects.filter(follow_status='accepted')
+         .values_list('follower_id', 'following_id').iterator(chunk_size=10000) for user_id in edge),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    # Map user ids to contiguous matrix indices
+    user_ids, indices = np.unique(edges, return_inverse=True)
+    indices = indices.reshape(-1, 2)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), (indices[:, 0], indices[:, 1])),
+        shape=(len(user_ids), len(user_ids)),
+    )
+    return user_ids, matrix
+
+
+# Load the adjacency matrix from the latest follow graph snapshot (see export_graph_snapshot) instead of the database.
+# Snapshot arrays are indexed by user id, so the user id of each index is the index itself
+def load_follow_matrix_from_snapshot():
+    snapshot = load_snapshot('follow')
+    if snapshot is None:
+        raise ValueError("No follow graph snapshot to build the suggestions from")
+
+    offsets, targets = snapshot.offsets, snapshot.targets
+    size = max(snapshot.meta['num_sources'], snapshot.meta['num_targets'])
+    # Sources past the last one with edges have no targets
+    indptr = np.concatenate([offsets, np.full(size + 1 - len(offsets), offsets[-1], dtype=np.int64)])
+    matrix = sparse.csr_matrix((np.ones(len(targets), dtype=np.float32), np.asarray(targets), indptr), shape=(size, size))
+    return np.arange(size, dtype=np.int64), matrix
+
+
+# Scale every row of a sparse matrix so its largest value is 1
+def _normalize_rows(matrix):
+    row_max = matrix.max(axis=1).toarray().ravel()
+    row_max[row_max == 0] = 1
+    return sparse.diags(1 / row_max) @ matrix
+
+
+# Drop the users themselves and the users they already follow from the candidate scores of the users in rows
+# [start, end), given their rows of the adjacency matrix
+def _drop_known(scores, following, start):
+    scores = scores.tocoo()
+    size = scores.shape[1]
+    followed = following.tocoo()
+    followed_keys = followed.row.astype(np.int64) * size + followed.col
+    keys = scores.row.astype(np.int64) * size + scores.col
+    keep = (scores.col != scores.row + start) & ~np.isin(keys, followed_keys) & (scores.data > 0)
+    return sparse.csr_matrix((scores.data[keep], (scores.row[keep], scores.col[keep])), shape=scores.shape)
+
+
+# Get the adjacency matrix without the follows of accounts with more than max_degree followers, used for the shared
+# follows of the co-follow score, and the estimated number of entries each row adds to the intermediate products
+def co_follow_matrix(matrix, max_degree=CO_FOLLOW_MAX_DEGREE):
+    followers = np.asarray(matrix.sum(axis=0)).ravel()
+    kept = followers <= max_degree
+    shared = (matrix @ sparse.diags(kept.astype(np.float32))).tocsr()
+    shared.eliminate_zeros()
+
+    # Friend of friend: the follows of every followed user. Co-follow: the followers of every kept followed user (the
+    # similar users), then their follows, estimated with the average number of follows and at most one per user
+    following_counts = np.diff(matrix.indptr).astype(np.float64)
+    similar_users = shared @ np.where(kept, followers, 0)
+    co_follow_costs = np.minimum(similar_users * following_counts.mean(), matrix.shape[1]) if len(following_counts) else similar_users
+    row_costs = matrix @ following_counts + similar_users + co_follow_costs
+    return shared, row_costs
+
+
+# Split the rows into [start, end) chunks of at most max_rows rows and max_cost estimated entries (a single row can go
+# over max_cost on its own)
+def chunk_bounds(row_costs, max_rows=SCORING_CHUNK_SIZE, max_cost=SCORING_CHUNK_NNZ):
+    cumulative_costs = np.concatenate([[0], np.cumsum(row_costs)])
+    bounds = []
+    start = 0
+    while start < len(row_costs):
+        end = int(np.searchsorted(cumulative_costs, cumulative_costs[start] + max_cost, side='right')) - 1
+        end = min(max(end, start + 1), start + max_rows, len(row_costs))
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+# Compute the top suggestions of the users in rows [start, end) of the adjacency matrix, with the shared follows
+# matrix of co_follow_matrix().
+# Returns parallel arrays of (row, candidate column, score, mutual count), sorted by row then descending score
+def score_chunk(matrix, shared, start, end, top_n=SUGGESTIONS_PER_USER, co_follow_weight=CO_FOLLOW_WEIGHT):
+    following = matrix[start:end]
+    size = matrix.shape[1]
+    # The users themselves and the users they already follow are dropped before normalizing, their entries (ex: a
+    # user's own row in the co-follow product adds their number of follows to every user they follow) would otherwise
+    # set the row maximums and squash the scores of the candidates
+    friend_of_friend = _drop_known(following @ matrix, following, start)
+    co_follow = _drop_known((shared[start:end] @ shared.T) @ matrix, following, start)
+
+    scores = (_normalize_rows(friend_of_friend) + co_follow_weight * _normalize_rows(co_follow)).tocoo()
+    rows, cols, values = scores.row, scores.col, scores.data
+    keys = rows.astype(np.int64) * size + cols
+
+    # Keep the top N candidates of every row: sort by row then descending score and rank candidates within their row
+    order = np.lexsort((-values, rows))
+    rows, cols, values, keys = rows[order], cols[order], values[order], keys[order]
+    row_starts = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - row_starts < top_n
+    rows, cols, values, keys = rows[keep], cols[keep], values[keep], keys[keep]
+
+    # Look up the friend of friend count (mutual follows) of the kept candidates
+    friend_of_friend = friend_of_friend.tocoo()
+    fof_keys = friend_of_friend.row.astype(np.int64) * size + friend_of_friend.col
+    fof_order = np.argsort(fof_keys)
+    fof_keys, fof_counts = fof_keys[fof_order], friend_of_friend.data[fof_order]
+    positions = np.minimum(np.searchsorted(fof_keys, keys), max(len(fof_keys) - 1, 0))
+    mutual_counts = np.zeros(len(keys), dtype=np.int64)
+    if len(fof_keys):
+        found = fof_keys[positions] == keys
+        mutual_counts[found] = fof_counts[positions[found]]
+
+    return rows + start, cols, values, mutual_counts
+
+
+# Rebuild the stored suggestions of every user from the current follow graph.
+# Returns the number of users and suggestions stored
+def build_user_suggestions(top_n=SUGGESTIONS_PER_USER, co_follow_weight=CO_FOLLOW_WEIGHT, chunk_size=SCORING_CHUNK_SIZE,
+                           from_snapshot=False, chunk_nnz=SCORING_CHUNK_NNZ, co_follow_max_degree=CO_FOLLOW_MAX_DEGREE):
+    user_ids, matrix = load_follow_matrix_from_snapshot() if from_snapshot else load_follow_matrix()
+    # Users deleted since the edges were read can't be stored in suggestions
+    existing_user_ids = np.fromiter(User.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64)
+    shared, row_costs = co_follow_matrix(matrix, co_follow_max_degree)
+
+    stored = 0
+    for start, end in chunk_bounds(row_costs, chunk_size, chunk_nnz):
+        rows, cols, scores, mutual_counts = score_chunk(matrix, shared, start, end, top_n, co_follow_weight)
+        existing = np.isin(user_ids[rows], existing_user_ids) & np.isin(user_ids[cols], existing_user_ids)
+        rows, cols, scores, mutual_counts = rows[existing], cols[existing], scores[existing], mutual_counts[existing]
+
+        suggestions = [
+            UserSuggestion(user_id=user_ids[row], suggested_user_id=user_ids[col], score=float(score), mutual_count=int(mutual_count))
+            for row, col, score, mutual_count in zip(rows, cols, scores, mutual_counts)
+        ]
+
+        # Replace the suggestions of the chunk's users in one transaction so they are never served half built
+        with transaction.atomic():
+            UserSuggestion.objects.filter(user_id__in=user_ids[start:end].tolist()).delete()
+            UserSuggestion.objects.bulk_create(suggestions, batch_size=5000)
+        stored += len(suggestions)
+
+    # Users that no longer follow anyone have no suggestions to rebuild, drop their outdated ones
+    UserSuggestion.objects.exclude(user_id__in=Follow.objects.filter(follow_status='accepted').values('follower_id')).delete()
+
+    return len(user_ids), stored
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import time
+from collections import deque
+from urllib.parse import parse_qs
+from django.conf import settings
+from channels.generic.websocket import AsyncWebsocketConsumer
+from ..Services import metrics
+
+
+# Delivery policies for outbound frames
+NEVER_DROP = 'never_drop'  # Always delivered, a connection that can't keep up with these is disconnected
+COALESCE = 'coalesce'  # Only the latest pending frame with the same key is delivered (ex: typing indicators, count updates)
+DROPPABLE = 'droppable'  # Dropped when the connection already has a backlog (ex: heartbeat acknowledgements)
+
+# Delivery policy of each outbound frame type, frame types that are not listed are never dropped
+OUTBOUND_POLICIES = {
+    "typing": COALESCE,
+    "count_update": COALESCE,
+    "heartbeat_ack": DROPPABLE,
+}
+
+# Maximum number of frames not yet acknowledged by the client (waiting to be sent, or sent to a client acknowledging
+# frames) before the connection is considered a slow consumer
+MAX_OUTBOUND_QUEUE = getattr(settings, 'WEBSOCKET_MAX_OUTBOUND_QUEUE', 200)
+# Maximum number of seconds the oldest frame not yet acknowledged by the client (or not yet sent, for clients that don't
+# acknowledge frames) can wait before the connection is considered a slow consumer
+MAX_OUTBOUND_LAG = getattr(settings, 'WEBSOCKET_MAX_OUTBOUND_LAG_SECONDS', 30)
+# Maximum number of frames sent to a client acknowledging frames and not yet acknowledged, further frames wait in the queue
+SEND_WINDOW = getattr(settings, 'WEBSOCKET_SEND_WINDOW', 50)
+# Number of frames not yet acknowledged by the client above which droppable frames are discarded
+DROPPABLE_THRESHOLD = MAX_OUTBOUND_QUEUE // 4
+
+# Close code sent to slow consumers, clients should reconnect and resynchronise their state
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+# Get the key frames are coalesced by, frames with the same key replace each other while they are waiting to be sent
+def coalesce_key(frame):
+    return (frame.get("type"), frame.get("receiver_id"), frame.get("user_id"), frame.get("unique_identifier"))
+
+
+# WebSocket consumer that sends frames to the client through a bounded per-connection queue.
+# Event handlers enqueue frames instead of sending them, and a writer task drains the queue to the client.
+# The server buffers sent frames without limit, so a successful send doesn't mean the client is keeping up. Clients
+# connecting with ?frame_acks=1 opt in to acknowledgements: every frame carries a per-connection sequence number ("seq")
+# that they acknowledge with {"type": "frame_ack", "seq": n} for all frames up to n. At most SEND_WINDOW frames are sent
+# to them without being acknowledged, the following ones wait in the queue where they can be coalesced or dropped.
+# Other clients are only measured by the frames waiting in the queue. A client that falls too far behind is disconnected.
+class BufferedWebsocketConsumer(AsyncWebsocketConsumer):
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol)
+
+        # Whether the client acknowledges the frames it receives, requested with ?frame_acks=1 when connecting
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.frame_acks = query.get('frame_acks') == ['1']
+        # Frames waiting to be sent to the client as [frame, enqueued_at] entries
+        self.outbound_queue = deque()
+        # Waiting coalescable frames by their coalesce key, so newer frames can replace them
+        self.coalescable_frames = {}
+        # Enqueue times of the frames sent and not yet acknowledged, oldest first
+        self.unacked_enqueued_at = deque()
+        # Sequence numbers of the last frame sent and of the last frame acknowledged by the client
+        self.sent_sequence = 0
+        self.acked_sequence = 0
+        self.outbound_ready = asyncio.Event()
+        self.writer_task = asyncio.ensure_future(self.drain_outbound_queue())
+
+    # Number of frames not yet acknowledged by the client, waiting to be sent or sent
+    def outbound_backlog(self):
+        return len(self.outbound_queue) + len(self.unacked_enqueued_at)
+
+    # Queue a frame to be sent to the client according to the delivery policy of its type
+    async def enqueue(self, frame):
+        if not hasattr(self, 'outbound_queue'):
+            return
+
+        policy = OUTBOUND_POLICIES.get(frame.get("type"), NEVER_DROP)
+
+        if policy == COALESCE:
+            key = coalesce_key(frame)
+            pending = self.coalescable_frames.get(key)
+            if pending is not None:
+                # Replace the waiting frame in place so it keeps its position in the queue
+                pending[0] = frame
+                metrics.increment('websocket_outbound_coalesced')
+                return
+        elif policy == DROPPABLE and self.outbound_backlog() >= DROPPABLE_THRESHOLD:
+            metrics.increment('websocket_outbound_dropped')
+            return
+
+        entry = [frame, time.monotonic()]
+        self.outbound_queue.append(entry)
+        if policy == COALESCE:
+            self.coalescable_frames[key] = entry
+        metrics.adjust_gauge('websocket_outbound_queued', 1)
+        metrics.observe('websocket_outbound_queue_depth', self.outbound_backlog())
+
+        # Disconnect the client if it fell too far behind, it will have to resynchronise when it reconnects
+        oldest_enqueued_at = self.unacked_enqueued_at[0] if self.unacked_enqueued_at else self.outbound_queue[0][1]
+        if self.outbound_backlog() > MAX_OUTBOUND_QUEUE or time.monotonic() - oldest_enqueued_at > MAX_OUTBOUND_LAG:
+            await self.disconnect_slow_consumer()
+            return
+
+        self.outbound_ready.set()
+
+    # Sends the queued frames to the client in order, while a client acknowledging frames has acknowledged enough of
+    # the frames sent. A failed send closes the connection instead of leaving it open without a writer
+    async def drain_outbound_queue(self):
+        try:
+            while True:
+                await self.outbound_ready.wait()
+                self.outbound_ready.clear()
+
+                while self.outbound_queue and len(self.unacked_enqueued_at) < SEND_WINDOW:
+                    frame, enqueued_at = self.outbound_queue.popleft()
+                    metrics.adjust_gauge('websocket_outbound_queued', -1)
+                    if OUTBOUND_POLICIES.get(frame.get("type")) == COALESCE:
+                        self.coalescable_frames.pop(coalesce_key(frame), None)
+                    if self.frame_acks:
+                        self.sent_sequence += 1
+                        self.unacked_enqueued_at.append(enqueued_at)
+                        metrics.adjust_gauge('websocket_outbound_unacked', 1)
+                        frame = {**frame, "seq": self.sent_sequence}
+                    await self.send(text_data=json.dumps(frame))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.increment('websocket_outbound_send_errors')
+            self.clear_outbound_queue(cancel_writer=False)
+            await self.close()
+
+    # Records the client's acknowledgement of the frames sent up to a sequence number and resumes sending
+    def acknowledge_frames(self, sequence):
+        if not hasattr(self, 'outbound_queue') or not isinstance(sequence, int):
+            return
+        sequence = min(sequence, self.sent_sequence)
+        while self.acked_sequence < sequence:
+            self.acked_sequence += 1
+            self.unacked_enqueued_at.popleft()
+            metrics.adjust_gauge('websocket_outbound_unacked', -1)
+        self.outbound_ready.set()
+
+    # Handles the frame acknowledgements of a client acknowledging frames, and passes the other frames to receive()
+    async def websocket_receive(self, message):
+        text_data = message.get("text")
+        if text_data and getattr(self, 'frame_acks', False) and '"frame_ack"' in text_data:
+            try:
+                frame = json.loads(text_data)
+            except ValueError:
+                frame = None
+            if isinstance(frame, dict) and frame.get("type") == "frame_ack":
+                self.acknowledge_frames(frame.get("seq"))
+                return
+        await super().websocket_receive(message)
+
+    # Discards the waiting frames and stops the writer task
+    def clear_outbound_queue(self, cancel_writer=True):
+        if not hasattr(self, 'outbound_queue'):
+            return
+
+        if cancel_writer:
+            self.writer_task.cancel()
+        metrics.adjust_gauge('websocket_outbound_queued', -len(self.outbound_queue))
+        metrics.adjust_gauge('websocket_outbound_unacked', -len(self.unacked_enqueued_at))
+        self.outbound_queue.clear()
+        self.coalescable_frames.clear()
+        self.unacked_enqueued_at.clear()
+        del self.outbound_queue
+
+    # Closes a connection that can't keep up, hinting the client to resynchronise its state after reconnecting
+    async def disconnect_slow_consumer(self):
+        self.clear_outbound_queue()
+        metrics.increment('websocket_slow_consumer_disconnects')
+
+        await self.send(text_data=json.dumps({
+            "type": "resync_required",
+            "reason": "slow_consumer",
+        }))
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        self.clear_outbound_queue()
+        await super().websocket_disconnect(message)
@@ -1,11 +1,19 @@
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
+import time
+from django.conf import settings
 from channels.db import database_sync_to_async
-from ..models import Message, User
+from asgiref.sync import sync_to_async
+from ..models import User
+from ..Services import presence_registry, message_delivery
+from .buffered_consumer import BufferedWebsocketConsumer
+
+
+# Minimum number of seconds between two "is typing" events relayed from the same connection
+TYPING_THROTTLE = getattr(settings, 'TYPING_THROTTLE_SECONDS', 3)
 
 
 # WebSocket consumer to handle live messaging between users
-class MessageConsumer(AsyncWebsocketConsumer):
+class MessageConsumer(BufferedWebsocketConsumer):
 
     # Retrieve a user from the database by their authentication token.
     # wrapped with @database_sync_to_async to allow database access in an asynchronous context.
@@ -16,13 +24,16 @@ class MessageConsumer(AsyncWebsocketConsumer):
         except User.DoesNotExist:
             return None
 
-    # Retrieve a message from the database by its ID
+    # Retrieve a batch of messages of the conversation the client missed.
+    # The messages the user hasn't acknowledged yet are returned, after the last message of the previous batch if given
     @database_sync_to_async
-    def get_message(self, message_id):
-        try:
-            return Message.objects.get(id=message_id)
-        except Message.DoesNotExist:
-            return None
+    def get_replay_batch(self, after):
+        return message_delivery.get_undelivered_messages(self.auth_user.id, self.receiver_id, after=after)
+
+    # Mark the messages acknowledged by the client as delivered
+    @database_sync_to_async
+    def acknowledge_delivery(self, message_ids):
+        return message_delivery.acknowledge_delivery(self.auth_user.id, message_ids)
 
     # Initiates a WebSocket connection for live messaging.
     async def connect(self):
@@ -50,8 +61,12 @@ class MessageConsumer(AsyncWebsocketConsumer):
         # Store the authenticated user's id to be used in the mark_message_as_read function
         self.auth_user = sender
 
+        # Time the last "is typing" event was relayed from this connection (used to throttle typing events)
+        self.last_typing_sent = 0
+
         # Extract receiver ID from the WebSocket URL parameter
         receiver_id = int(self.scope['url_route']['kwargs']['receiver_id'])
+        self.receiver_id = receiver_id
 
         # Create a unique room group name using both sender and receiver IDs
         self.room_group_name = f"group_{min(sender_id, receiver_id)}_{max(sender_id, receiver_id)}"
@@ -62,31 +77,47 @@ class MessageConsumer(AsyncWebsocketConsumer):
         # Accept the WebSocket connection
         await self.accept()
 
+        # Mark the user as online in the presence registry
+        await sync_to_async(presence_registry.mark_online)(sender_id)
+
+        # Send the messages that were never delivered to the user, whatever the client received before
+        await self.send_replay(None)
+
     # Handles disconnection from the messaging session.
     async def disconnect(self, close_code):
-        if hasattr(self, 'notification_group'):
+        if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
+            # Mark the user as offline if this was their last open connection
+            await sync_to_async(presence_registry.mark_offline)(self.auth_user.id)
 
     # Marks a message in the Live WebSocket conversation as read if the user reading the message is the receiver
     async def mark_message_as_read(self, unique_identifier):
-        # Find the message by its unique identifier and mark it as read
-        try:
-            message_id = int(unique_identifier)
-            message = await self.get_message(message_id)
-
-            # Check the receiver of the notification is the authenticated user and the message is not read
-            if message.receiver == self.auth_user and not message.is_read:
-                message.is_read = True
-                message.save()
-        except (ValueError, Message.DoesNotExist):
-            pass
+        message_id = message_delivery.parse_sequence(unique_identifier)
+        if message_id is not None:
+            await database_sync_to_async(message_delivery.mark_message_as_read)(self.auth_user.id, message_id)
 
     # Receives incoming messages from the WebSocket connection and relays the messages to other users in the same chat group.
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+
+        # Control frames that are not chat messages
+        frame_type = text_data_json.get("type")
+        if frame_type == "heartbeat":
+            await self.receive_heartbeat()
+            return
+        if frame_type == "typing":
+            await self.receive_typing(bool(text_data_json.get("is_typing", True)))
+            return
+        if frame_type == "ack":
+            await self.receive_ack(text_data_json)
+            return
+        if frame_type == "replay":
+            await self.send_replay(message_delivery.parse_sequence(text_data_json.get("since")))
+            return
+
         content = text_data_json["content"]
         unique_identifier = text_data_json["unique_identifier"]
 
@@ -98,27 +129,105 @@ class MessageConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 "type": "chat.message",
+                "room": self.room_group_name,
                 "content": content,
                 "unique_identifier": unique_identifier,
             }
         )
 
+    # Keeps the user's presence alive while the connection is open
+    async def receive_heartbeat(self):
+        await sync_to_async(presence_registry.heartbeat)(self.auth_user.id)
+        await self.enqueue({"type": "heartbeat_ack"})
+
+    # Relays "is typing" signals to the conversation group without touching the database.
+    # Typing starts are throttled per connection, typing stops are only relayed if a start was relayed
+    async def receive_typing(self, is_typing):
+        now = time.monotonic()
+        if is_typing:
+            if now - self.last_typing_sent < TYPING_THROTTLE:
+                return
+            self.last_typing_sent = now
+        else:
+            if not self.last_typing_sent:
+                return
+            self.last_typing_sent = 0
+
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                "type": "chat.typing",
+                "room": self.room_group_name,
+                "user_id": self.auth_user.id,
+                "is_typing": is_typing,
+            }
+        )
+
+    # Sends a batch of missed messages to the client. Clients ask for the next batch with the returned last_sequence
+    # (as "since"), and acknowledge the messages they received by their ids
+    async def send_replay(self, since):
+        messages, has_more = await self.get_replay_batch(since)
+        await self.enqueue({
+            "type": "replay",
+            "messages": messages,
+            "has_more": has_more,
+            "last_sequence": int(messages[-1]["unique_identifier"]) if messages else since,
+        })
+
+    # Marks the messages acknowledged by the client as delivered and informs their senders
+    async def receive_ack(self, text_data_json):
+        message_ids = text_data_json.get("unique_identifiers")
+        if message_ids is not None:
+            message_ids = [message_id for message_id in map(message_delivery.parse_sequence, message_ids) if message_id is not None]
+
+        delivered_by_sender = await self.acknowledge_delivery(message_ids)
+        for sender_id, delivered_ids in delivered_by_sender.items():
+            room_group_name = message_delivery.conversation_group_name(self.auth_user.id, sender_id)
+            await self.channel_layer.group_send(
+                room_group_name,
+                {
+                    "type": "message.delivered",
+                    "room": room_group_name,
+                    "unique_identifiers": delivered_ids,
+                }
+            )
+
     # Relays messages to users in the chat group and sends the message to the original consumer (WebSocket connection).
     async def chat_message(self, event):
         content = event["content"]
         unique_identifier = event["unique_identifier"]
 
-        await self.send(text_data=json.dumps({
+        await self.enqueue({
             "type": "message",
+            "sender": event.get("sender"),
             "content": content,
             "unique_identifier": unique_identifier,
-        }))
+        })
 
     # Send a WebSocket message to the client indicating that a message should be removed
     async def remove_message(self, event):
         unique_identifier = event["unique_identifier"]
 
-        await self.send(text_data=json.dumps({
+        await self.enqueue({
             "type": "remove_message",
             "unique_identifier": unique_identifier,
-        }))
+        })
+
+    # Send a typing indicator to the other participant of the conversation
+    async def chat_typing(self, event):
+        # Do not echo the typing indicator back to the user who is typing
+        if event["user_id"] == self.auth_user.id:
+            return
+
+        await self.enqueue({
+            "type": "typing",
+            "user_id": event["user_id"],
+            "is_typing": event["is_typing"],
+        })
+
+    # Informs the sender of messages that they were delivered to the receiver
+    async def message_delivered(self, event):
+        await self.enqueue({
+            "type": "message_delivered",
+            "unique_identifiers": event["unique_identifiers"],
+        })
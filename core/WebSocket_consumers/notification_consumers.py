@@ -1,27 +1,50 @@
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from ..models import Notification, User
+from asgiref.sync import sync_to_async
+from ..models import User
+from ..Services import presence_registry
+from .buffered_consumer import BufferedWebsocketConsumer
 
 
 # WebSocket consumer for handling real-time notifications.
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(BufferedWebsocketConsumer):
 
-    # Retrieve a notification from the database by its ID
-    # wrapped with @database_sync_to_async to allow database access in an asynchronous context.
+    # Retrieve the id of a user from the database by their authentication token
     @database_sync_to_async
-    def get_notification(self, notification_id):
-        try:
-            return Notification.objects.get(id=notification_id)
-        except Notification.DoesNotExist:
-            return None
+    def get_user_id_by_token(self, token):
+        return User.objects.filter(auth_token=token).values_list('id', flat=True).first()
 
     # Establishes a WebSocket connection for the user's notifications.
+    # The connection is authenticated like the other consumers, and only the user of the url can open it (it joins
+    # their notification group and keeps them online in the presence registry)
     async def connect(self):
-        # Get the receiver of the WebSocket Notifications from the url
-        user = self.scope["url_route"]["kwargs"]["user_id"]
-
-        # Store the authenticated user's id to be used in the mark_notification_as_read function
+        # Get headers from the connection's scope
+        headers = dict(self.scope["headers"])
+
+        # If user is not authenticated, send an authentication required message and close the connection
+        if b"authorization" not in headers:
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                "type": "authentication_required",
+                "message": "Authentication is required to access notifications."
+            }))
+            await self.close()
+            return
+
+        # Extract the token from the Authorization header and get the user associated with the token
+        try:
+            token = headers[b"authorization"].decode("utf-8").split()[1]
+        except IndexError:
+            await self.close()
+            return
+        user = await self.get_user_id_by_token(token)
+
+        # Get the receiver of the WebSocket Notifications from the url, it must be the authenticated user
+        if user is None or user != int(self.scope["url_route"]["kwargs"]["user_id"]):
+            await self.close()
+            return
+
+        # Store the authenticated user's id
         self.auth_userId = user
 
         # Create a notification group for the user and add it to the channel layer
@@ -33,6 +56,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        # Mark the user as online in the presence registry
+        await sync_to_async(presence_registry.mark_online)(user)
+
     # Disconnects the user from the WebSocket notification group.
     async def disconnect(self, close_code):
         if hasattr(self, 'notification_group'):
@@ -40,22 +66,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.notification_group,
                 self.channel_name
             )
+            # Mark the user as offline if this was their last open connection
+            await sync_to_async(presence_registry.mark_offline)(self.auth_userId)
 
-    # Marks a notification in the Live WebSocket as read if the user reading the notification is the recipient
-    async def mark_notification_as_read(self, unique_identifier):
-        try:
-            # Find the notification by its unique identifier
-            notification_id = int(unique_identifier)
-            notification = await self.get_notification(notification_id)
-            if notification:
-                # Find the recipient of the notification
-                recipient_id = notification.recipient_id
-                # Check the notification recipient matches the current authenticated user and the notification is unread
-                if recipient_id == self.auth_userId and not notification.is_read:
-                    notification.is_read = True
-                    await notification.save()
-        except ValueError:
-            pass
+    # Receives control frames from the client. Heartbeats keep the user's presence alive while the connection is open
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+
+        if text_data_json.get("type") == "heartbeat":
+            await sync_to_async(presence_registry.heartbeat)(self.auth_userId)
+            await self.enqueue({"type": "heartbeat_ack"})
 
     # Sends a new notification message to the connected user.
     async def core_notification(self, event):
@@ -71,7 +91,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         post_media_url = event.get("post_media_url")  # Use .get() to handle the possibility of missing key
 
         # Send notification data to the user
-        await self.send(text_data=json.dumps({
+        await self.enqueue({
             "type": "core.notification",
             "unique_identifier": unique_identifier,
             "notification_type": notification_type,
@@ -80,27 +100,31 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             "message": message,
             "sender_profile_picture_url": sender_profile_picture_url,
             "post_media_url": post_media_url,
-        }))
-
-        # Mark the notification as read if the recipient is the current user
-        await self.mark_notification_as_read(unique_identifier)
+        })
 
     # Function to send accepted follow request updates to frontend Websocket client to make necessary front-end changes
     async def notification_follow_request_accept(self, event):
         unique_identifier = event["unique_identifier"]
 
         # Send update to the connected frontend clients
-        await self.send(text_data=json.dumps({
+        await self.enqueue({
             "type": "notification_follow_request_accept",
             "unique_identifier": unique_identifier,
-        }))
+        })
+
+    # Function to send a batch of accepted follow requests to the frontend Websocket client (ex: after switching to a public profile)
+    async def notification_follow_request_accept_batch(self, event):
+        await self.enqueue({
+            "type": "notification_follow_request_accept_batch",
+            "unique_identifiers": event["unique_identifiers"],
+        })
 
     # Removes a specific notification from the user's WebSocket
     async def remove_notification(self, event):
         unique_identifier = event["unique_identifier"]
 
         # Send removal instruction to the user's WebSocket
-        await self.send(text_data=json.dumps({
+        await self.enqueue({
             "type": "remove.notification",
             "unique_identifier": unique_identifier,
-        }))
+        })
@@ -0,0 +1,332 @@
+import json
+import time
+from django.conf import settings
+from channels.db import database_sync_to_async
+from asgiref.sync import sync_to_async
+from ..models import User
+from ..Services import presence_registry, message_delivery
+from ..Services.message_delivery import conversation_group_name
+from .buffered_consumer import BufferedWebsocketConsumer
+
+
+# Minimum number of seconds between two "is typing" events relayed for the same conversation
+TYPING_THROTTLE = getattr(settings, 'TYPING_THROTTLE_SECONDS', 3)
+# Maximum number of conversation rooms a single connection can be subscribed to at the same time
+MAX_CONVERSATION_SUBSCRIPTIONS = getattr(settings, 'WEBSOCKET_MAX_CONVERSATION_SUBSCRIPTIONS', 50)
+
+
+# Single WebSocket consumer per user that multiplexes the user's notifications and any number of conversations.
+# The user is authenticated once on connect and joins their notification group, conversation rooms are then
+# joined and left on demand with "subscribe" and "unsubscribe" control frames.
+class UserConsumer(BufferedWebsocketConsumer):
+
+    # Retrieve the id and username of a user from the database by their authentication token.
+    # Only these values are kept on the connection to keep per-connection memory low
+    @database_sync_to_async
+    def get_user_by_token(self, token):
+        return User.objects.filter(auth_token=token).values_list('id', 'username').first()
+
+    # Mark a message as read if the authenticated user is its receiver
+    @database_sync_to_async
+    def mark_message_as_read(self, message_id):
+        message_delivery.mark_message_as_read(self.user_id, message_id)
+
+    # Retrieve a batch of messages across all of the user's conversations that the client missed.
+    # The messages the user hasn't acknowledged yet are returned, after the last message of the previous batch if given
+    @database_sync_to_async
+    def get_replay_batch(self, after):
+        return message_delivery.get_undelivered_messages(self.user_id, after=after)
+
+    # Mark the messages acknowledged by the client as delivered
+    @database_sync_to_async
+    def acknowledge_delivery(self, message_ids):
+        return message_delivery.acknowledge_delivery(self.user_id, message_ids)
+
+    # Initiates the WebSocket connection for the authenticated user
+    async def connect(self):
+        # Get headers from the connection's scope
+        headers = dict(self.scope["headers"])
+
+        # If user is not authenticated, send an authentication required message and close the connection
+        if b"authorization" not in headers:
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                "type": "authentication_required",
+                "message": "Authentication is required to open a connection."
+            }))
+            await self.close()
+            return
+
+        # Extract the token from the Authorization header and get the user associated with the token
+        try:
+            token = headers[b"authorization"].decode("utf-8").split()[1]
+        except IndexError:
+            await self.close()
+            return
+        user = await self.get_user_by_token(token)
+        if user is None:
+            await self.close()
+            return
+        self.user_id, self.username = user
+
+        # Conversation rooms this connection is subscribed to, mapping the room group name to the other user's id
+        self.conversation_groups = {}
+        # Time the last "is typing" event was relayed for each conversation room
+        self.last_typing_sent = {}
+
+        # Join the user's notification group
+        self.notification_group = f"notifications_{self.user_id}"
+        await self.channel_layer.group_add(self.notification_group, self.channel_name)
+
+        await self.accept()
+
+        # Mark the user as online in the presence registry
+        await sync_to_async(presence_registry.mark_online)(self.user_id)
+
+        # Send the messages that were never delivered to the user, whatever the client received before
+        await self.send_replay(None)
+
+    # Leaves the notification group and every subscribed conversation room
+    async def disconnect(self, close_code):
+        if hasattr(self, 'notification_group'):
+            await self.channel_layer.group_discard(self.notification_group, self.channel_name)
+            for room_group_name in self.conversation_groups:
+                await self.channel_layer.group_discard(room_group_name, self.channel_name)
+
+            # Mark the user as offline if this was their last open connection
+            await sync_to_async(presence_registry.mark_offline)(self.user_id)
+
+    # Send an error frame to the client without closing the connection
+    async def send_error(self, message):
+        await self.enqueue({"type": "error", "message": message})
+
+    # Get the room group name of the conversation with the "receiver_id" of a frame, if the connection is subscribed to it
+    def get_subscribed_group(self, text_data_json):
+        try:
+            receiver_id = int(text_data_json.get("receiver_id"))
+        except (TypeError, ValueError):
+            return None
+        room_group_name = conversation_group_name(self.user_id, receiver_id)
+        return room_group_name if room_group_name in self.conversation_groups else None
+
+    # Receives frames from the client and dispatches them by their type
+    async def receive(self, text_data):
+        try:
+            text_data_json = json.loads(text_data)
+        except ValueError:
+            await self.send_error("Frames must be valid JSON")
+            return
+
+        frame_type = text_data_json.get("type")
+
+        if frame_type == "heartbeat":
+            await sync_to_async(presence_registry.heartbeat)(self.user_id)
+            await self.enqueue({"type": "heartbeat_ack"})
+        elif frame_type == "subscribe":
+            await self.subscribe_conversation(text_data_json)
+        elif frame_type == "unsubscribe":
+            await self.unsubscribe_conversation(text_data_json)
+        elif frame_type == "message":
+            await self.relay_message(text_data_json)
+        elif frame_type == "typing":
+            await self.relay_typing(text_data_json)
+        elif frame_type == "ack":
+            await self.receive_ack(text_data_json)
+        elif frame_type == "replay":
+            await self.send_replay(message_delivery.parse_sequence(text_data_json.get("since")))
+        else:
+            await self.send_error(f"Unknown frame type: {frame_type}")
+
+    # Joins the conversation room with another user
+    async def subscribe_conversation(self, text_data_json):
+        try:
+            receiver_id = int(text_data_json.get("receiver_id"))
+        except (TypeError, ValueError):
+            await self.send_error("A valid receiver_id is required")
+            return
+
+        if receiver_id == self.user_id:
+            await self.send_error("Cannot subscribe to a conversation with yourself")
+            return
+
+        room_group_name = conversation_group_name(self.user_id, receiver_id)
+        if room_group_name not in self.conversation_groups:
+            if len(self.conversation_groups) >= MAX_CONVERSATION_SUBSCRIPTIONS:
+                await self.send_error(f"A maximum of {MAX_CONVERSATION_SUBSCRIPTIONS} conversations can be subscribed to at once")
+                return
+
+            await self.channel_layer.group_add(room_group_name, self.channel_name)
+            self.conversation_groups[room_group_name] = receiver_id
+
+        await self.enqueue({"type": "subscribed", "receiver_id": receiver_id})
+
+    # Leaves the conversation room with another user
+    async def unsubscribe_conversation(self, text_data_json):
+        room_group_name = self.get_subscribed_group(text_data_json)
+        if room_group_name is None:
+            return
+
+        await self.channel_layer.group_discard(room_group_name, self.channel_name)
+        receiver_id = self.conversation_groups.pop(room_group_name)
+        self.last_typing_sent.pop(room_group_name, None)
+
+        await self.enqueue({"type": "unsubscribed", "receiver_id": receiver_id})
+
+    # Relays a message to a subscribed conversation room and marks it as read if the user is its receiver
+    async def relay_message(self, text_data_json):
+        room_group_name = self.get_subscribed_group(text_data_json)
+        if room_group_name is None:
+            await self.send_error("Subscribe to the conversation before sending to it")
+            return
+
+        content = text_data_json.get("content")
+        unique_identifier = text_data_json.get("unique_identifier")
+
+        message_id = message_delivery.parse_sequence(unique_identifier)
+        if message_id is not None:
+            await self.mark_message_as_read(message_id)
+
+        await self.channel_layer.group_send(
+            room_group_name,
+            {
+                "type": "chat.message",
+                "room": room_group_name,
+                "content": content,
+                "unique_identifier": unique_identifier,
+            }
+        )
+
+    # Relays throttled "is typing" signals to a subscribed conversation room without touching the database
+    async def relay_typing(self, text_data_json):
+        room_group_name = self.get_subscribed_group(text_data_json)
+        if room_group_name is None:
+            return
+
+        is_typing = bool(text_data_json.get("is_typing", True))
+        now = time.monotonic()
+        if is_typing:
+            if now - self.last_typing_sent.get(room_group_name, 0) < TYPING_THROTTLE:
+                return
+            self.last_typing_sent[room_group_name] = now
+        elif not self.last_typing_sent.pop(room_group_name, None):
+            return
+
+        await self.channel_layer.group_send(
+            room_group_name,
+            {
+                "type": "chat.typing",
+                "room": room_group_name,
+                "user_id": self.user_id,
+                "is_typing": is_typing,
+            }
+        )
+
+    # Sends a batch of missed messages to the client. Clients ask for the next batch with the returned last_sequence
+    # (as "since"), and acknowledge the messages they received by their ids
+    async def send_replay(self, since):
+        messages, has_more = await self.get_replay_batch(since)
+        await self.enqueue({
+            "type": "replay",
+            "messages": messages,
+            "has_more": has_more,
+            "last_sequence": int(messages[-1]["unique_identifier"]) if messages else since,
+        })
+
+    # Marks the messages acknowledged by the client as delivered and informs their senders
+    async def receive_ack(self, text_data_json):
+        message_ids = text_data_json.get("unique_identifiers")
+        if message_ids is not None:
+            message_ids = [message_id for message_id in map(message_delivery.parse_sequence, message_ids) if message_id is not None]
+
+        delivered_by_sender = await self.acknowledge_delivery(message_ids)
+        for sender_id, delivered_ids in delivered_by_sender.items():
+            room_group_name = conversation_group_name(self.user_id, sender_id)
+            await self.channel_layer.group_send(
+                room_group_name,
+                {
+                    "type": "message.delivered",
+                    "room": room_group_name,
+                    "unique_identifiers": delivered_ids,
+                }
+            )
+
+    # Get the id of the other user in the conversation an event was sent to
+    def get_event_receiver_id(self, event):
+        return self.conversation_groups.get(event.get("room"))
+
+    # ---------- Conversation events ----------
+
+    # Sends a message from a subscribed conversation room to the client
+    async def chat_message(self, event):
+        await self.enqueue({
+            "type": "message",
+            "receiver_id": self.get_event_receiver_id(event),
+            "sender": event.get("sender"),
+            "content": event["content"],
+            "unique_identifier": event["unique_identifier"],
+        })
+
+    # Send a WebSocket message to the client indicating that a message should be removed
+    async def remove_message(self, event):
+        await self.enqueue({
+            "type": "remove_message",
+            "receiver_id": self.get_event_receiver_id(event),
+            "unique_identifier": event["unique_identifier"],
+        })
+
+    # Send a typing indicator from the other participant of a subscribed conversation
+    async def chat_typing(self, event):
+        # Do not echo the typing indicator back to the user who is typing
+        if event["user_id"] == self.user_id:
+            return
+
+        await self.enqueue({
+            "type": "typing",
+            "receiver_id": self.get_event_receiver_id(event),
+            "user_id": event["user_id"],
+            "is_typing": event["is_typing"],
+        })
+
+    # Informs the sender of messages that they were delivered to the receiver
+    async def message_delivered(self, event):
+        await self.enqueue({
+            "type": "message_delivered",
+            "receiver_id": self.get_event_receiver_id(event),
+            "unique_identifiers": event["unique_identifiers"],
+        })
+
+    # ---------- Notification events ----------
+
+    # Sends a new notification to the client
+    async def core_notification(self, event):
+        await self.enqueue({
+            "type": "core.notification",
+            "unique_identifier": event["unique_identifier"],
+            "notification_type": event["notification_type"],
+            "recipient": event["recipient"],
+            "sender": event["sender"],
+            "message": event["message"],
+            "sender_profile_picture_url": event["sender_profile_picture_url"],
+            "post_media_url": event.get("post_media_url"),
+        })
+
+    # Sends accepted follow request updates to the client to make the necessary front-end changes
+    async def notification_follow_request_accept(self, event):
+        await self.enqueue({
+            "type": "notification_follow_request_accept",
+            "unique_identifier": event["unique_identifier"],
+        })
+
+    # Function to send a batch of accepted follow requests to the frontend Websocket client (ex: after switching to a public profile)
+    async def notification_follow_request_accept_batch(self, event):
+        await self.enqueue({
+            "type": "notification_follow_request_accept_batch",
+            "unique_identifiers": event["unique_identifiers"],
+        })
+
+    # Removes a specific notification from the client
+    async def remove_notification(self, event):
+        await self.enqueue({
+            "type": "remove.notification",
+            "unique_identifier": event["unique_identifier"],
+        })
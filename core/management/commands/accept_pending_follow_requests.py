@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Follow
+from core.Services.follow_request_acceptance import accept_all_pending_follow_requests
+
+
+# Command: python manage.py accept_pending_follow_requests [--user {user_id}]
+# Accepts the pending follow requests of public users. Used to resume acceptance jobs that were interrupted
+# (ex: the worker running them restarted) after a user switched their profile to public
+class Command(BaseCommand):
+    help = "Accept the pending follow requests of users whose profile is public"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only accept the pending follow requests of this user")
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user_ids = [options['user']]
+        else:
+            # Public users that still have pending follow requests
+            user_ids = (Follow.objects.filter(follow_status='pending', following__profile_privacy='public')
+                        .values_list('following_id', flat=True).distinct())
+
+        for user_id in user_ids:
+            accepted = accept_all_pending_follow_requests(user_id)
+            if accepted is None:
+                self.stdout.write(f"User {user_id}: an acceptance job is already running, skipping")
+            else:
+                self.stdout.write(f"User {user_id}: accepted {accepted} follow requests")
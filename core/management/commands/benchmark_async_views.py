@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+# Sync and async version of each benchmarked endpoint, {user_id} is replaced by the id of the profile viewed
+ENDPOINTS = {
+    'feed': ('/api/feed/', '/api/async/feed/'),
+    'explore': ('/api/explore/posts/', '/api/async/explore/posts/'),
+    'notifications': ('/api/notifications/', '/api/async/notifications/'),
+    'conversation': ('/api/messages/conversation/{user_id}/', '/api/async/messages/conversation/{user_id}/'),
+    'profile': ('/api/user/profile/{user_id}/', '/api/async/user/profile/{user_id}/'),
+}
+
+
+# Send a GET request to an ASGI application in process, returns the response status
+async def _get(application, path, token):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'authorization', f'Token {token}'.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    response_status = None
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Wait like a client keeping the connection open until the response is sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal response_status
+        if message['type'] == 'http.response.start':
+            response_status = message['status']
+
+    await application(scope, receive, send)
+    return response_status
+
+
+# Command: python manage.py benchmark_async_views --user {user_id} --profile {user_id}
+# Sends the same load (a number of requests with a number of them in flight at once) to the sync and async version of
+# the hot read endpoints through the project's ASGI application, in process as daphne would run it, and reports the
+# throughput and latencies of both. Run it against a copy of production data, with the production cache and database
+class Command(BaseCommand):
+    help = "Compare the throughput of the sync and async versions of the hot read endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help="Id of the user sending the requests")
+        parser.add_argument('--profile', type=int, help="Id of the user whose profile and conversation are requested, defaults to --user")
+        parser.add_argument('--endpoint', choices=list(ENDPOINTS), action='append', help="Only benchmark this endpoint")
+        parser.add_argument('--requests', type=int, default=500, help="Number of requests sent to each version of an endpoint")
+        parser.add_argument('--concurrency', type=int, default=50, help="Number of requests in flight at once")
+
+    async def run_load(self, application, path, token, requests, concurrency):
+        latencies = []
+        errors = 0
+        remaining = iter(range(requests))
+
+        async def client():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                if await _get(application, path, token) != 200:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - start, sorted(latencies), errors
+
+    def report(self, name, version, elapsed, latencies, errors):
+        percentile = lambda share: latencies[min(len(latencies) - 1, int(len(latencies) * share))] * 1000
+        self.stdout.write(f"{name:<14} {version:<6} {len(latencies) / elapsed:8.1f} req/s   p50 {percentile(0.5):7.1f} ms   "
+                          f"p95 {percentile(0.95):7.1f} ms   p99 {percentile(0.99):7.1f} ms   errors {errors}")
+
+    async def benchmark(self, application, token, paths, options):
+        for name, (sync_path, async_path) in paths.items():
+            for version, path in (('sync', sync_path), ('async', async_path)):
+                await _get(application, path, token)  # Warm up (caches, connections)
+                elapsed, latencies, errors = await self.run_load(application, path, token, options['requests'], options['concurrency'])
+                self.report(name, version, elapsed, latencies, errors)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(id=options['user']).first()
+        if user is None:
+            raise CommandError(f"User {options['user']} not found")
+        token, _ = Token.objects.get_or_create(user=user)
+        profile_id = options['profile'] or user.id
+
+        paths = {
+            name: tuple(path.format(user_id=profile_id) for path in ENDPOINTS[name])
+            for name in options['endpoint'] or list(ENDPOINTS)
+        }
+        self.stdout.write(f"{options['requests']} requests per version, {options['concurrency']} in flight")
+        asyncio.run(self.benchmark(get_asgi_application(), token.key, paths, options))
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.utils import load_backend
+
+from core.Services import metrics
+
+
+# Backends compared, the pooled backend is configured with the POOL settings of the database
+BACKENDS = {
+    'direct': 'django.db.backends.postgresql',
+    'pooled': 'core.DB_Backends.pooled_postgresql',
+}
+
+
+# Command: python manage.py benchmark_db_pool --threads 8 --requests 2000
+# Runs request-like cycles (connect, a query, close, as a request or a database_sync_to_async call does with
+# CONN_MAX_AGE = 0) from a number of threads with a new connection per cycle and with pooled connections, and reports
+# the throughput and latencies of both, along with the time spent waiting for a pooled connection.
+# Run it against the production database server (from a worker host) so connection setup costs what it costs there
+class Command(BaseCommand):
+    help = "Compare request latencies with a new database connection per request and with pooled connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias whose settings are used")
+        parser.add_argument('--threads', type=int, default=8, help="Number of threads running cycles at once")
+        parser.add_argument('--requests', type=int, default=2000, help="Number of cycles run with each backend")
+        parser.add_argument('--query', default='SELECT 1', help="Query run in each cycle")
+
+    def run_load(self, settings_dict, alias, options):
+        latencies = []
+        remaining = iter(range(options['requests']))
+        backend = load_backend(settings_dict['ENGINE'])
+
+        def worker():
+            # One wrapper per thread, like django.db.connections
+            connection = backend.DatabaseWrapper(settings_dict, alias)
+            thread_latencies = []
+            for _ in remaining:
+                start = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute(options['query'])
+                    cursor.fetchall()
+                connection.close()
+                thread_latencies.append(time.perf_counter() - start)
+            latencies.extend(thread_latencies)
+            # Also opened on the first connection of a thread (by django.contrib.postgres' connection_created handler)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, sorted(latencies)
+
+    def report(self, name, elapsed, latencies, extra=''):
+        percentile = lambda share: latencies[min(len(latencies) - 1, int(len(latencies) * share))] * 1000
+        self.stdout.write(f"{name:<7} {len(latencies) / elapsed:8.1f} req/s   p50 {percentile(0.5):6.2f} ms   "
+                          f"p95 {percentile(0.95):6.2f} ms   p99 {percentile(0.99):6.2f} ms{extra}")
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        # Connect once first, so the type oids django.contrib.postgres loads on the first connection are cached
+        connections[alias].ensure_connection()
+        connections[alias].close()
+
+        self.stdout.write(f"{options['requests']} cycles per backend, {options['threads']} threads, query: {options['query']}")
+        for name, engine in BACKENDS.items():
+            settings_dict = {**connections.settings[alias], 'ENGINE': engine, 'CONN_MAX_AGE': 0}
+            before = metrics.snapshot()
+            elapsed, latencies = self.run_load(settings_dict, alias, options)
+
+            extra = ''
+            if name == 'pooled':
+                after = metrics.snapshot()
+                wait_before = before['observations'].get('db_pool_wait_ms', {'count': 0, 'sum': 0})
+                wait_after = after['observations']['db_pool_wait_ms']
+                average_wait = (wait_after['sum'] - wait_before['sum']) / max(1, wait_after['count'] - wait_before['count'])
+                opened = after['counters'].get('db_pool_connections_opened', 0) - before['counters'].get('db_pool_connections_opened', 0)
+                extra = f"   pool wait avg {average_wait:.2f} ms max {wait_after['max']:.2f} ms   connections opened {opened}"
+            self.report(name, elapsed, latencies, extra)
@@ -0,0 +1,86 @@
+import time
+import uuid
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+
+from core.models import Hashtag, Post
+from core.serializers import PostSerializer
+from core.Services import media_urls
+
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+
+# Build unsaved posts with media, variants and authors with profile pictures, nothing is written to the database
+def _sample_posts(count):
+    posts = []
+    for index in range(count):
+        stem = uuid.uuid4().hex
+        user = User(
+            id=index + 1,
+            username=f"user{index}",
+            profile_picture=f"profiles/{stem}/avatar.jpg",
+            profile_picture_variants={'thumbnail': f"profiles/{stem}/avatar_150w.webp", 'medium': f"profiles/{stem}/avatar_400w.webp"},
+        )
+        post = Post(
+            id=index + 1,
+            user=user,
+            content="Benchmark post",
+            media=f"posts/{stem}/photo.jpg",
+            media_variants={'thumbnail': f"posts/{stem}/photo_320w.webp", 'medium': f"posts/{stem}/photo_1080w.webp"},
+        )
+        # Serve the hashtags from an empty prefetch cache instead of querying them
+        post._prefetched_objects_cache = {'hashtags': Hashtag.objects.none()}
+        posts.append(post)
+    return posts
+
+
+# Command: python manage.py benchmark_media_urls
+# Times the serialization of pages of posts with the media URLs built through the storage (.url on every image, as
+# before media_urls) and through media_urls, along with the cost of a single URL both ways
+class Command(BaseCommand):
+    help = "Benchmark post serialization with media URLs built by the storage and by media_urls"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100, help="Number of posts serialized per page")
+        parser.add_argument('--repeat', type=int, default=20, help="Number of pages serialized per measurement")
+
+    def time_pages(self, posts, repeat):
+        PostSerializer(posts, many=True).data  # Warm up (storage client, URL base, signed URL cache)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            PostSerializer(posts, many=True).data
+        return (time.perf_counter() - start) / repeat
+
+    def time_urls(self, build_url, names):
+        build_url(names[0])
+        start = time.perf_counter()
+        for name in names:
+            build_url(name)
+        return (time.perf_counter() - start) / len(names)
+
+    def handle(self, *args, **options):
+        posts = _sample_posts(options['posts'])
+        names = [post.media.name for post in posts] * 10
+        enabled = media_urls.ENABLED
+        self.stdout.write(f"Storage: {default_storage.__class__.__module__}.{default_storage.__class__.__name__}")
+
+        try:
+            media_urls.ENABLED = False
+            storage_page = self.time_pages(posts, options['repeat'])
+            media_urls.ENABLED = True
+            builder_page = self.time_pages(posts, options['repeat'])
+        finally:
+            media_urls.ENABLED = enabled
+
+        storage_url = self.time_urls(default_storage.url, names)
+        builder_url = self.time_urls(media_urls.media_url, names)
+
+        scale = 100 / len(posts)
+        self.stdout.write(f"Serialization per 100 posts: storage .url {storage_page * scale * 1000:.2f} ms, "
+                          f"media_urls {builder_page * scale * 1000:.2f} ms ({storage_page / builder_page:.1f}x)")
+        self.stdout.write(f"Single URL: storage .url {storage_url * 1e6:.1f} us, "
+                          f"media_urls {builder_url * 1e6:.1f} us ({storage_url / builder_url:.1f}x)")
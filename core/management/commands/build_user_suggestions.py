@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.Services.user_suggestions import (
+    build_user_suggestions, SUGGESTIONS_PER_USER, CO_FOLLOW_WEIGHT, CO_FOLLOW_MAX_DEGREE, SCORING_CHUNK_SIZE, SCORING_CHUNK_NNZ
+)
+
+
+# Command: python manage.py build_user_suggestions [--top-n {count}] [--co-follow-weight {weight}] [--co-follow-max-degree {followers}]
+#          [--chunk-size {size}] [--chunk-nnz {entries}] [--from-snapshot]
+# Rebuilds the "who to follow" suggestions of every user from the accepted follow graph.
+# Meant to run periodically (ex: nightly), the suggestions endpoint only serves the stored results
+class Command(BaseCommand):
+    help = "Rebuild the precomputed who-to-follow suggestions of every user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-n', type=int, default=SUGGESTIONS_PER_USER, help="Number of suggestions stored per user")
+        parser.add_argument('--co-follow-weight', type=float, default=CO_FOLLOW_WEIGHT,
+                            help="Weight of the co-follow score relative to the friend of friend score")
+        parser.add_argument('--co-follow-max-degree', type=int, default=CO_FOLLOW_MAX_DEGREE,
+                            help="Number of followers above which an account is left out of the co-follow score")
+        parser.add_argument('--chunk-size', type=int, default=SCORING_CHUNK_SIZE, help="Maximum number of users scored at once")
+        parser.add_argument('--chunk-nnz', type=int, default=SCORING_CHUNK_NNZ,
+                            help="Maximum estimated number of entries of the intermediate matrices of a chunk")
+        parser.add_argument('--from-snapshot', action='store_true',
+                            help="Read the follow graph from the latest export_graph_snapshot snapshot instead of the database")
+
+    def handle(self, *args, **options):
+        try:
+            users, suggestions = build_user_suggestions(options['top_n'], options['co_follow_weight'], options['chunk_size'],
+                                                        options['from_snapshot'], options['chunk_nnz'], options['co_follow_max_degree'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Stored {suggestions} suggestions for {users} users")
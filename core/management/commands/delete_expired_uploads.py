@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.Services.direct_uploads import delete_expired_sessions
+
+
+# Command: python manage.py delete_expired_uploads
+# Deletes the direct upload sessions that expired, along with the files uploaded to the sessions that were never
+# used for a post or profile picture. Meant to run periodically (ex: every hour)
+class Command(BaseCommand):
+    help = "Delete expired direct upload sessions and their abandoned uploaded files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=int, default=60 * 60, help="Only delete the sessions expired for longer than this")
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_sessions(grace_seconds=options['grace_seconds'])
+        self.stdout.write(f"Deleted {deleted} expired upload sessions")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+
+from core.models import Post
+from core.Services.sharded_counters import fold_shards
+
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+
+# Command: python manage.py fold_counter_shards
+# Moves the totals of the sharded counter slots of hot posts and users back into their counter fields.
+# Meant to run periodically (ex: every minute), rows that cooled down go back to being updated in place
+class Command(BaseCommand):
+    help = "Fold the sharded counter slots of hot rows back into their counter fields"
+
+    def handle(self, *args, **options):
+        for model in (Post, User):
+            folded = fold_shards(model)
+            self.stdout.write(f"{model.__name__}: folded the counter slots of {folded} rows")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.Services import image_variants
+
+
+# Command: python manage.py generate_image_variants
+# Generates the missing resized variants, sizes and placeholders of post media and profile pictures (ex: images
+# uploaded before variants or placeholders existed, or whose background job failed). --all regenerates the variants
+# of every image (ex: after changing widths)
+class Command(BaseCommand):
+    help = "Generate the missing resized variants of post media and profile pictures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(image_variants.TARGETS), action='append', help="Only generate the variants of this kind of image")
+        parser.add_argument('--all', action='store_true', help="Regenerate the variants of every image, not only the missing ones")
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or list(image_variants.TARGETS):
+            model, field, variants_field, _ = image_variants.TARGETS[kind]
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            if not options['all']:
+                _, _, placeholder_field = image_variants.metadata_fields(field)
+                rows = rows.filter(Q(**{variants_field: {}}) | Q(**{placeholder_field: ''}))
+
+            generated = failed = 0
+            for object_id in rows.order_by('pk').values_list('pk', flat=True).iterator():
+                try:
+                    if image_variants.generate_variants(kind, object_id):
+                        generated += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{kind} {object_id}: {e}")
+
+            self.stdout.write(f"{kind}: generated the variants of {generated} images, {failed} failed")
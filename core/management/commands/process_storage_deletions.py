@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.models import StorageDeletion
+from core.Services import storage_deletions
+
+
+# Command: python manage.py process_storage_deletions
+# Deletes the queued storage objects (media of deleted posts and users, replaced images, abandoned uploads) in
+# batches of multi-object deletes, failed keys are retried with a backoff on later runs.
+# Meant to run periodically (ex: every minute)
+class Command(BaseCommand):
+    help = "Delete the storage objects queued for deletion"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=storage_deletions.BATCH_SIZE, help="Number of keys deleted per request (at most 1000)")
+
+    def handle(self, *args, **options):
+        processed = storage_deletions.process_due_deletions(options['batch_size'])
+        self.stdout.write(f"Processed {processed} queued deletions")
+
+        failed = StorageDeletion.objects.filter(attempts__gte=storage_deletions.MAX_ATTEMPTS).count()
+        if failed:
+            self.stderr.write(f"{failed} deletions failed {storage_deletions.MAX_ATTEMPTS} times and are no longer retried")
@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+from core.models import Post, Follow, Comment, CounterJournal
+from core.Services import sharded_counters
+from core.Services.sharded_counters import fold_shards
+
+
+# Get the User model configured for this Django project
+User = get_user_model()
+
+
+# Build a subquery counting the rows of a model that reference the outer row
+def count_subquery(queryset, outer_field):
+    counts = queryset.filter(**{outer_field: OuterRef('pk')}).order_by().values(outer_field).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+# Denormalized counters and the aggregate they must match, for each model
+COUNTERS = {
+    User: {
+        'num_followers': lambda: count_subquery(Follow.objects.filter(follow_status='accepted'), 'following_id'),
+        'num_following': lambda: count_subquery(Follow.objects.filter(follow_status='accepted'), 'follower_id'),
+        'num_posts': lambda: count_subquery(Post.objects.all(), 'user_id'),
+    },
+    Post: {
+        'like_count': lambda: count_subquery(Post.likes.through.objects.all(), 'post_id'),
+        'comment_count': lambda: count_subquery(Comment.objects.all(), 'post_id'),
+    },
+}
+
+
+# Command: python manage.py reconcile_counters [--incremental] [--chunk-size {size}] [--dry-run]
+# Recomputes the denormalized counters (followers, following, posts, likes and comments) from their source tables
+# in keyset-chunked aggregate queries, fixes only the rows that drifted and reports drift statistics.
+# With --incremental, only the rows whose counters changed since the previous incremental run (recorded in the
+# CounterJournal table by sharded_counters) are checked
+class Command(BaseCommand):
+    help = "Recompute denormalized counters from their source tables and repair the rows that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only reconcile the rows whose counters changed since the previous incremental run")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of rows checked per query")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it")
+
+    def handle(self, *args, **options):
+        for model, counters in COUNTERS.items():
+            # Fold the sharded counter slots of hot rows first, the counter fields only hold the full value once folded
+            fold_shards(model)
+
+            journal = self.get_journal(model) if options['incremental'] else None
+            candidate_ids = journal.values('object_id') if journal is not None else None
+            stats = self.reconcile_model(model, counters, candidate_ids, options['chunk_size'], options['dry_run'])
+            if journal is not None and not options['dry_run']:
+                journal.delete()
+
+            self.stdout.write(f"{model.__name__}: checked {stats['checked']} rows, {stats['drifted']} drifted")
+            for field, drift in stats['fields'].items():
+                self.stdout.write(f"  {field}: {drift['rows']} rows off, total drift {drift['total']:+d}, "
+                                  f"max drift {drift['max']}")
+
+    # Get the journal entries of the rows of a model to reconcile.
+    # Entries younger than the journal interval are left for the next run: changes to their rows are not journaled
+    # again until the interval ends, and may not be committed yet
+    def get_journal(self, model):
+        cutoff = timezone.now() - timedelta(seconds=sharded_counters.JOURNAL_INTERVAL)
+        journal = CounterJournal.objects.filter(object_type=model._meta.label_lower, created_at__lte=cutoff)
+        # Bound the entries by id, so entries created while the rows are checked are kept for the next run
+        last_id = journal.aggregate(last_id=Max('id'))['last_id'] or 0
+        return journal.filter(id__lte=last_id)
+
+    def reconcile_model(self, model, counters, candidate_ids, chunk_size, dry_run):
+        stats = {
+            'checked': 0,
+            'drifted': 0,
+            'fields': {field: {'rows': 0, 'total': 0, 'max': 0} for field in counters},
+        }
+
+        rows = model.objects.all()
+        if candidate_ids is not None:
+            rows = rows.filter(id__in=candidate_ids)
+
+        last_id = 0
+        while True:
+            # Keyset pagination over the primary key, so every chunk is an index range scan no matter how far along we are
+            chunk_ids = list(rows.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not chunk_ids:
+                break
+            last_id = chunk_ids[-1]
+            stats['checked'] += len(chunk_ids)
+
+            # Compute the actual value of every counter of the chunk and keep only the rows where one of them differs
+            annotations = {f'actual_{field}': expression() for field, expression in counters.items()}
+            drift_filter = Q()
+            for field in counters:
+                drift_filter |= ~Q(**{field: F(f'actual_{field}')})
+
+            drifted_rows = list(
+                model.objects.filter(id__in=chunk_ids)
+                .annotate(**annotations)
+                .filter(drift_filter)
+                .values('id', *counters, *annotations)
+            )
+
+            fixes = []
+            for row in drifted_rows:
+                changed = {}
+                stored = {field: row[field] for field in counters}
+                for field in counters:
+                    drift = row[f'actual_{field}'] - row[field]
+                    if drift:
+                        changed[field] = row[f'actual_{field}']
+                        field_stats = stats['fields'][field]
+                        field_stats['rows'] += 1
+                        field_stats['total'] += drift
+                        field_stats['max'] = max(field_stats['max'], abs(drift))
+                if changed:
+                    fixes.append((row['id'], stored, changed))
+
+            stats['drifted'] += len(fixes)
+            if fixes and not dry_run:
+                with transaction.atomic():
+                    for row_id, stored, changed in fixes:
+                        # Only overwrite counters that haven't moved since they were read, a counter updated concurrently
+                        # is left alone and checked again on the next run
+                        model.objects.filter(id=row_id, **stored).update(**changed)
+
+        return stats
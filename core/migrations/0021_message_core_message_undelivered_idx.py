@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_alter_user_options_user_core_user_usernam_e8adca_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_delivered', False)), fields=['receiver', 'id'], name='core_message_undelivered_idx'),
+        ),
+    ]
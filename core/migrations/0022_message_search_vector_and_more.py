@@ -0,0 +1,39 @@
+# Generated by Django 4.2.4 on 2026-10-18 23:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_message_core_message_undelivered_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_message_search_idx'),
+        ),
+        # Keep the search document of a message up to date whenever it is created or its content changes
+        migrations.RunSQL(
+            sql='''
+                CREATE TRIGGER core_message_search_vector_update
+                BEFORE INSERT OR UPDATE OF content ON core_message
+                FOR EACH ROW EXECUTE FUNCTION
+                tsvector_update_trigger(search_vector, 'pg_catalog.english', content);
+            ''',
+            reverse_sql='DROP TRIGGER IF EXISTS core_message_search_vector_update ON core_message;',
+        ),
+        # Build the search document of the existing messages
+        migrations.RunSQL(
+            sql="UPDATE core_message SET search_vector = to_tsvector('pg_catalog.english', content);",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
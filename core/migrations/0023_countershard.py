@@ -0,0 +1,27 @@
+# Generated by Django 4.2.4 on 2026-10-18 23:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_message_search_vector_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('field', models.CharField(max_length=50)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('delta', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('object_type', 'object_id', 'field', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.4 on 2026-10-18 23:50
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_usersuggestion'),
+    ]
+
+    operations = [
+        # Trigram operator classes used by the username substring search index
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['username'], name='core_user_username_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_user_username_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('follow_request', 'Follow Request'), ('follow_accept', 'Follow Request Accepted'), ('new_follower', 'New Follower'), ('new_comment', 'New Comment'), ('new_like', 'New Like'), ('new_mention', 'New Mention')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_notification_new_mention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='media_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_picture_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
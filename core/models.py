@@ -1,6 +1,11 @@
 # Import necessary modules
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
+import os
+import re
 import uuid
 
 
@@ -18,6 +23,12 @@ class User(AbstractUser):
                                 error_messages={'unique': ("A user with that username already exists.")})
     # Additional fields for user profiles
     profile_picture = models.ImageField(upload_to=user_profile_picture_upload, null=True, blank=True)  # Profile picture for the user
+    # Storage keys of the resized variants of the profile picture by variant name, generated in the background
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Displayed size of the profile picture and tiny WebP data URI shown while it loads (see image_processing)
+    profile_picture_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_picture_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_picture_placeholder = models.TextField(blank=True, editable=False)
     bio = models.TextField(max_length=300, blank=True)  # Short bio or description for the user
     profile_privacy = models.CharField(max_length=10, choices=[('public', 'Public'), ('private', 'Private')], default='public')  # Privacy setting for user profile
     num_followers = models.PositiveIntegerField(default=0)  # counter to keep track of users num of followers
@@ -27,6 +38,9 @@ class User(AbstractUser):
     class Meta:
         indexes = [
             models.Index(fields=['username']),
+            # Index for username substring searches (LIKE '%query%'), prefix searches use the varchar_pattern_ops
+            # index Django creates for the unique username column
+            GinIndex(fields=['username'], name='core_user_username_trgm_idx', opclasses=['gin_trgm_ops']),
         ]
 
     def save(self, *args, **kwargs):
@@ -57,11 +71,32 @@ def post_media_upload(instance, filename):
     # Construct the path including the unique identifier
     return f'posts/{unique_identifier}/{filename}'
 
+# Storage key of a content-addressed file, derived from the SHA-256 of its content (see Services/media_store)
+def media_content_key(sha256, filename):
+    _, extension = os.path.splitext(filename or '')
+    return f'media/{sha256[:2]}/{sha256}{extension.lower()[:10]}'
+
+
+# Get the SHA-256 of the content-addressed file a storage key belongs to, the file itself or one of its resized
+# variants (ex: media/9f/9f86...15b0_320w.webp). None for other keys
+def media_content_sha256(key):
+    match = MEDIA_CONTENT_KEY_PATTERN.match(key or '')
+    return match.group(1) if match else None
+
+
+MEDIA_CONTENT_KEY_PATTERN = re.compile(r'^media/[0-9a-f]{2}/([0-9a-f]{64})(?![0-9a-f])')
+
 # Model to represent user posts
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_posts')  # ForeignKey user who made the post
     content = models.TextField(max_length=1000)  # Text content of the post
     media = models.ImageField(upload_to=post_media_upload, null=False, blank=False)
+    # Storage keys of the resized variants of the media by variant name, generated in the background
+    media_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Displayed size of the media and tiny WebP data URI shown while it loads (see image_processing)
+    media_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    media_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    media_placeholder = models.TextField(blank=True, editable=False)
     visibility = models.CharField(max_length=10, choices=[('public', 'Public'), ('private', 'Private')], default='public')  # Visibility setting for the post
     hashtags = models.ManyToManyField(Hashtag, blank=True)  # Hashtags or tags associated with the post
     created_at = models.DateTimeField(auto_now_add=True)
@@ -128,6 +163,8 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_delivered = models.BooleanField(default=False)  # Track if the message has been delivered
     is_read = models.BooleanField(default=False)  # Track if the message has been read
+    # Full-text search document of the message content, kept up to date by a database trigger on insert and update
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return f"{self.sender.username} to {self.receiver.username} - {self.created_at}"
@@ -136,6 +173,9 @@ class Message(models.Model):
         indexes = [
             models.Index(fields=['sender']),
             models.Index(fields=['receiver']),
+            # Partial index over each user's queue of undelivered messages
+            models.Index(fields=['receiver', 'id'], condition=models.Q(is_delivered=False), name='core_message_undelivered_idx'),
+            GinIndex(fields=['search_vector'], name='core_message_search_idx'),  # Index for full-text message search
         ]
         ordering = ['-created_at']
 
@@ -148,6 +188,7 @@ class Notification(models.Model):
         ('new_follower', 'New Follower'),
         ('new_comment', 'New Comment'),
         ('new_like', 'New Like'),
+        ('new_mention', 'New Mention'),
     )
 
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -164,4 +205,116 @@ class Notification(models.Model):
         indexes = [
             models.Index(fields=['recipient']),  # Index for recipient field
             models.Index(fields=['sender', 'notification_type']),  # Composite index
-        ]
\ No newline at end of file
+        ]
+
+# Model to represent one slot of a sharded counter.
+# Counters of hot rows (ex: the like count of a viral post) are incremented on one of several slots instead of the
+# row itself, so concurrent updates don't all wait on the same row lock. The value of the counter is the counter
+# field on the row plus the sum of its slots, until the slots are folded back into the row
+class CounterShard(models.Model):
+    object_type = models.CharField(max_length=50)  # Label of the model the counter belongs to (ex: "core.post")
+    object_id = models.BigIntegerField()  # Primary key of the row the counter belongs to
+    field = models.CharField(max_length=50)  # Name of the counter field on the row
+    shard = models.PositiveSmallIntegerField()
+    delta = models.BigIntegerField(default=0)  # Change to apply to the counter field, can be negative
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} {self.field} [{self.shard}]: {self.delta:+d}"
+
+    class Meta:
+        unique_together = ('object_type', 'object_id', 'field', 'shard')
+
+
+# Model to represent a row whose counters changed, journaled by sharded_counters for incremental runs of the
+# reconcile_counters command. Consumed (deleted) by reconcile_counters once the row is checked
+class CounterJournal(models.Model):
+    object_type = models.CharField(max_length=50)  # Label of the model of the row (ex: "core.post")
+    object_id = models.BigIntegerField()  # Primary key of the row
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} at {self.created_at}"
+
+
+# Model to represent a precomputed "who to follow" suggestion for a user, built by the build_user_suggestions command
+class UserSuggestion(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='suggestions')  # ForeignKey User the suggestion is for
+    suggested_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='suggested_to')  # ForeignKey User being suggested
+    score = models.FloatField()  # Relevance of the suggestion, higher is better
+    mutual_count = models.PositiveIntegerField(default=0)  # Number of users followed by the user that follow the suggested user
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.suggested_user.username} suggested to {self.user.username}"
+
+    class Meta:
+        unique_together = ('user', 'suggested_user')
+        indexes = [
+            models.Index(fields=['user', '-score']),  # Index for serving a user's suggestions by relevance
+        ]
+
+
+# Model to represent a direct upload of an image to the storage bucket through a presigned URL.
+# The client uploads the file straight to the bucket, then creates its post or updates its profile with the id of
+# the session, which verifies the uploaded object and marks the session as completed so it can only be used once
+class UploadSession(models.Model):
+    PURPOSE_CHOICES = (
+        ('post_media', 'Post Media'),
+        ('profile_picture', 'Profile Picture'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')  # ForeignKey User uploading the file
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
+    key = models.CharField(max_length=100, unique=True)  # Storage key the file is uploaded to, stored as is in the image field
+    content_type = models.CharField(max_length=50)
+    size = models.PositiveIntegerField()  # Size of the file in bytes declared by the client
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    sha256 = models.CharField(max_length=64, blank=True)  # SHA-256 of the file declared by the client, checked by the storage on upload
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()  # The presigned URL and the session stop being valid after this time
+
+    def __str__(self):
+        return f"{self.purpose} upload by {self.user} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),  # Index for cleaning up expired sessions
+        ]
+
+
+# Model to represent a stored image file, identified by the SHA-256 of its content.
+# Uploading an image that is already stored (ex: a repost, the same profile picture uploaded again) references the
+# stored file instead of storing a new copy, and the file is only deleted once no image field references it anymore
+class MediaObject(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=100, unique=True)  # Storage key of the file, as saved in the image fields
+    size = models.PositiveBigIntegerField()  # Size of the file in bytes
+    ref_count = models.PositiveIntegerField(default=1)  # Number of image fields referencing the file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.ref_count} references)"
+
+
+# Model to represent a storage object waiting to be deleted.
+# Files that are no longer used (ex: the media of a deleted post) are queued in the same transaction as the change
+# that orphaned them, and deleted from the storage in batches by the process_storage_deletions command
+class StorageDeletion(models.Model):
+    key = models.CharField(max_length=255)  # Storage key of the file to delete
+    attempts = models.PositiveSmallIntegerField(default=0)  # Number of failed deletion attempts
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Delete {self.key} ({self.attempts} attempts)"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at']),  # Index for fetching the deletions that are due
+        ]
@@ -1,6 +1,11 @@
 from rest_framework import serializers
-from .models import Hashtag, Post, Comment, Message, Notification
+from django.db import models
+from .models import Hashtag, Post, Comment, Message, Notification, UploadSession
 from django.contrib.auth import get_user_model
+from .Services.follow_graph import ViewerFollowState
+from .Services import direct_uploads, image_processing, media_store, sharded_counters
+from .Services.image_variants import variant_url, variant_urls, POST_MEDIA, PROFILE_PICTURE
+from .Services.media_urls import media_url
 
 
 # Get the User model configured for this Django project
@@ -11,15 +16,89 @@ User = get_user_model()
 # Python data will be rendered into JSON for use in API responses (serialization)
 # JSON data will be converted to python data from API requests to be saved in Django model instances. (deserialization)
 
+
+# Verify a direct upload session of the requesting user (see upload_views), returning the session to put in the
+# image field of the validated data (see complete_image) and the width and height of the image
+def verify_direct_upload(serializer, upload_id, purpose, field_name):
+    request = serializer.context.get('request')
+    try:
+        return direct_uploads.verify_upload(upload_id, request.user if request else None, purpose)
+    except direct_uploads.UploadError as e:
+        raise serializers.ValidationError({field_name: [str(e)]})
+
+
+# Store the image validated for an image field of a serializer (a file uploaded with the request or a direct upload
+# session), replacing it with its storage key in the validated data. Called by the views in the transaction saving
+# the image field, so the reference taken on the stored file and the completed session roll back with a failed save
+def complete_image(serializer, field, field_name):
+    image = serializer.validated_data.get(field)
+    if isinstance(image, UploadSession):
+        try:
+            serializer.validated_data[field] = direct_uploads.complete_upload(image)
+        except direct_uploads.UploadError as e:
+            raise serializers.ValidationError({field_name: [str(e)]})
+    elif image:
+        # An image that is already stored is not uploaded again, see media_store
+        serializer.validated_data[field] = media_store.store(image)
+
+
+# Get a counter of an instance, from the counter values preloaded in the serializer context (see PostListSerializer
+# and async_views) or from the row and its counter slots
+def counter_value(serializer, instance, field):
+    counter_values = serializer.context.get('counter_values')
+    if counter_values is not None and (instance.pk, field) in counter_values:
+        return counter_values[(instance.pk, field)]
+    return sharded_counters.get(instance, field)
+
+
+# Read the width and height of an image uploaded with the request from its header, the file is stored by
+# complete_image
+def read_image_size(file):
+    width, height = image_processing.read_size(file)
+    file.seek(0)
+    return width, height
+
+
+# Image field representing the image with the URL built by media_urls instead of going through the storage
+class MediaImageField(serializers.ImageField):
+    def to_representation(self, value):
+        url = media_url(value.name if value else None)
+        request = self.context.get('request')
+        if url is not None and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+# Model serializer field mapping using MediaImageField for the image fields of the models
+MEDIA_FIELD_MAPPING = {**serializers.ModelSerializer.serializer_field_mapping, models.ImageField: MediaImageField}
+
+
 class UserSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = MEDIA_FIELD_MAPPING
+
+    # Id of a direct upload session to use as the profile picture instead of a file sent with the request
+    profile_picture_upload_id = serializers.UUIDField(write_only=True, required=False)
+
     class Meta:
         model = User
         fields = '__all__'
 
+    def validate(self, attrs):
+        upload_id = attrs.pop('profile_picture_upload_id', None)
+        if upload_id is not None:
+            attrs['profile_picture'], attrs['profile_picture_width'], attrs['profile_picture_height'] = verify_direct_upload(
+                self, upload_id, direct_uploads.PROFILE_PICTURE, 'profile_picture_upload_id',
+            )
+        elif attrs.get('profile_picture'):
+            attrs['profile_picture_width'], attrs['profile_picture_height'] = read_image_size(attrs['profile_picture'])
+        return attrs
+
     # Exclude the password field from the API response
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data.pop('password')  # Remove the password field from the serialized data
+        # Replace the storage keys of the profile picture variants with their URLs
+        data['profile_picture_variants'] = variant_urls(instance, PROFILE_PICTURE)
         return data
 
 
@@ -29,7 +108,19 @@ class HashtagSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+# List serializer of posts loading the counters of every post of the list at once (one cache request, and one query
+# for the posts whose counter slots aren't cached) instead of reading them post by post
+class PostListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if 'counter_values' not in self.context:
+            self.context['counter_values'] = sharded_counters.get_many(posts, ('like_count', 'comment_count'))
+        return super().to_representation(posts)
+
+
 class PostSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = MEDIA_FIELD_MAPPING
+
     # Custom field for the user representation of the author of the post
     user = serializers.SerializerMethodField()
     # Function to customize the representation of the author of the post
@@ -39,7 +130,7 @@ class PostSerializer(serializers.ModelSerializer):
             return {
                 'id': user.id,
                 'username': user.username,
-                'profile_picture': user.profile_picture.url if user.profile_picture else None
+                'profile_picture': variant_url(user, PROFILE_PICTURE, 'thumbnail')
             }
         return None
 
@@ -47,6 +138,10 @@ class PostSerializer(serializers.ModelSerializer):
     hashtags = serializers.SerializerMethodField()
     # Function to customize the representation of the hashtags associated with a post
     def get_hashtags(self, post):
+        # Hashtags preloaded for a whole page of posts in the context (see async_views)
+        hashtags_by_post = self.context.get('hashtags_by_post')
+        if hashtags_by_post is not None:
+            return hashtags_by_post.get(post.id, [])
         return [{'id': hashtag.id, 'name': hashtag.name} for hashtag in post.hashtags.all()]
 
     # Custom field to indicate if the requesting user has liked the post
@@ -54,21 +149,64 @@ class PostSerializer(serializers.ModelSerializer):
     # Function that checks if a requesting user liked the post that is being retrieved
     # This will be used on the front end to provide indication to users if they liked a post or not
     def get_liked_by_user(self, post):
+        # Ids of the posts of the page liked by the requesting user, preloaded in the context (see async_views)
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is not None:
+            return post.id in liked_post_ids
         if 'request' in self.context:
             user = self.context['request'].user
             if user.is_authenticated:
                 return post.likes.filter(id=user.id).exists()
         return False
 
+    # Like and comment counts, including the counter slots of hot posts
+    like_count = serializers.SerializerMethodField()
+    comment_count = serializers.SerializerMethodField()
+
+    def get_like_count(self, post):
+        return counter_value(self, post, 'like_count')
+
+    def get_comment_count(self, post):
+        return counter_value(self, post, 'comment_count')
+
+    # URLs of the resized variants of the media (ex: "thumbnail", "medium"), empty until they are generated
+    media_variants = serializers.SerializerMethodField()
+
+    def get_media_variants(self, post):
+        return variant_urls(post, POST_MEDIA)
+
+    # Id of a direct upload session to use as the media instead of a file sent with the request
+    upload_id = serializers.UUIDField(write_only=True, required=False)
+
+    # A new post needs either a media file or a completed upload
+    def validate(self, attrs):
+        upload_id = attrs.pop('upload_id', None)
+        if upload_id is not None:
+            attrs['media'], attrs['media_width'], attrs['media_height'] = verify_direct_upload(self, upload_id, direct_uploads.POST_MEDIA, 'upload_id')
+        elif attrs.get('media'):
+            attrs['media_width'], attrs['media_height'] = read_image_size(attrs['media'])
+        elif self.instance is None:
+            raise serializers.ValidationError({'media': ["No file was submitted."]})
+        return attrs
+
     class Meta:
         model = Post
-        fields = ['id', 'user', 'content', 'media', 'visibility', 'hashtags', 'created_at', 'updated_at', 'like_count', 'comment_count', 'liked_by_user']
+        fields = ['id', 'user', 'content', 'media', 'media_variants', 'media_width', 'media_height', 'media_placeholder', 'upload_id', 'visibility', 'hashtags', 'created_at', 'updated_at', 'like_count', 'comment_count', 'liked_by_user']
+        extra_kwargs = {'media': {'required': False}}
+        list_serializer_class = PostListSerializer
 
 
 class PostSerializerMinimal(PostSerializer):
+    # Post grids only need the thumbnail of the media, with its size and placeholder to lay out the grid before it loads
+    media = serializers.SerializerMethodField()
+
+    def get_media(self, post):
+        return variant_url(post, POST_MEDIA, 'thumbnail')
+
     class Meta:
         model = Post
-        fields = ['id', 'media', 'like_count', 'comment_count']
+        fields = ['id', 'media', 'media_width', 'media_height', 'media_placeholder', 'like_count', 'comment_count']
+        list_serializer_class = PostListSerializer
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -103,7 +241,7 @@ class CommentSerializer(serializers.ModelSerializer):
             return {
                 'id': user.id,
                 'username': user.username,
-                'profile_picture': user.profile_picture.url if user.profile_picture else None
+                'profile_picture': variant_url(user, PROFILE_PICTURE, 'thumbnail')
             }
         return None
 
@@ -128,14 +266,19 @@ class FollowSerializer(serializers.ModelSerializer):
             requesting_user = self.context['request'].user
             # Check if there is an authenticated requesting user
             if requesting_user.is_authenticated:
-                if requesting_user == following_user:
-                    return "self"
-                follow_instance = requesting_user.following.filter(following_id=following_user.id).first()
-                if follow_instance:
-                    return follow_instance.follow_status  # return the follow status
+                # Load the requesting user's follow relationships once and reuse them for every user being serialized
+                if getattr(self, '_viewer_follow_state', None) is None:
+                    self._viewer_follow_state = ViewerFollowState(requesting_user.id)
+                return self._viewer_follow_state.status_of(following_user.id)
         # If we do not follow the user
         return False
 
+    # Profile picture thumbnail of the user
+    profile_picture = serializers.SerializerMethodField()
+
+    def get_profile_picture(self, user):
+        return variant_url(user, PROFILE_PICTURE, 'thumbnail')
+
     class Meta:
         model = User
         fields = ['id', 'username', 'profile_picture', 'requesting_user_follow_status']
@@ -147,10 +290,24 @@ class FollowSerializerMinimal(FollowSerializer):
         fields = ['id', 'username', 'profile_picture']
 
 
+class UserSuggestionSerializer(FollowSerializerMinimal):
+    # Number of users followed by the requesting user that follow the suggested user
+    mutual_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'profile_picture', 'mutual_count']
+
+
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = '__all__'
+        exclude = ['search_vector']
+
+
+class MessageSearchSerializer(MessageSerializer):
+    # Relevance of the message to the search query
+    rank = serializers.FloatField(read_only=True)
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -168,7 +325,7 @@ class NotificationSerializer(serializers.ModelSerializer):
             return {
                 'id': sender.id,
                 'username': sender.username,
-                'profile_picture': sender.profile_picture.url if sender.profile_picture else None
+                'profile_picture': variant_url(sender, PROFILE_PICTURE, 'thumbnail')
             }
         return None
 
@@ -178,7 +335,7 @@ class NotificationSerializer(serializers.ModelSerializer):
         if post:
             return {
                 'id': post.id,
-                'media': post.media.url if post.media else None,
+                'media': variant_url(post, POST_MEDIA, 'thumbnail'),
             }
         return None
 
@@ -2,21 +2,39 @@
 from django.urls import path, include
 
 urlpatterns = [
+    # Include the URLs for the async versions of the hot read API views
+    path('', include('core.API_URLs.async_urls')),
+
     # Include the URLs for comment-related API views
     path('', include('core.API_URLs.comment_urls')),
 
     # Include the URLs for follow-related API views
     path('', include('core.API_URLs.follow_urls')),
 
+    # Include the URLs for the on-demand image resizing API views
+    path('', include('core.API_URLs.image_urls')),
+
     # Include the URLs for message-related API views
     path('', include('core.API_URLs.message_urls')),
 
+    # Include the URLs for the runtime metrics API views
+    path('', include('core.API_URLs.metrics_urls')),
+
     # Include the URLs for notification-related API views
     path('', include('core.API_URLs.notification_urls')),
 
+    # Include the URLs for presence-related API views
+    path('', include('core.API_URLs.presence_urls')),
+
     # Include the URLs for post-related API views
     path('', include('core.API_URLs.post_urls')),
 
+    # Include the URLs for suggestion-related API views
+    path('', include('core.API_URLs.suggestion_urls')),
+
+    # Include the URLs for direct upload API views
+    path('', include('core.API_URLs.upload_urls')),
+
     # Include the URLs for user-related API views
     path('', include('core.API_URLs.user_urls')),
 ]
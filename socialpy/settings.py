@@ -64,6 +64,7 @@ INSTALLED_APPS = [
     'corsheaders',
 
     # Django
+    'django.contrib.postgres',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -80,6 +81,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.DB_Routers.replica_router.replica_routing_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -111,17 +113,51 @@ ASGI_APPLICATION = 'socialpy.asgi.application'
 # ---------- DATABASE ----------
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connections are taken from a pool kept by each worker process (see core/DB_Backends/pooled_postgresql) and given
+# back at the end of every request, set DB_POOL_ENABLED to False to open a connection per request instead.
+# DB_POOL_MAX_SIZE is per process, keep it at least at the number of threads using the database in a worker (ex: the
+# thread executor of database_sync_to_async) and keep workers * DB_POOL_MAX_SIZE under the server's max_connections
+DB_POOL_ENABLED = config('DB_POOL_ENABLED', default=True, cast=bool)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.DB_Backends.pooled_postgresql' if DB_POOL_ENABLED else 'django.db.backends.postgresql',
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT', default=''),  # Default to an empty string if not specified
+        'CONN_MAX_AGE': 0,  # Connections go back to the pool at the end of every request
+        'POOL': {
+            'MIN_SIZE': config('DB_POOL_MIN_SIZE', default=0, cast=int),
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=10, cast=float),
+            'HEALTH_CHECK_INTERVAL': config('DB_POOL_HEALTH_CHECK_INTERVAL', default=30, cast=float),
+            'MAX_IDLE': config('DB_POOL_MAX_IDLE', default=5 * 60, cast=float),
+            'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', default=60 * 60, cast=float),
+        },
     }
 }
 
+# Read replicas, one database alias (replica_1, replica_2, ...) per host of DB_REPLICA_HOSTS (comma separated).
+# Reads of GET requests go to the replicas (see core/DB_Routers/replica_router). The other settings default to the
+# primary's, DB_REPLICA_NAME lets a second database of the same server act as a replica in development
+DB_REPLICA_HOSTS = [host.strip() for host in config('DB_REPLICA_HOSTS', default='').split(',') if host.strip()]
+for replica_index, replica_host in enumerate(DB_REPLICA_HOSTS, start=1):
+    DATABASES[f'replica_{replica_index}'] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        'HOST': replica_host,
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},  # Tests read the test database through the replica aliases
+    }
+DATABASE_REPLICAS = [f'replica_{replica_index}' for replica_index in range(1, len(DB_REPLICA_HOSTS) + 1)]
+DATABASE_ROUTERS = ['core.DB_Routers.replica_router.ReplicaRouter']
+# Seconds a client's reads stay on the primary after it writes, so it reads its own writes despite replication lag
+DB_REPLICA_STICKY_SECONDS = config('DB_REPLICA_STICKY_SECONDS', default=10, cast=int)
+
 # ---------- DJANGO REST FRAMEWORK ----------
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -144,8 +180,11 @@ AWS_REGION_NAME = config('AWS_REGION_NAME')
 # Set the S3 bucket name you created earlier
 AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME')
 
-# Set the S3 URL format
-AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
+# Endpoint of an S3 compatible storage to use instead of AWS S3 (ex: a local MinIO or moto server in development)
+AWS_S3_ENDPOINT_URL = config('AWS_S3_ENDPOINT_URL', default=None)
+
+# Set the S3 URL format (files are served from the custom endpoint when one is set)
+AWS_S3_CUSTOM_DOMAIN = None if AWS_S3_ENDPOINT_URL else f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
 # Set the S3 file URL access
 AWS_DEFAULT_ACL = None
@@ -158,7 +197,7 @@ STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
 # To serve media files directly from S3
-MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/media/'
+MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/' if AWS_S3_ENDPOINT_URL else f'https://{AWS_S3_CUSTOM_DOMAIN}/media/'
 
 # To serve static files directly from S3
 # STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/static/'
@@ -183,10 +222,89 @@ CHANNEL_LAYERS = {
         "CONFIG": {
             # Use the same Redis location as for caching
             "hosts": [("127.0.0.1", 6379)],
+            # Bound the number of events waiting in a single channel, so a stalled consumer can't grow Redis without limit
+            "capacity": 300,
+            # Seconds an undelivered event waits in a channel before it is discarded
+            "expiry": 60,
         },
     },
 }
 
+# ---------- REAL-TIME CONNECTIONS ----------
+
+# Seconds a user stays online without a heartbeat from any of their WebSocket connections
+PRESENCE_TTL_SECONDS = 60
+# Minimum number of seconds between "is typing" events relayed from a single connection
+TYPING_THROTTLE_SECONDS = 3
+# Maximum number of conversation rooms a multiplexed user connection can be subscribed to at once
+WEBSOCKET_MAX_CONVERSATION_SUBSCRIPTIONS = 50
+# Maximum number of frames not yet acknowledged by the client (waiting to be sent, or sent to a client that opted in to
+# acknowledgements, see buffered_consumer) on a single connection before it is disconnected as a slow consumer
+WEBSOCKET_MAX_OUTBOUND_QUEUE = 200
+# Maximum number of seconds a frame can go unacknowledged (or unsent, for clients that don't acknowledge frames) before
+# the connection is disconnected as a slow consumer
+WEBSOCKET_MAX_OUTBOUND_LAG_SECONDS = 30
+# Maximum number of frames sent to a client acknowledging frames without being acknowledged, further frames wait in
+# the outbound queue
+WEBSOCKET_SEND_WINDOW = 50
+
+# ---------- SHARDED COUNTERS ----------
+
+# Number of counter slots used for the counters of a hot row
+COUNTER_SHARDS = 16
+# Number of updates to a single counter within COUNTER_HOT_WINDOW_SECONDS above which it switches to sharded slots
+COUNTER_HOT_THRESHOLD = 20
+COUNTER_HOT_WINDOW_SECONDS = 10
+# Seconds the summed value of a sharded counter is cached for reads
+COUNTER_READ_CACHE_SECONDS = 5
+# Seconds during which further changes to the counters of a row are not journaled again for reconcile_counters
+COUNTER_JOURNAL_INTERVAL_SECONDS = 60
+
+
+# ---------- GRAPH SNAPSHOTS ----------
+
+# Directory the export_graph_snapshot command writes the follow and like graph snapshots to
+GRAPH_SNAPSHOT_DIR = config('GRAPH_SNAPSHOT_DIR', default=os.path.join(BASE_DIR, 'graph_snapshots'))
+
+
+# ---------- DIRECT UPLOADS ----------
+
+# Seconds the presigned upload URL of an upload session stays valid
+UPLOAD_SESSION_EXPIRY_SECONDS = 15 * 60
+# Largest image that can be uploaded through an upload session, in bytes
+UPLOAD_MAX_SIZE_BYTES = 10 * 1024 * 1024
+
+
+# ---------- MEDIA URLS ----------
+
+# Base URL of a CDN serving the media files publicly, media URLs are built from it instead of the storage's URLs
+MEDIA_CDN_URL = config('MEDIA_CDN_URL', default=None)
+# Number of signed media URLs cached by each process when the storage signs its URLs
+MEDIA_SIGNED_URL_CACHE_SIZE = 10000
+
+
+# ---------- IMAGE RESIZING ----------
+
+# Directory of the disk cache of images resized on demand, and its size limit in bytes
+IMAGE_RESIZE_CACHE_DIR = config('IMAGE_RESIZE_CACHE_DIR', default=os.path.join(BASE_DIR, 'image_cache'))
+IMAGE_RESIZE_CACHE_MAX_BYTES = config('IMAGE_RESIZE_CACHE_MAX_BYTES', default=1024 * 1024 * 1024, cast=int)
+# Widths images can be resized to on demand
+IMAGE_RESIZE_WIDTHS = (160, 320, 640, 1080)
+# Seconds clients and CDNs can reuse a resized image before revalidating it
+IMAGE_RESIZE_MAX_AGE = 60 * 60 * 24
+# Internal location of IMAGE_RESIZE_CACHE_DIR in the front web server, to send cached images with X-Accel-Redirect
+IMAGE_RESIZE_ACCEL_REDIRECT_PREFIX = config('IMAGE_RESIZE_ACCEL_REDIRECT_PREFIX', default=None)
+
+
+# ---------- STORAGE DELETIONS ----------
+
+# Number of queued storage objects deleted per multi-object delete request (at most 1000)
+STORAGE_DELETION_BATCH_SIZE = 1000
+# Number of failed attempts after which a queued deletion is no longer retried
+STORAGE_DELETION_MAX_ATTEMPTS = 8
+# Seconds before the first retry of a failed deletion, doubled after every failed attempt
+STORAGE_DELETION_RETRY_SECONDS = 60
+
 
 # ---------- PASSWORD VAlIDATION ----------
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -231,3 +349,4 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+